@@ -7,6 +7,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -134,6 +135,49 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# How stream_track sends audio once access has been checked (see
+# player/streaming.py). 'django' serves it from the worker; 'x-accel' hands
+# the request to nginx, which needs an internal location over MEDIA_ROOT:
+#     location /protected-media/ { internal; alias /path/to/media/; }
+# 'x-sendfile' does the same for Apache/lighttpd.
+MEDIA_STREAM_BACKEND = os.environ.get('MEDIA_STREAM_BACKEND', 'django')
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# Store track audio and icons by content hash, once per distinct file, under
+# MEDIA_ROOT/blobs/ (see player/media_store.py). Files already stored keep
+# their names. Run collect_media_blobs periodically when this is on.
+MEDIA_CONTENT_ADDRESSED = os.environ.get('MEDIA_CONTENT_ADDRESSED') == '1'
+if MEDIA_CONTENT_ADDRESSED:
+    # Hash uploads as they arrive, so storing them needs no second read.
+    FILE_UPLOAD_HANDLERS = [
+        'player.media_store.HashingMemoryFileUploadHandler',
+        'player.media_store.HashingTemporaryFileUploadHandler',
+    ]
+
+# Write-behind for playback positions (see player/playback_buffer.py). When
+# non-zero, live position heartbeats are buffered in a SQLite file shared by
+# the web workers on this host and written to the database in bulk every this
+# many seconds (and when a worker exits). 0 writes every sample through.
+PLAYBACK_FLUSH_INTERVAL = float(os.environ.get('PLAYBACK_FLUSH_INTERVAL', 0))
+PLAYBACK_BUFFER_PATH = os.environ.get(
+    'PLAYBACK_BUFFER_PATH', os.path.join(tempfile.gettempdir(), 'listener_library_playback.sqlite3')
+)
+
+# Page header data, access grants and stream descriptors (player/header_cache.py,
+# access.py, media_cache.py) are invalidated by whichever process writes, web
+# or worker, so every service shares one memcached (CACHE_LOCATION, host:port;
+# docker-compose.yml runs it on localhost). Tests get a dummy cache so nothing
+# leaks between them; tests of caching override it.
+if 'test' in sys.argv:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION', '127.0.0.1:11211'),
+        }
+    }
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
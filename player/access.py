@@ -0,0 +1,81 @@
+"""Per-user cache of which tracks and playlists a user may play.
+
+A user may play the tracks they own and the tracks of any playlist shared
+with them (Playlist.accessors), and view the playlists they own or are an
+accessor of. Working that out in SQL is an OR across a three-table join
+with a DISTINCT, too much for every stream request and playback heartbeat,
+so the answer is kept as two sets of ids, cached per user and built in a
+single query (``access_grants``). Checks against it (``can_access_track``,
+``can_access_playlist``) are set lookups.
+
+The sets are a player.versioned_cache entry. Writes that change what
+someone may reach (receivers in player.models) drop the entry of each user
+affected (``invalidate_access``) once their transaction commits.
+bulk_create sends no signals, so code that bulk creates tracks or playlist
+items calls ``invalidate_access`` itself.
+"""
+from collections import namedtuple
+
+from django.db import models
+
+from . import versioned_cache
+
+NAMESPACE = 'player:access'
+# Backstop for a change nothing invalidates.
+ACCESS_CACHE_TIMEOUT = 3600
+
+TRACK = 't'
+PLAYLIST = 'p'
+
+AccessGrants = namedtuple('AccessGrants', 'track_ids playlist_ids')
+
+
+def invalidate_access(user_ids):
+    """Drop these users' cached grants when the current transaction commits."""
+    versioned_cache.invalidate(NAMESPACE, user_ids)
+
+
+def _build_grants(user_id):
+    from .models import Playlist, PlaylistItem, Track
+    shared = Playlist.accessors.through.objects.filter(user_id=user_id)
+    # One round trip: (kind, id) rows for owned tracks, tracks in shared
+    # playlists, owned playlists and shared playlists.
+    rows = Track.objects.filter(owner_id=user_id).order_by().annotate(
+        kind=models.Value(TRACK),
+    ).values_list('kind', 'id').union(
+        PlaylistItem.objects.filter(playlist_id__in=shared.values('playlist_id')).order_by().annotate(
+            kind=models.Value(TRACK),
+        ).values_list('kind', 'track_id'),
+        Playlist.objects.filter(owner_id=user_id).order_by().annotate(
+            kind=models.Value(PLAYLIST),
+        ).values_list('kind', 'id'),
+        shared.order_by().annotate(kind=models.Value(PLAYLIST)).values_list('kind', 'playlist_id'),
+        all=True,
+    )
+    track_ids, playlist_ids = set(), set()
+    for kind, pk in rows:
+        (track_ids if kind == TRACK else playlist_ids).add(pk)
+    return AccessGrants(frozenset(track_ids), frozenset(playlist_ids))
+
+
+def access_grants(user):
+    """AccessGrants (frozensets of track and playlist ids) for ``user``, from the cache if possible."""
+    if not user.is_authenticated:
+        return AccessGrants(frozenset(), frozenset())
+    return versioned_cache.cached(NAMESPACE, user.pk, lambda: _build_grants(user.pk), ACCESS_CACHE_TIMEOUT)
+
+
+def can_access_track(user, track_id):
+    return track_id in access_grants(user).track_ids
+
+
+def can_access_playlist(user, playlist_id):
+    return playlist_id in access_grants(user).playlist_ids
+
+
+def playlist_audience(playlist_ids):
+    """Ids of the users given access to any of these playlists (not their owners)."""
+    from .models import Playlist
+    return Playlist.accessors.through.objects.filter(
+        playlist_id__in=playlist_ids,
+    ).values_list('user_id', flat=True)
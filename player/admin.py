@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import (
     UserProfile, Track, UserPlaybackState, PodcastProgress, Bookmark,
-    Transcript, UserTrackLastPlayed, Playlist, PlaylistItem,
+    Transcript, UserTrackLastPlayed, Playlist, PlaylistItem, MediaBlob, TrackRendition,
 )
 
 
@@ -30,10 +30,32 @@ class PlaylistAdmin(admin.ModelAdmin):
     track_count.short_description = 'Tracks'
 
 
+@admin.register(UserProfile)
+class UserProfileAdmin(admin.ModelAdmin):
+    list_display = ('user', 'storage_limit_gb', 'storage_used_bytes', 'storage_reserved_bytes')
+    # Maintained by track writes; fix drift with reconcile_storage_usage.
+    readonly_fields = ('storage_used_bytes', 'storage_reserved_bytes')
+
+
 admin.site.register(Track)
 admin.site.register(UserPlaybackState)
 admin.site.register(PodcastProgress)
 admin.site.register(Bookmark)
-admin.site.register(UserProfile)
 admin.site.register(Transcript)
 admin.site.register(UserTrackLastPlayed)
+
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'refcount', 'created_at')
+    # Maintained by track writes; fix drift with collect_media_blobs.
+    readonly_fields = ('name', 'sha256', 'size', 'refcount')
+
+
+@admin.register(TrackRendition)
+class TrackRenditionAdmin(admin.ModelAdmin):
+    list_display = ('track', 'profile', 'status', 'file_size', 'attempts', 'created_at')
+    list_filter = ('status', 'profile')
+    raw_id_fields = ('track',)
+    # Written by run_media_worker.
+    readonly_fields = ('source_name', 'file_size', 'attempts', 'error_message')
@@ -1,9 +1,38 @@
-from .models import UserPlaybackState, Bookmark
+"""Template context shared by every page: the resumable playback state and bookmarks.
+
+This runs for every template rendered with a request, partials included, so
+nothing is fetched up front: each value is a lazy object that loads on first
+use, at most once per request, from the per-user header cache
+(player.header_cache). The cache holds the saved playback state; positions
+still in the write-behind buffer are applied on top of it when read.
+"""
+from django.utils.functional import SimpleLazyObject
+
+from .header_cache import BOOKMARKS, PLAYBACK, cached_header
+from .models import Bookmark
 from .forms import BookmarkForm
+from .playback import saved_playback_state, with_buffered_state
+
+
+def _request_header(request):
+    """The request's lazy header values, shared by every render in the request."""
+    header = getattr(request, '_player_header', None)
+    if header is None:
+        user = request.user
+        header = request._player_header = {
+            'playback_state': SimpleLazyObject(lambda: with_buffered_state(
+                user, cached_header(PLAYBACK, user.pk, lambda: saved_playback_state(user))
+            )),
+            'bookmarks': SimpleLazyObject(
+                lambda: cached_header(BOOKMARKS, user.pk, lambda: list(
+                    Bookmark.objects.filter(user=user).select_related('track').order_by('name')
+                ))
+            ),
+        }
+    return header
+
 
 def global_context(request):
     if request.user.is_authenticated:
-        state = UserPlaybackState.objects.select_related('track', 'playlist').get(user=request.user) if UserPlaybackState.objects.filter(user=request.user).exists() else None
-        bookmarks = Bookmark.objects.filter(user=request.user).order_by('name')
-        return {'playback_state': state, 'bookmarks': bookmarks, 'bookmark_form': BookmarkForm()}
+        return {**_request_header(request), 'bookmark_form': BookmarkForm()}
     return {'playback_state': None, 'bookmarks': [], 'bookmark_form': BookmarkForm()}
@@ -0,0 +1,136 @@
+"""Finding the duration of uploaded tracks that upload-time metadata missed.
+
+Uploads read the duration with mutagen as they are saved. Files it cannot
+read are left with duration 0 and picked up by the fix_track_durations
+worker, which claims them in batches, probes them in a thread pool and
+backs off (then gives up) on files that cannot be probed at all.
+"""
+import os
+import subprocess
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+from mutagen import File as MutagenFile
+
+from .media_cache import refresh_track_media
+from .models import Track, invalidate_headers_showing
+
+# A failed probe is retried after RETRY_BACKOFF * 2**(attempts - 1), and a
+# track is quarantined (never retried) after MAX_ATTEMPTS failures.
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = timedelta(minutes=5)
+# How long a claimed batch is reserved for the worker that claimed it.
+CLAIM_LEASE = timedelta(minutes=10)
+
+
+def tracks_needing_duration():
+    return Track.objects.filter(
+        duration=0, file_size__gt=0, duration_attempts__lt=MAX_ATTEMPTS,
+    ).filter(Q(duration_retry_at__isnull=True) | Q(duration_retry_at__lte=timezone.now()))
+
+
+def claim_tracks(batch_size):
+    """Reserve up to ``batch_size`` tracks for probing and return them.
+
+    The reservation is a duration_retry_at lease; its exact value doubles as
+    the claim token, so concurrent workers never get the same track.
+    """
+    ids = list(tracks_needing_duration().order_by('id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    lease = timezone.now() + CLAIM_LEASE
+    tracks_needing_duration().filter(pk__in=ids).update(duration_retry_at=lease)
+    return list(Track.objects.filter(pk__in=ids, duration_retry_at=lease).order_by('id'))
+
+
+def _mutagen_duration(file_path):
+    audio = MutagenFile(file_path)
+    return audio.info.length if audio and audio.info.length else 0
+
+
+def _ffprobe_format_duration(file_path):
+    output = subprocess.check_output(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+         '-of', 'default=noprint_wrappers=1:nokey=1', file_path],
+        stderr=subprocess.DEVNULL,
+    )
+    return float(output.decode().strip())
+
+
+def _ffprobe_packet_duration(file_path):
+    """Duration from the end of the last audio packet.
+
+    Reads packet headers only, nothing is decoded, so it stays cheap on long
+    files whose container has no usable duration (e.g. VBR MP3 without a
+    Xing header, or a truncated upload).
+    """
+    process = subprocess.Popen(
+        ['ffprobe', '-v', 'error', '-select_streams', 'a:0',
+         '-show_entries', 'packet=pts_time,duration_time', '-of', 'csv=p=0', file_path],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+    end = 0
+    for line in process.stdout:
+        fields = line.strip().split(',')
+        try:
+            end = max(end, float(fields[0]) + (float(fields[1]) if len(fields) > 1 and fields[1] else 0))
+        except ValueError:
+            continue
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, 'ffprobe')
+    return end
+
+
+PROBES = (
+    ('Mutagen', _mutagen_duration),
+    ('FFprobe', _ffprobe_format_duration),
+    ('FFprobe packet scan', _ffprobe_packet_duration),
+)
+
+
+def probe_duration(file_path):
+    """Return (duration, errors) for the file; duration is 0 if every probe failed."""
+    errors = []
+    if not os.path.exists(file_path):
+        return 0, [f'File not found at {file_path}']
+    for name, probe in PROBES:
+        try:
+            duration = probe(file_path)
+        except Exception as e:
+            errors.append(f'{name} failed: {e}')
+            continue
+        if duration and duration > 0:
+            return duration, errors
+    return 0, errors
+
+
+def record_results(results):
+    """Save a batch of (track, duration) results in two bulk updates.
+
+    Tracks with a duration are done, and the cached headers and stream
+    descriptors showing them are refreshed; the rest get a backoff, or are
+    quarantined once they run out of attempts.
+    """
+    now = timezone.now()
+    found, failed = [], []
+    for track, duration in results:
+        if duration > 0:
+            track.duration = duration
+            track.duration_attempts = 0
+            track.duration_retry_at = None
+            found.append(track)
+        else:
+            track.duration_attempts += 1
+            track.duration_retry_at = (
+                now + RETRY_BACKOFF * 2 ** (track.duration_attempts - 1)
+                if track.duration_attempts < MAX_ATTEMPTS else None
+            )
+            failed.append(track)
+    fields = ['duration', 'duration_attempts', 'duration_retry_at']
+    Track.objects.bulk_update(found + failed, fields)
+    if found:
+        # bulk_update sends no post_save, so do what its receivers would.
+        invalidate_headers_showing([track.pk for track in found])
+        refresh_track_media(found)
+    return found, failed
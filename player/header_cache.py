@@ -0,0 +1,27 @@
+"""Per-user cache of the header data every page shows (see player.context_processors).
+
+Each section ('playback', 'bookmarks') of a user's header is a
+player.versioned_cache entry. Writes that change a section drop it
+(``invalidate_header``) once their transaction commits.
+"""
+from . import versioned_cache
+
+PLAYBACK = 'playback'
+BOOKMARKS = 'bookmarks'
+
+# Backstop for changes nothing invalidates (e.g. a renamed track in a bookmark).
+HEADER_CACHE_TIMEOUT = 600
+
+
+def _namespace(section):
+    return f'player:header:{section}'
+
+
+def invalidate_header(section, user_ids):
+    """Drop the cached ``section`` of these users' headers when the current transaction commits."""
+    versioned_cache.invalidate(_namespace(section), user_ids)
+
+
+def cached_header(section, user_id, build):
+    """The cached ``section`` for ``user_id``, calling ``build()`` to fill it on a miss."""
+    return versioned_cache.cached(_namespace(section), user_id, build, HEADER_CACHE_TIMEOUT)
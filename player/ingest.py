@@ -0,0 +1,166 @@
+"""Bulk track ingestion for playlist uploads.
+
+The slow part of adding many tracks at once, writing each file to storage
+and reading its duration, runs in a thread pool with no transaction open
+(``ingest_files``). Only the row inserts happen inside the transaction, as
+a few bulk_creates (``bulk_create_tracks``), so even a long playlist holds
+its locks for milliseconds.
+
+Progress is kept in the cache under a client-chosen id, for the upload page
+to poll through the upload_progress view while the request is running.
+"""
+import logging
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.cache import cache
+
+from .access import invalidate_access
+from .jobs import DURATION_CHANNEL, notify_workers
+from .media_cache import refresh_track_media
+from .models import MediaBlob, Track, TrackRendition, TrackSearchGram, adjust_storage_used
+from .text import normalize_search_text, search_grams
+from .uploads import read_audio_metadata
+
+INGEST_THREADS = 4
+PROGRESS_TIMEOUT = 3600
+
+logger = logging.getLogger(__name__)
+
+# A file written to storage: the name it was uploaded as, its storage name,
+# and what was read from it.
+IngestedFile = namedtuple('IngestedFile', 'filename name duration file_size')
+
+
+def _progress_key(user_id, progress_id):
+    return f'player:ingest:{user_id}:{progress_id}'
+
+
+def get_progress(user_id, progress_id):
+    """{'stage', 'done', 'total'} last reported for this ingestion, or None."""
+    return cache.get(_progress_key(user_id, progress_id))
+
+
+class IngestProgress:
+    """Counts files through an ingestion and publishes the count to the cache.
+
+    Used by the request's own thread (ingest_files advances it as the pool
+    finishes files). Without a ``progress_id`` (the client isn't polling)
+    nothing is published.
+    """
+
+    def __init__(self, user_id, progress_id, total):
+        self.key = _progress_key(user_id, progress_id) if progress_id else None
+        self.total = total
+        self.done = 0
+        self.stage = 'storing'
+        self._publish()
+
+    def _publish(self):
+        if self.key:
+            cache.set(self.key, {'stage': self.stage, 'done': self.done, 'total': self.total}, PROGRESS_TIMEOUT)
+
+    def advance(self, count=1):
+        self.done += count
+        self._publish()
+
+    def set_stage(self, stage):
+        self.stage = stage
+        self._publish()
+
+
+def store_file(field, uploaded):
+    """Save an uploaded file where ``field`` (a FileField) would; returns its storage name."""
+    return field.storage.save(field.generate_filename(None, uploaded.name), uploaded)
+
+
+def delete_stored_files(names):
+    # Track storage, so blobs shared with other tracks are left alone when
+    # the store is content-addressed (it serves ordinary names as well).
+    storage = Track._meta.get_field('file').storage
+    for name in names:
+        try:
+            storage.delete(name)
+        except OSError:
+            logger.exception(f"Could not delete {name} after a failed upload")
+
+
+def ingest_files(files, progress=None, threads=INGEST_THREADS):
+    """Store uploaded audio files and read their durations, several at a time.
+
+    Returns an IngestedFile per file, in order. The pool's threads only
+    write files and read them back: they run no queries and leave the cache
+    (``progress``) to the calling thread, so they never open a database
+    connection. Call it outside any transaction. If any file fails, those
+    already stored are deleted again before the error is raised.
+    """
+    field = Track._meta.get_field('file')
+
+    def ingest(uploaded):
+        name = store_file(field, uploaded)
+        try:
+            return name, read_audio_metadata(field.storage.path(name)), None
+        except Exception as e:
+            # Left for the caller to delete: deleting a blob queries MediaBlob.
+            return name, None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(threads, len(files)))) as pool:
+        futures = [pool.submit(ingest, uploaded) for uploaded in files]
+        for future in as_completed(futures):
+            if progress is not None and future.exception() is None and future.result()[2] is None:
+                progress.advance()
+    results = [(None, None, future.exception()) if future.exception() else future.result() for future in futures]
+    error = next((error for _, _, error in results if error is not None), None)
+    if error is not None:
+        delete_stored_files(name for name, _, _ in results if name is not None)
+        raise error
+    return [
+        IngestedFile(uploaded.name, name, metadata['duration'], uploaded.size)
+        for uploaded, (name, metadata, _) in zip(files, results)
+    ]
+
+
+def bulk_create_tracks(tracks):
+    """bulk_create unsaved Tracks, doing what Track.save() and its signals would.
+
+    That is: fill search_text and the TrackSearchGram rows, charge each
+    owner once per distinct file, count the references to shared media
+    blobs, drop the owners' cached access grants, describe the files for
+    streaming, queue renditions and wake the duration worker if a duration
+    is missing. The files
+    must be stored already. Call inside a transaction.
+    """
+    charged = set(
+        Track.objects.filter(
+            owner_id__in={track.owner_id for track in tracks},
+            file__in={track.file.name for track in tracks},
+            storage_charged=True,
+        ).values_list('owner_id', 'file')
+    )
+    added = defaultdict(int)
+    for track in tracks:
+        track.search_text = normalize_search_text(track.name, track.artist)
+        key = (track.owner_id, track.file.name)
+        track.storage_charged = not track.file.name or key not in charged
+        if track.storage_charged:
+            charged.add(key)
+            added[track.owner_id] += track.file_size
+    tracks = Track.objects.bulk_create(tracks)
+
+    TrackSearchGram.objects.bulk_create([
+        TrackSearchGram(track_id=track.pk, gram=gram)
+        for track in tracks for gram in search_grams(track.search_text)
+    ])
+    MediaBlob.acquire(name for track in tracks for name in (track.file.name, track.icon.name))
+    for track in tracks:
+        track._saved_search_text = track.search_text
+        track._saved_storage = (track.owner_id, track.file_size, track.file.name, track.storage_charged)
+        track._saved_files = (track.file.name, track.icon.name)
+    for owner_id, size in added.items():
+        adjust_storage_used(owner_id, size)
+    invalidate_access({track.owner_id for track in tracks})
+    refresh_track_media(tracks)
+    TrackRendition.queue(tracks)
+    if any(track.duration == 0 and track.file_size > 0 for track in tracks):
+        notify_workers(DURATION_CHANNEL)
+    return tracks
@@ -0,0 +1,123 @@
+"""Waking background workers when there is new work for them.
+
+Web requests call ``notify_workers(channel)`` when they queue work; workers
+block in ``JobWaiter.wait()`` instead of sleep-polling. On PostgreSQL this is
+LISTEN/NOTIFY, so it works across containers. Elsewhere (the SQLite dev
+setup) the worker writes a pidfile and is woken with SIGUSR1, which only
+reaches workers on the same host. Waits always time out eventually, so a
+lost notification just delays work until the next poll.
+"""
+import os
+import select
+import signal
+import tempfile
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+
+TRANSCRIPTION_CHANNEL = 'transcription_jobs'
+DURATION_CHANNEL = 'track_durations'
+MEDIA_CHANNEL = 'media_jobs'
+
+
+def _pidfile(channel):
+    pid_dir = getattr(settings, 'WORKER_PID_DIR', None) or tempfile.gettempdir()
+    return os.path.join(pid_dir, f'listener_library_{channel}.pid')
+
+
+def _send(channel):
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            # Channel names are module constants, never user input.
+            cursor.execute(f'NOTIFY {channel}')
+        return
+    try:
+        with open(_pidfile(channel)) as f:
+            os.kill(int(f.read().strip()), signal.SIGUSR1)
+    except (OSError, ValueError):
+        pass
+
+
+def notify_workers(channel):
+    """Wake workers waiting on ``channel`` once the current transaction commits."""
+    transaction.on_commit(lambda: _send(channel))
+
+
+class JobWaiter:
+    """Blocks a worker's main loop until notified, woken locally, or timed out.
+
+    Must be created on the main thread (it installs signal handlers).
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self._listen_conn = None
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._read_fd, False)
+        os.set_blocking(self._write_fd, False)
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.wake())
+        with open(_pidfile(channel), 'w') as f:
+            f.write(str(os.getpid()))
+
+    def _listen(self):
+        if connection.vendor != 'postgresql':
+            return None
+        if self._listen_conn is None:
+            # A dedicated connection, so LISTEN survives the ORM connection
+            # being closed or reset between jobs.
+            conn = connections.create_connection('default')
+            conn.ensure_connection()
+            conn.set_autocommit(True)
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN {self.channel}')
+            self._listen_conn = conn
+        return self._listen_conn.connection
+
+    def wake(self):
+        """Interrupt the current (or next) ``wait`` from this process, e.g. a signal handler."""
+        try:
+            os.write(self._write_fd, b'\0')
+        except BlockingIOError:
+            pass
+
+    def wait(self, timeout, extra_fds=()):
+        """Return True if woken before ``timeout`` seconds passed.
+
+        ``extra_fds`` (e.g. worker subprocess pipes) also end the wait when
+        they become readable; the caller reads them.
+        """
+        fds = [self._read_fd, *extra_fds]
+        try:
+            pg_conn = self._listen()
+        except Exception:
+            pg_conn = None
+            self._listen_conn = None
+        if pg_conn is not None:
+            fds.append(pg_conn)
+        try:
+            ready, _, _ = select.select(fds, [], [], timeout)
+        except (OSError, ValueError):
+            # The LISTEN connection went away; reconnect on the next wait.
+            self._listen_conn = None
+            return False
+        if self._read_fd in ready:
+            try:
+                while os.read(self._read_fd, 512):
+                    pass
+            except BlockingIOError:
+                pass
+        if pg_conn is not None and pg_conn in ready:
+            try:
+                pg_conn.poll()
+                pg_conn.notifies.clear()
+            except Exception:
+                self._listen_conn = None
+        return bool(ready)
+
+    def close(self):
+        try:
+            os.remove(_pidfile(self.channel))
+        except OSError:
+            pass
+        if self._listen_conn is not None:
+            self._listen_conn.close()
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from player.models import Transcript, TranscriptSegment
+
+
+class Command(BaseCommand):
+    help = 'Parses stored SRT content into segments for transcripts saved before segments existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Rebuild every transcript, not just ones without segments.')
+
+    def handle(self, *args, **options):
+        transcripts = Transcript.objects.exclude(content='')
+        if not options['all']:
+            transcripts = transcripts.exclude(Exists(TranscriptSegment.objects.filter(transcript=OuterRef('pk'))))
+
+        count = 0
+        for transcript in transcripts.only('id', 'content').iterator(chunk_size=100):
+            transcript.rebuild_segments()
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Built segments for {count} transcript(s).'))
@@ -0,0 +1,74 @@
+import os
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from player import media_store
+from player.media_store import BLOB_PREFIX, STAGING_DIR, blob_digest
+from player.models import MediaBlob, Track, UploadSession
+
+
+class Command(BaseCommand):
+    help = 'Recounts references to content-addressed media blobs and deletes blobs nothing uses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without changing it.')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        storage = MediaBlob.storage()
+
+        references = Counter()
+        for file_name, icon_name in Track.objects.values_list('file', 'icon').iterator(chunk_size=2000):
+            references.update(name for name in (file_name, icon_name) if blob_digest(name))
+        references.update(
+            name for name in UploadSession.objects.exclude(file_name='').values_list('file_name', flat=True)
+            if blob_digest(name)
+        )
+
+        recounted = 0
+        known = set()
+        for blob in MediaBlob.objects.iterator(chunk_size=2000):
+            known.add(blob.name)
+            if blob.refcount != references[blob.name]:
+                recounted += 1
+                self.stdout.write(self.style.WARNING(
+                    f'{blob.name}: counted {blob.refcount} references, found {references[blob.name]}.'
+                ))
+                if not dry_run:
+                    MediaBlob.objects.filter(pk=blob.pk).update(refcount=references[blob.name])
+        for name in set(references) - known:
+            recounted += 1
+            self.stdout.write(self.style.WARNING(f'{name}: in use but not counted.'))
+            if not dry_run:
+                MediaBlob.acquire([name] * references[name])
+
+        deleted = 0
+        for name in self.unused_files(storage, set(references)):
+            deleted += 1
+            if not dry_run:
+                MediaBlob.objects.filter(name=name, refcount__lte=0).delete()
+                storage.delete(name)
+
+        verb = 'Would delete' if dry_run else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'Recounted {recounted} blob(s). {verb} {deleted} unused file(s).'
+        ))
+
+    def unused_files(self, storage, in_use):
+        """Names of files under blobs/ that nothing references and nobody has just written."""
+        root = storage.path(BLOB_PREFIX)
+        grace = media_store.BLOB_GRACE.total_seconds()
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, storage.location).replace(os.sep, '/')
+                if name in in_use:
+                    continue
+                try:
+                    if time.time() - os.path.getmtime(path) < grace:
+                        continue
+                except FileNotFoundError:
+                    continue
+                if name.startswith(STAGING_DIR + '/') or blob_digest(name):
+                    yield name
@@ -1,81 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from django.core.management.base import BaseCommand
-from player.models import Track
-from mutagen import File as MutagenFile
-from pydub import AudioSegment
-import os
-import subprocess
-import time
+from django.utils import timezone
+from player.durations import MAX_ATTEMPTS, claim_tracks, probe_duration, record_results
+from player.jobs import DURATION_CHANNEL, JobWaiter
+
+# Sleep this long when there is nothing to do and no upload wakes us. Tracks
+# waiting out a retry backoff are picked up on the next wake or timeout.
+IDLE_INTERVAL = 300
+
 
 class Command(BaseCommand):
     help = 'Fixes zero duration for tracks that have a valid file size'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20, help='Tracks claimed per batch.')
+        parser.add_argument('--threads', type=int, default=4, help='Tracks probed at once.')
+        parser.add_argument('--once', action='store_true', help='Exit when no track is left to probe.')
+
     def handle(self, *args, **options):
         self.stdout.write("Starting track duration fixer...")
+        waiter = None if options['once'] else JobWaiter(DURATION_CHANNEL)
 
-        while True:
-            track = Track.objects.filter(duration=0, file_size__gt=0).first()
-            if not track:
-                time.sleep(5)
-                continue
-
-            self.process_track(track)
-
-    def process_track(self, track):
         try:
+            with ThreadPoolExecutor(max_workers=max(1, options['threads'])) as pool:
+                while True:
+                    tracks = claim_tracks(options['batch_size'])
+                    if tracks:
+                        self.process_batch(pool, tracks)
+                        continue
+                    if waiter is None:
+                        break
+                    self.stdout.flush()
+                    waiter.wait(IDLE_INTERVAL)
+        finally:
+            if waiter is not None:
+                waiter.close()
+
+    def process_batch(self, pool, tracks):
+        def probe(track):
             if not track.file:
-                self.stdout.write(self.style.WARNING(f'Track {track.id} has no file associated.'))
-                return
-
-            file_path = track.file.path
-            # Ensure the file exists on disk
-            if not os.path.exists(file_path):
-                self.stdout.write(self.style.WARNING(f'File for track {track.id} not found at {file_path}.'))
-                return
-
-            duration = 0
-
-            # Try Mutagen with path
-            try:
-                audio = MutagenFile(file_path)
-                if audio and audio.info.length:
-                    duration = audio.info.length
-            except Exception as e:
-                self.stdout.write(self.style.WARNING(f'Mutagen failed on path for track {track.id}: {e}'))
-
-            # Try Mutagen with file object if path failed
-            if not duration:
-                try:
-                    with open(file_path, 'rb') as f:
-                        audio = MutagenFile(f)
-                        if audio and audio.info.length:
-                            duration = audio.info.length
-                except Exception as e:
-                    self.stdout.write(self.style.WARNING(f'Mutagen failed on file object for track {track.id}: {e}'))
-
-            # Try ffprobe as a fast fallback before pydub
-            if not duration:
-                try:
-                    result = subprocess.check_output(
-                        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', file_path],
-                        stderr=subprocess.STDOUT
-                    )
-                    duration = float(result.decode().strip())
-                except Exception as e:
-                    self.stdout.write(self.style.WARNING(f'FFprobe failed for track {track.id}: {e}'))
-
-            # Try Pydub as last resort
-            if not duration:
-                try:
-                    audio = AudioSegment.from_file(file_path)
-                    duration = len(audio) / 1000.0
-                except Exception as e:
-                    self.stdout.write(self.style.WARNING(f'Pydub failed for track {track.id}: {e}'))
-
-            if duration > 0:
-                track.duration = duration
-                track.save()
-                self.stdout.write(self.style.SUCCESS(f'Updated duration for track {track.id}: {track.duration}s'))
+                return 0, ['no file associated']
+            return probe_duration(track.file.path)
+
+        probed = list(pool.map(probe, tracks))
+        found, failed = record_results([(track, duration) for track, (duration, _) in zip(tracks, probed)])
+
+        for track in found:
+            self.stdout.write(self.style.SUCCESS(f'Updated duration for track {track.id}: {track.duration}s'))
+        errors = {track.id: errors for track, (_, errors) in zip(tracks, probed)}
+        for track in failed:
+            detail = '; '.join(errors[track.id])
+            if track.duration_attempts >= MAX_ATTEMPTS:
+                self.stdout.write(self.style.ERROR(
+                    f'Giving up on track {track.id} after {track.duration_attempts} attempts: {detail}'
+                ))
             else:
-                self.stdout.write(self.style.WARNING(f'Could not determine duration for track {track.id} (path: {file_path})'))
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f'Error processing track {track.id}: {str(e)}'))
+                self.stdout.write(self.style.WARNING(
+                    f'Could not determine duration for track {track.id} '
+                    f'(attempt {track.duration_attempts}, retry after {timezone.localtime(track.duration_retry_at):%H:%M}): {detail}'
+                ))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from player.uploads import UPLOAD_EXPIRY, purge_stale_uploads
+
+
+class Command(BaseCommand):
+    help = 'Deletes resumable uploads left unused for a day, releasing the quota they reserved'
+
+    def handle(self, *args, **options):
+        count = purge_stale_uploads()
+        self.stdout.write(self.style.SUCCESS(f'Purged {count} upload(s) untouched for {UPLOAD_EXPIRY}.'))
@@ -0,0 +1,96 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from player.models import StorageTotals, Track, UploadSession, UserProfile
+
+# Float sums of GB limits can differ in the last bits without real drift.
+ALLOCATION_TOLERANCE_GB = 1e-6
+
+
+class Command(BaseCommand):
+    help = 'Compares the materialized storage counters with the tracks and profiles they summarise, and repairs any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without fixing it.')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        drifted = self.reconcile_charges(dry_run)
+        for field, sources, description in (
+            ('storage_used_bytes',
+             Track.objects.filter(storage_charged=True).values(user_id=F('owner_id')).annotate(total=Sum('file_size')),
+             'tracks total'),
+            ('storage_reserved_bytes', UploadSession.objects.values('user_id').annotate(total=Sum('length')),
+             'unfinished uploads total'),
+        ):
+            drifted += self.reconcile_counter(field, sources, description, dry_run)
+
+        with transaction.atomic():
+            totals = StorageTotals.load(lock=True)
+            allocated = UserProfile.objects.aggregate(total=Sum('storage_limit_gb'))['total'] or 0
+            if abs(totals.allocated_limit_gb - allocated) > ALLOCATION_TOLERANCE_GB:
+                drifted += 1
+                self.stdout.write(self.style.WARNING(
+                    f'Allocated quota: counter says {totals.allocated_limit_gb}GB, profiles total {allocated}GB.'
+                ))
+                if not dry_run:
+                    StorageTotals.objects.filter(pk=totals.pk).update(allocated_limit_gb=allocated)
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('Storage counters are accurate.'))
+        elif dry_run:
+            self.stdout.write(self.style.WARNING(f'Found {drifted} drifted counter(s); run without --dry-run to fix.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Repaired {drifted} drifted counter(s).'))
+
+    def reconcile_counter(self, field, sources, description, dry_run):
+        """Compare one per-user counter with ``sources`` (user_id, total rows); returns how many drifted."""
+        sources = sources.order_by()
+        totals = dict(sources.values_list('user_id', 'total'))
+        drifted = 0
+        for user_id, recorded in UserProfile.objects.values_list('user_id', field).iterator(chunk_size=500):
+            if recorded == totals.get(user_id, 0):
+                continue
+            with transaction.atomic():
+                # Recount under the row lock so an upload in flight is included.
+                profile = UserProfile.objects.select_for_update().select_related('user').get(user_id=user_id)
+                actual = sum(sources.filter(user_id=user_id).values_list('total', flat=True))
+                recorded = getattr(profile, field)
+                if recorded == actual:
+                    continue
+                drifted += 1
+                self.stdout.write(self.style.WARNING(
+                    f'{profile.user.username}: {field} says {recorded} bytes, {description} {actual}.'
+                ))
+                if not dry_run:
+                    UserProfile.objects.filter(pk=profile.pk).update(**{field: actual})
+        return drifted
+
+    def reconcile_charges(self, dry_run):
+        """Make exactly one track of each owner's set sharing a stored file the charged one."""
+        groups = (
+            Track.objects.exclude(file='').order_by().values('owner_id', 'file')
+            .annotate(charged=Count('pk', filter=Q(storage_charged=True))).exclude(charged=1)
+        )
+        drifted = 0
+        for group in groups.iterator(chunk_size=500):
+            drifted += 1
+            self.stdout.write(self.style.WARNING(
+                f"User {group['owner_id']}: {group['charged']} tracks charged for {group['file']}, expected 1."
+            ))
+            if not dry_run:
+                with transaction.atomic():
+                    tracks = Track.objects.filter(owner_id=group['owner_id'], file=group['file'])
+                    first = tracks.order_by('pk').values_list('pk', flat=True).first()
+                    tracks.exclude(pk=first).update(storage_charged=False)
+                    tracks.filter(pk=first).update(storage_charged=True)
+
+        # A track without a file never shares one.
+        fileless = Track.objects.filter(file='', storage_charged=False)
+        count = fileless.count()
+        if count:
+            drifted += count
+            self.stdout.write(self.style.WARNING(f'{count} track(s) without a file are not charged.'))
+            if not dry_run:
+                fileless.update(storage_charged=True)
+        return drifted
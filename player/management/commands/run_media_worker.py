@@ -0,0 +1,136 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from player.jobs import MEDIA_CHANNEL, JobWaiter
+from player.media_cache import refresh_track_media
+from player.models import Track, TrackRendition
+from player import remux
+from player.renditions import MAX_ATTEMPTS, claim_renditions, make_rendition, record_results
+from player.uploads import purge_stale_uploads
+
+# Sleep this long when there is nothing to do and no upload wakes us.
+IDLE_INTERVAL = 300
+# How often abandoned resumable uploads (of any user) are deleted, releasing
+# their .part files and reserved quota (see player.uploads), and files
+# replaced by a remux are deleted once unused (see player.remux).
+PURGE_INTERVAL = timedelta(hours=1)
+
+
+class Command(BaseCommand):
+    help = (
+        'Remuxes uploads so they seek in one range request, then transcodes them '
+        'into low-bitrate renditions segmented for HLS'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=4, help='Tracks or renditions claimed per batch.')
+        parser.add_argument('--threads', type=int, default=2, help='ffmpeg processes run at once.')
+        parser.add_argument('--once', action='store_true', help='Exit when nothing is left to do.')
+        parser.add_argument('--backfill', action='store_true', help='First queue renditions for tracks that have none.')
+
+    def handle(self, *args, **options):
+        self.stdout.write("Starting media worker...")
+        if options['backfill']:
+            self.backfill()
+        waiter = None if options['once'] else JobWaiter(MEDIA_CHANNEL)
+        self.next_purge = timezone.now()
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, options['threads'])) as pool:
+                while True:
+                    self.purge()
+                    # Remux first: renditions wait for it (see player.remux).
+                    tracks = remux.claim_tracks(options['batch_size'])
+                    if tracks:
+                        self.remux_batch(pool, tracks)
+                        continue
+                    renditions = claim_renditions(options['batch_size'])
+                    if renditions:
+                        self.process_batch(pool, renditions)
+                        continue
+                    if waiter is None:
+                        break
+                    self.stdout.flush()
+                    waiter.wait(IDLE_INTERVAL)
+        finally:
+            if waiter is not None:
+                waiter.close()
+
+    def purge(self):
+        if timezone.now() < self.next_purge:
+            return
+        self.next_purge = timezone.now() + PURGE_INTERVAL
+        count = purge_stale_uploads()
+        if count:
+            self.stdout.write(self.style.SUCCESS(f'Purged {count} abandoned upload(s).'))
+        count = remux.delete_retired_files()
+        if count:
+            self.stdout.write(self.style.SUCCESS(f'Deleted {count} file(s) replaced by a remux.'))
+
+    def backfill(self):
+        tracks = Track.objects.exclude(file='').filter(
+            ~Exists(TrackRendition.objects.filter(track=OuterRef('pk')))
+        ).only('id', 'file')
+        queued, batch = 0, []
+        for track in tracks.iterator(chunk_size=500):
+            batch.append(track)
+            if len(batch) == 500:
+                TrackRendition.queue(batch)
+                queued, batch = queued + len(batch), []
+        TrackRendition.queue(batch)
+        queued += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'Queued renditions for {queued} track(s).'))
+
+    def remux_batch(self, pool, tracks):
+        def remux_file(track):
+            try:
+                return track, remux.remux_track(track), None
+            except Exception as e:
+                return track, None, str(e) or e.__class__.__name__
+
+        # Tracks sharing a file are switched together; remux it once.
+        by_file = {track.file.name: track for track in tracks}
+        results = list(pool.map(remux_file, by_file.values()))
+        remuxed, failed = remux.record_results(results)
+
+        for track in remuxed:
+            self.stdout.write(self.style.SUCCESS(f'Remuxed track {track.id} for seeking: {track.file.name}'))
+        errors = {track.id: error for track, _, error in results}
+        for track in failed:
+            if track.remux_attempts >= remux.MAX_ATTEMPTS:
+                self.stdout.write(self.style.ERROR(
+                    f'Giving up remuxing track {track.id} after {track.remux_attempts} attempts: {errors[track.id]}'
+                ))
+            else:
+                self.stdout.write(self.style.WARNING(
+                    f'Could not remux track {track.id} (attempt {track.remux_attempts}): {errors[track.id]}'
+                ))
+
+    def process_batch(self, pool, renditions):
+        def make(rendition):
+            try:
+                return rendition, make_rendition(rendition), None
+            except Exception as e:
+                return rendition, 0, str(e) or e.__class__.__name__
+
+        made, failed = record_results(list(pool.map(make, renditions)))
+        refresh_track_media({rendition.track_id: rendition.track for rendition in made}.values())
+
+        for rendition in made:
+            self.stdout.write(self.style.SUCCESS(
+                f'Made {rendition.profile} rendition of track {rendition.track_id} ({rendition.file_size} bytes)'
+            ))
+        for rendition in failed:
+            if rendition.attempts >= MAX_ATTEMPTS:
+                self.stdout.write(self.style.ERROR(
+                    f'Giving up on {rendition.profile} rendition of track {rendition.track_id} '
+                    f'after {rendition.attempts} attempts: {rendition.error_message}'
+                ))
+            else:
+                self.stdout.write(self.style.WARNING(
+                    f'Could not make {rendition.profile} rendition of track {rendition.track_id} '
+                    f'(attempt {rendition.attempts}): {rendition.error_message}'
+                ))
@@ -1,102 +1,441 @@
 import os
 import sys
-import time
+import json
+import shutil
+import signal
 import subprocess
 import warnings
 import tempfile
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from datetime import timedelta
+from django.db.models import Count, Min, Q
 from django.utils import timezone
+from player.jobs import JobWaiter, TRANSCRIPTION_CHANNEL
 from player.models import Transcript
 
 # Suppress warnings
 warnings.filterwarnings("ignore")
 
-class Command(BaseCommand):
-    help = 'Runs the transcription worker to process pending transcripts'
+# How often running jobs are checked for cancellation, and how long an idle
+# worker sleeps when no notification arrives.
+POLL_INTERVAL = 5
+IDLE_INTERVAL = 60
+# A worker refreshes heartbeat_at on its jobs this often; a 'processing' job
+# whose heartbeat is older than LEASE_TIMEOUT belongs to a worker that died
+# and is put back in the queue, to resume from its checkpoints.
+HEARTBEAT_INTERVAL = 30
+LEASE_TIMEOUT = 120
 
-    def handle(self, *args, **options):
-        self.stdout.write("Starting transcription worker with slim subprocess support...")
 
-        while True:
-            # Re-fetch to avoid stale objects
-            pending = Transcript.objects.filter(status='pending').first()
-            if not pending:
-                time.sleep(5)
+def _claim_fields():
+    now = timezone.now()
+    return {'status': 'processing', 'processing_started_at': now, 'heartbeat_at': now, 'chunks_completed': 0, 'chunks_total': 0}
+
+
+def reclaim_stale_transcripts():
+    """Requeue 'processing' transcripts whose worker stopped heartbeating.
+
+    Returns how many were requeued.
+    """
+    cutoff = timezone.now() - timedelta(seconds=LEASE_TIMEOUT)
+    return Transcript.objects.filter(status='processing').filter(
+        Q(heartbeat_at__lt=cutoff)
+        | Q(heartbeat_at__isnull=True, processing_started_at__lt=cutoff)
+        | Q(heartbeat_at__isnull=True, processing_started_at__isnull=True)
+    ).update(status='pending', processing_started_at=None, heartbeat_at=None)
+
+
+def claim_next_transcript():
+    """Atomically move the fairest pending transcript to 'processing'.
+
+    Owners with the fewest transcripts already processing (across every
+    worker) go first, oldest pending job breaking ties, so one bulk uploader
+    cannot starve everyone else. On PostgreSQL the row is claimed with
+    SELECT ... FOR UPDATE SKIP LOCKED; elsewhere with a conditional UPDATE.
+    Returns the claimed Transcript or None. Its processing_started_at
+    identifies this claim: once the job is reclaimed, updates made under the
+    old claim match nothing.
+    """
+    pending_owners = (
+        Transcript.objects.filter(status='pending')
+        .values('track__owner_id').annotate(oldest=Min('created_at'))
+    )
+    in_flight = dict(
+        Transcript.objects.filter(status='processing')
+        .values('track__owner_id').annotate(n=Count('id'))
+        .values_list('track__owner_id', 'n')
+    )
+    owners = sorted(
+        pending_owners,
+        key=lambda row: (in_flight.get(row['track__owner_id'], 0), row['oldest']),
+    )
+    skip_locked = connection.features.has_select_for_update_skip_locked
+
+    for row in owners:
+        candidates = Transcript.objects.filter(
+            status='pending', track__owner_id=row['track__owner_id'],
+        ).order_by('created_at', 'id')
+        with transaction.atomic():
+            if skip_locked:
+                transcript = candidates.select_for_update(skip_locked=True, of=('self',)).first()
+                if transcript is None:
+                    continue
+                claimed = Transcript.objects.filter(pk=transcript.pk).update(**_claim_fields())
+            else:
+                transcript = candidates.first()
+                if transcript is None:
+                    continue
+                # Compare-and-swap: only one worker sees its UPDATE match.
+                claimed = Transcript.objects.filter(pk=transcript.pk, status='pending').update(**_claim_fields())
+        if claimed:
+            transcript.refresh_from_db()
+            return transcript
+    return None
+
+
+def _engine_script_path():
+    # Use the slim script to avoid Django overhead in the subprocess
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'transcribe_slim.py')
+
+
+class TranscriptionEngine:
+    """A long-lived ``transcribe_slim.py --serve`` process with the model loaded.
+
+    Jobs go in as JSON lines on stdin and results come back as JSON lines on
+    stdout (see transcribe_slim.serve), so only the first job on an engine
+    pays for importing torch/whisper and loading the model.
+    """
+
+    def __init__(self, workers=1, threads=1):
+        self.process = subprocess.Popen(
+            [sys.executable, _engine_script_path(), '--serve', '--workers', str(workers), '--threads', str(threads)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            # Its own process group, shared with the chunk pool processes it
+            # starts, so terminate() stops them all (see there).
+            start_new_session=True,
+        )
+        os.set_blocking(self.process.stdout.fileno(), False)
+        self._buffer = b''
+        self.ready = False
+        self.jobs_done = 0
+        self.job = None
+
+    def fileno(self):
+        return self.process.stdout.fileno()
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def submit(self, job):
+        request = {
+            'audio_path': job.transcript.track.file.path,
+            'output_srt_path': job.tmp_srt_path,
+            'checkpoint_dir': job.transcript.checkpoint_dir,
+        }
+        self.process.stdin.write((json.dumps(request) + "\n").encode('utf-8'))
+        self.process.stdin.flush()
+        self.job = job
+
+    def read_messages(self):
+        """Return the complete reply lines available right now."""
+        try:
+            self._buffer += os.read(self.fileno(), 65536)
+        except BlockingIOError:
+            pass
+        *lines, self._buffer = self._buffer.split(b"\n")
+        messages = []
+        for line in lines:
+            try:
+                messages.append(json.loads(line))
+            except ValueError:
+                continue
+        return messages
+
+    def rss_bytes(self):
+        """Resident memory of the engine and its chunk pool processes (Linux only)."""
+        pid = self.process.pid
+        pids = [pid]
+        try:
+            with open(f'/proc/{pid}/task/{pid}/children') as f:
+                pids += [int(child) for child in f.read().split()]
+        except (OSError, ValueError):
+            pass
+        total = 0
+        for pid in pids:
+            try:
+                with open(f'/proc/{pid}/statm') as f:
+                    total += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+            except (OSError, ValueError, IndexError):
                 continue
+        return total
+
+    def _signal_group(self, signum):
+        try:
+            os.killpg(self.process.pid, signum)
+        except ProcessLookupError:
+            pass
 
-            self.process_transcript(pending)
-            self.stdout.flush()
+    def terminate(self):
+        """Stop the engine and its chunk pool processes.
 
-    def process_transcript(self, transcript):
-        self.stdout.write(f"Processing transcript for {transcript.track.name}...")
-        transcript.status = 'processing'
-        transcript.processing_started_at = timezone.now()
-        transcript.save()
+        Signalling only the engine would orphan the pool, which would go on
+        transcribing a cancelled job next to the replacement engine's pool.
+        """
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self._signal_group(signal.SIGTERM)
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self._signal_group(signal.SIGKILL)
+            self.process.wait()
+        # Pool processes that outlived the engine.
+        self._signal_group(signal.SIGKILL)
+        self.process.stdout.close()
 
-        audio_path = transcript.track.file.path
 
+class TranscriptionJob:
+    """One transcript being processed on an engine."""
+
+    def __init__(self, transcript):
+        self.transcript = transcript
         # Create a temporary file for the SRT output
         with tempfile.NamedTemporaryFile(suffix='.srt', delete=False) as tmp_srt:
-            tmp_srt_path = tmp_srt.name
+            self.tmp_srt_path = tmp_srt.name
+
+    def claimed(self):
+        """The transcript row, if this worker still holds the job."""
+        return Transcript.objects.filter(
+            pk=self.transcript.pk, status='processing',
+            processing_started_at=self.transcript.processing_started_at,
+        )
 
+    def read_output(self):
+        if not os.path.exists(self.tmp_srt_path):
+            raise FileNotFoundError("SRT output file not found after the engine reported success.")
+        with open(self.tmp_srt_path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def cleanup(self):
+        # Clean up the temporary file
+        if os.path.exists(self.tmp_srt_path):
+            os.remove(self.tmp_srt_path)
+
+
+class Command(BaseCommand):
+    help = 'Runs the transcription worker to process pending transcripts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=os.cpu_count() or 1,
+            help='Number of transcriptions to run at once (default: number of CPU cores).',
+        )
+        parser.add_argument(
+            '--max-jobs-per-engine', type=int, default=25,
+            help='Restart an engine after it has transcribed this many tracks.',
+        )
+        parser.add_argument(
+            '--max-engine-memory-mb', type=int, default=1500,
+            help='Restart an engine once its resident memory exceeds this.',
+        )
+        parser.add_argument(
+            '--chunk-workers', type=int, default=1,
+            help='Processes per engine transcribing chunks of one long file in parallel (one model each).',
+        )
+        parser.add_argument(
+            '--threads', type=int, default=1,
+            help='Torch threads per model. CPU use is concurrency x chunk-workers x threads.',
+        )
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        self.max_jobs_per_engine = options['max_jobs_per_engine']
+        self.max_engine_memory = options['max_engine_memory_mb'] * 1024 * 1024
+        self.engine_options = {'workers': max(1, options['chunk_workers']), 'threads': max(1, options['threads'])}
+        self.stdout.write(f"Starting transcription worker with {concurrency} engine(s)...")
+
+        self.waiter = JobWaiter(TRANSCRIPTION_CHANNEL)
+        # An engine exiting wakes the loop so its job is failed/requeued at once.
+        signal.signal(signal.SIGCHLD, lambda signum, frame: self.waiter.wake())
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        # Start every engine up front so models are warm before work arrives.
+        self.engines = [TranscriptionEngine(**self.engine_options) for _ in range(concurrency)]
+
+        self.last_heartbeat = None
         try:
-            # Use the slim script to avoid Django overhead in the subprocess
-            slim_script_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'transcribe_slim.py')
+            while True:
+                self.collect_results()
+                self.heartbeat()
+                self.cancel_abandoned()
+                while self.busy_count() < concurrency:
+                    index = self.idle_engine_index()
+                    if index is None:
+                        break
+                    transcript = claim_next_transcript()
+                    if transcript is None:
+                        break
+                    self.start_job(index, transcript)
+                self.stdout.flush()
+                self.waiter.wait(
+                    POLL_INTERVAL if self.busy_count() else IDLE_INTERVAL,
+                    extra_fds=[engine.fileno() for engine in self.engines if engine is not None],
+                )
+        finally:
+            self.requeue_running()
+            self.waiter.close()
 
-            # Start transcription as a separate subprocess
-            process = subprocess.Popen(
-                [sys.executable, slim_script_path, audio_path, tmp_srt_path]
-            )
+    def busy_count(self):
+        return sum(1 for engine in self.engines if engine is not None and engine.job is not None)
+
+    def replace_engine(self, index, start=True):
+        engine = self.engines[index]
+        if engine is not None:
+            engine.terminate()
+        # Engines that died while idle are only restarted when a job needs
+        # one, so a broken install fails jobs instead of respawning forever.
+        self.engines[index] = TranscriptionEngine(**self.engine_options) if start else None
+
+    def idle_engine_index(self):
+        """The slot of an engine free for a job, or None if every engine is busy.
+
+        A slot whose engine is gone, or died since collect_results, counts
+        as free: start_job starts a new engine in it.
+        """
+        idle = [i for i, engine in enumerate(self.engines) if engine is None or engine.job is None]
+        if not idle:
+            return None
+        # Prefer engines whose model is already loaded.
+        idle.sort(key=lambda i: not (self.engines[i] is not None and self.engines[i].ready and self.engines[i].alive()))
+        return idle[0]
+
+    def start_job(self, index, transcript):
+        self.stdout.write(f"Processing transcript for {transcript.track.name}...")
+        if self.engines[index] is None or not self.engines[index].alive():
+            self.replace_engine(index)
+        job = TranscriptionJob(transcript)
+        try:
+            self.engines[index].submit(job)
+        except Exception as e:
+            job.cleanup()
+            self.fail(job, f"Worker error: {str(e)}")
+            self.replace_engine(index, start=False)
 
-            cancelled = False
-            while process.poll() is None:
-                # Check if user cancelled in the DB
-                transcript.refresh_from_db()
-                if transcript.status != 'processing':
-                    self.stdout.write(self.style.WARNING(f"Transcription for {transcript.track.name} was cancelled. Terminating subprocess..."))
-                    process.terminate()
+    def collect_results(self):
+        for index, engine in enumerate(self.engines):
+            if engine is None:
+                continue
+            for message in engine.read_messages():
+                if message.get('event') == 'ready':
+                    engine.ready = True
+                elif message.get('event') == 'progress':
+                    if engine.job is not None:
+                        self.record_progress(engine.job, message)
+                elif engine.job is not None:
+                    job, engine.job = engine.job, None
+                    engine.jobs_done += 1
                     try:
-                        process.wait(timeout=10)
-                    except subprocess.TimeoutExpired:
-                        process.kill()
-                    cancelled = True
-                    break
-
-                time.sleep(5)
-
-            if not cancelled:
-                return_code = process.returncode
-                if return_code == 0:
-                    # Success: read the SRT file and update model
-                    if os.path.exists(tmp_srt_path):
-                        with open(tmp_srt_path, 'r', encoding='utf-8') as f:
-                            srt_content = f.read()
-
-                        transcript.content = srt_content
-                        transcript.status = 'completed'
-                        transcript.error_message = None
-                        transcript.save()
-                        self.stdout.write(self.style.SUCCESS(f"Successfully transcribed {transcript.track.name}"))
-                    else:
-                        raise FileNotFoundError("SRT output file not found after successful subprocess completion.")
-                else:
-                    # Subprocess failed
-                    transcript.refresh_from_db()
-                    if transcript.status == 'processing':
-                        transcript.status = 'failed'
-                        transcript.error_message = f"Transcription subprocess failed with return code {return_code}."
-                        transcript.save()
-                    self.stdout.write(self.style.ERROR(f"Error processing {transcript.track.name}: return code {return_code}"))
+                        self.finish_job(job, message)
+                    finally:
+                        job.cleanup()
+
+            if not engine.alive():
+                if engine.job is not None:
+                    job, engine.job = engine.job, None
+                    self.fail(job, f"Transcription engine exited with return code {engine.process.returncode}.")
+                    self.stdout.write(self.style.ERROR(f"Error processing {job.transcript.track.name}: engine exited with return code {engine.process.returncode}"))
+                    job.cleanup()
+                self.replace_engine(index, start=False)
+            elif engine.job is None and (
+                    engine.jobs_done >= self.max_jobs_per_engine
+                    or engine.rss_bytes() > self.max_engine_memory):
+                self.stdout.write(f"Recycling transcription engine after {engine.jobs_done} job(s)...")
+                self.replace_engine(index)
+
+    def heartbeat(self):
+        """Renew the lease on running jobs and requeue jobs whose worker died."""
+        now = timezone.now()
+        if self.last_heartbeat and (now - self.last_heartbeat).total_seconds() < HEARTBEAT_INTERVAL:
+            return
+        self.last_heartbeat = now
+        for engine in self.engines:
+            if engine is not None and engine.job is not None:
+                engine.job.claimed().update(heartbeat_at=now)
+        reclaimed = reclaim_stale_transcripts()
+        if reclaimed:
+            self.stdout.write(self.style.WARNING(f"Requeued {reclaimed} transcript(s) abandoned by a stopped worker."))
+
+    def cancel_abandoned(self):
+        """Stop jobs this worker no longer holds (cancelled by the user, or reclaimed)."""
+        running = {engine.job.transcript.pk: i for i, engine in enumerate(self.engines) if engine is not None and engine.job is not None}
+        if not running:
+            return
+        current = dict(
+            Transcript.objects.filter(pk__in=running, status='processing').values_list('pk', 'processing_started_at')
+        )
+        for pk, index in running.items():
+            job = self.engines[index].job
+            if pk in current and current[pk] == job.transcript.processing_started_at:
+                continue
+            self.stdout.write(self.style.WARNING(f"Transcription for {job.transcript.track.name} was cancelled. Restarting its engine..."))
+            # The engine is mid-transcription; the only way to stop it is to
+            # replace it.
+            self.engines[index].job = None
+            self.replace_engine(index)
+            job.cleanup()
 
+    def record_progress(self, job, progress):
+        """Publish the chunks finished so far as a partial transcript."""
+        try:
+            with open(os.path.join(job.transcript.checkpoint_dir, 'partial.srt'), encoding='utf-8') as f:
+                partial = f.read()
+        except OSError:
+            return
+        with transaction.atomic():
+            updated = job.claimed().update(
+                content=partial, chunks_completed=progress['completed'], chunks_total=progress['total'],
+                heartbeat_at=timezone.now(),
+            )
+            if updated:
+                job.transcript.rebuild_segments(partial)
+
+    def finish_job(self, job, result):
+        transcript = job.transcript
+        try:
+            if result.get('ok'):
+                # Success: read the SRT file and update model, unless the
+                # user cancelled while the engine was finishing.
+                srt_content = job.read_output()
+                with transaction.atomic():
+                    updated = job.claimed().update(
+                        content=srt_content, status='completed', error_message=None, updated_at=timezone.now(),
+                    )
+                    if updated:
+                        transcript.rebuild_segments(srt_content)
+                if updated:
+                    shutil.rmtree(transcript.checkpoint_dir, ignore_errors=True)
+                    self.stdout.write(self.style.SUCCESS(f"Successfully transcribed {transcript.track.name}"))
+            else:
+                self.fail(job, f"Transcription failed: {result.get('error')}")
+                self.stdout.write(self.style.ERROR(f"Error processing {transcript.track.name}: {result.get('error')}"))
         except Exception as e:
-            transcript.refresh_from_db()
-            if transcript.status == 'processing':
-                transcript.status = 'failed'
-                transcript.error_message = f"Worker error: {str(e)}"
-                transcript.save()
+            self.fail(job, f"Worker error: {str(e)}")
             self.stdout.write(self.style.ERROR(f"Worker exception processing {transcript.track.name}: {e}"))
 
-        finally:
-            # Clean up the temporary file
-            if os.path.exists(tmp_srt_path):
-                os.remove(tmp_srt_path)
+    def fail(self, job, message):
+        # Checkpoints are kept, so a retry resumes where this attempt stopped.
+        job.claimed().update(status='failed', error_message=message, updated_at=timezone.now())
+
+    def requeue_running(self):
+        """On shutdown, stop the engines and hand unfinished jobs back to the queue."""
+        for index, engine in enumerate(self.engines):
+            if engine is None:
+                continue
+            job = engine.job
+            engine.terminate()
+            if job is not None:
+                job.cleanup()
+                job.claimed().update(status='pending', processing_started_at=None, heartbeat_at=None)
+            self.engines[index] = None
@@ -1,9 +1,14 @@
 import sys
 import os
+import json
 import warnings
 import subprocess
-import tempfile
 import math
+import argparse
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 # Suppress warnings from Whisper and its dependencies
 warnings.filterwarnings("ignore")
@@ -13,6 +18,14 @@ try:
 except ImportError:
     torch = None
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Whisper works on 16 kHz mono float32 samples.
+SAMPLE_RATE = 16000
+
 def format_timestamp(seconds):
     """Converts seconds to SRT timestamp format (HH:MM:SS,mmm)"""
     milliseconds = int((seconds % 1) * 1000)
@@ -34,14 +47,17 @@ def get_duration(audio_path):
         print(f"Error getting duration: {e}")
         return None
 
-def transcribe_chunk(model, audio_chunk_path, offset_seconds):
-    """Transcribes a single audio chunk and returns segments with offset timestamps."""
+def transcribe_chunk(model, audio, offset_seconds):
+    """Transcribes a single audio chunk and returns segments with offset timestamps.
+
+    ``audio`` is a float32 sample array (see decode_chunk) or a file path.
+    """
     # Transcribe with optimized parameters
     # fp16=False is safer for CPU
     # condition_on_previous_text=False prevents repetition loops on long tracks
     # temperature fallback helps break out of failure loops
     result = model.transcribe(
-        audio_chunk_path,
+        audio,
         fp16=False,
         condition_on_previous_text=False,
         temperature=(0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
@@ -56,83 +72,371 @@ def transcribe_chunk(model, audio_chunk_path, offset_seconds):
         })
     return segments
 
-def main():
-    if len(sys.argv) < 3:
-        print("Usage: transcribe_slim.py <audio_path> <output_srt_path>")
-        sys.exit(1)
+def write_srt(segments, output_srt_path):
+    """Convert collected segments to SRT and write them to output_srt_path."""
+    with open(output_srt_path, 'w', encoding='utf-8') as f:
+        for i, segment in enumerate(segments):
+            start = format_timestamp(segment["start"])
+            end = format_timestamp(segment["end"])
+            text = segment["text"]
+            f.write(f"{i+1}\n{start} --> {end}\n{text}\n\n")
+
+
+# Long files are cut into chunks of this many seconds. Neighbouring chunks
+# overlap by CHUNK_OVERLAP seconds so words at a cut are heard whole by at
+# least one chunk; stitch_segments() removes the duplicates.
+CHUNK_LENGTH = 1200  # 20 minutes in seconds
+CHUNK_OVERLAP = 5
+
+Chunk = namedtuple('Chunk', 'start length owned_start owned_end')
+
+
+def plan_chunks(duration, chunk_length=CHUNK_LENGTH, overlap=CHUNK_OVERLAP):
+    """Return the Chunks to transcribe for a file of ``duration`` seconds.
+
+    Each chunk owns [owned_start, owned_end) on the original timeline and is
+    extracted with ``overlap`` seconds of context either side. A file short
+    enough to do in one pass is a single chunk with ``length`` None, meaning
+    "the whole file, no extraction".
+    """
+    if duration <= chunk_length + 60:  # Extra 60s buffer to avoid splitting very short overflows
+        return [Chunk(0, None, 0, math.inf)]
+    num_chunks = math.ceil(duration / chunk_length)
+    chunks = []
+    for i in range(num_chunks):
+        owned_start = i * chunk_length
+        owned_end = math.inf if i == num_chunks - 1 else owned_start + chunk_length
+        start = max(0, owned_start - overlap)
+        chunks.append(Chunk(start, owned_start + chunk_length + overlap - start, owned_start, owned_end))
+    return chunks
+
+
+def stitch_segments(chunks, chunk_segments):
+    """Merge per-chunk segments into one timeline without boundary duplicates.
+
+    A segment belongs to the chunk whose owned interval contains its
+    midpoint, so a sentence heard by two overlapping chunks is kept once.
+    If the two chunks split it differently, the survivors can still overlap
+    in time: an identical repeat is dropped, otherwise the later one is
+    trimmed to start where the earlier ends. The result only depends on the
+    inputs, never on the order chunks finished in.
+    """
+    kept = []
+    for chunk, segments in zip(chunks, chunk_segments):
+        for segment in segments:
+            midpoint = (segment["start"] + segment["end"]) / 2
+            if chunk.owned_start <= midpoint < chunk.owned_end:
+                kept.append(segment)
+    kept.sort(key=lambda segment: (segment["start"], segment["end"]))
+
+    stitched = []
+    for segment in kept:
+        if stitched and segment["start"] < stitched[-1]["end"]:
+            previous = stitched[-1]
+            if segment["text"].strip().lower() == previous["text"].strip().lower():
+                continue
+            segment = dict(segment, start=previous["end"])
+            if segment["end"] <= segment["start"]:
+                continue
+        stitched.append(segment)
+    return stitched
+
+
+class PcmBuffer:
+    """A reusable float32 sample buffer that ffmpeg's raw PCM output is read into.
+
+    Chunks are all about the same size, so after the first one decoding
+    allocates nothing; the buffer only grows when a chunk is bigger.
+    """
+
+    def __init__(self):
+        self._raw = np.empty(0, dtype=np.int16)
+        self._samples = np.empty(0, dtype=np.float32)
+
+    def reserve(self, n_samples):
+        if n_samples > self._raw.size:
+            raw = np.empty(n_samples, dtype=np.int16)
+            raw[:self._raw.size] = self._raw
+            self._raw = raw
+            self._samples = np.empty(n_samples, dtype=np.float32)
+
+    def fill(self, stream):
+        """Read s16le PCM from ``stream`` until EOF; return a float32 view of it.
+
+        The view is only valid until the next fill().
+        """
+        filled = 0
+        while True:
+            if filled == self._raw.nbytes:
+                self.reserve(max(SAMPLE_RATE * 60, self._raw.size * 2))
+            read = stream.readinto(memoryview(self._raw.view(np.uint8))[filled:])
+            if not read:
+                break
+            filled += read
+        n_samples = filled // 2
+        samples = self._samples[:n_samples]
+        np.divide(self._raw[:n_samples], 32768.0, out=samples)
+        return samples
+
+
+def decode_chunk(audio_path, chunk, buffer):
+    """Decode one planned chunk to 16 kHz mono samples in ``buffer`` via an ffmpeg pipe."""
+    cmd = ['ffmpeg', '-nostdin', '-v', 'error']
+    if chunk.length is not None:
+        cmd += ['-ss', str(chunk.start), '-t', str(chunk.length)]
+        buffer.reserve(int(chunk.length * SAMPLE_RATE) + 1)
+    cmd += ['-i', audio_path, '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), '-']
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        samples = buffer.fill(process.stdout)
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    return samples
+
+
+# Decode buffers are kept for the life of the process (engine or pool
+# worker) so consecutive jobs reuse them. Two, so the next chunk can be
+# decoded while the current one is transcribed.
+_buffers = []
+
+
+def _get_buffers(count):
+    while len(_buffers) < count:
+        _buffers.append(PcmBuffer())
+    return _buffers[:count]
+
+
+# Each pool process loads its own model once, in the initializer.
+_pool_model = None
+
+
+def _init_pool_worker(threads):
+    global _pool_model
+    warnings.filterwarnings("ignore")
+    _pool_model = load_model(threads)
+
+
+def _pool_transcribe(audio_path, chunk):
+    buffer, = _get_buffers(1)
+    samples = decode_chunk(audio_path, chunk, buffer)
+    if torch:
+        with torch.no_grad():
+            return transcribe_chunk(_pool_model, samples, chunk.start)
+    return transcribe_chunk(_pool_model, samples, chunk.start)
+
+
+def make_pool(workers, threads):
+    """A process pool of ``workers`` processes, each with a model using ``threads`` threads.
 
-    audio_path = sys.argv[1]
-    output_srt_path = sys.argv[2]
+    Memory grows with ``workers`` (one model per process); CPU use with
+    ``workers * threads``.
+    """
+    # spawn, not fork: forking a process that has touched torch is unsafe.
+    context = multiprocessing.get_context('spawn')
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=context,
+        initializer=_init_pool_worker, initargs=(threads,),
+    )
+
+
+def load_checkpoints(checkpoint_dir, chunks):
+    """Return {chunk index: segments} for chunks an earlier run already finished.
+
+    A checkpoint only counts if it was made for exactly the same chunk, so
+    changing the chunk plan simply starts over.
+    """
+    done = {}
+    if not checkpoint_dir:
+        return done
+    for i, chunk in enumerate(chunks):
+        try:
+            with open(os.path.join(checkpoint_dir, f"chunk-{i:04d}.json"), encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if checkpoint.get("chunk") == list(chunk):
+            done[i] = checkpoint["segments"]
+    return done
+
+
+def save_checkpoint(checkpoint_dir, index, chunk, segments):
+    """Persist one finished chunk; written atomically so a crash never leaves half a file."""
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = os.path.join(checkpoint_dir, f"chunk-{index:04d}.json")
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump({"chunk": list(chunk), "segments": segments}, f)
+    os.replace(path + ".tmp", path)
 
+
+def transcribe_file(model, audio_path, output_srt_path, pool=None, checkpoint_dir=None, on_progress=None):
+    """Transcribe audio_path and write an SRT file.
+
+    Chunks run on ``pool`` (see make_pool) in parallel when one is given,
+    otherwise one after another on ``model``. With ``checkpoint_dir`` each
+    finished chunk is saved there and chunks saved by an earlier, interrupted
+    run are not transcribed again. ``on_progress(done, chunks, segments)``
+    is called after every chunk with the segments finished so far.
+    """
     if not os.path.exists(audio_path):
-        print(f"Error: Audio file not found at {audio_path}")
-        sys.exit(1)
+        raise FileNotFoundError(f"Audio file not found at {audio_path}")
+
+    duration = get_duration(audio_path)
+    if duration is None:
+        raise RuntimeError("Could not determine audio duration.")
+
+    chunks = plan_chunks(duration)
+    done = load_checkpoints(checkpoint_dir, chunks)
+    todo = [i for i in range(len(chunks)) if i not in done]
+    if len(chunks) > 1:
+        print(f"Processing in {len(chunks)} chunks ({len(done)} already checkpointed)...")
+
+    def finished(i, segments):
+        done[i] = segments
+        if checkpoint_dir:
+            save_checkpoint(checkpoint_dir, i, chunks[i], segments)
+        if on_progress:
+            order = sorted(done)
+            on_progress(len(done), len(chunks), stitch_segments([chunks[j] for j in order], [done[j] for j in order]))
+
+    if pool is not None:
+        futures = {pool.submit(_pool_transcribe, audio_path, chunks[i]): i for i in todo}
+        for future in as_completed(futures):
+            finished(futures[future], future.result())
+    elif todo:
+        buffers = _get_buffers(2)
+        # ffmpeg decodes chunk N+1 on a helper thread while chunk N is
+        # transcribed; the pipe read releases the GIL.
+        with ThreadPoolExecutor(max_workers=1) as decoder:
+            next_samples = decoder.submit(decode_chunk, audio_path, chunks[todo[0]], buffers[0])
+            for n, i in enumerate(todo):
+                samples = next_samples.result()
+                if n + 1 < len(todo):
+                    next_samples = decoder.submit(decode_chunk, audio_path, chunks[todo[n + 1]], buffers[(n + 1) % 2])
+                if len(chunks) > 1:
+                    print(f"  Chunk {i+1}/{len(chunks)} (starting at {chunks[i].start}s)...")
+                finished(i, transcribe_chunk(model, samples, chunks[i].start))
+
+    write_srt(stitch_segments(chunks, [done[i] for i in range(len(chunks))]), output_srt_path)
+
+
+def load_model(threads=1):
+    import whisper
+    if torch:
+        # Few threads per model saves resources and prevents OOM; scale out
+        # with more pool workers instead.
+        torch.set_num_threads(threads)
+    # Load model (tiny for speed/efficiency/low memory)
+    return whisper.load_model("tiny")
+
+
+def load_transcriber(workers, threads):
+    """Return (model, pool) for transcribe_file: a local model, or a warm pool."""
+    if workers > 1:
+        pool = make_pool(workers, threads)
+        # Start every process now so their models load before the first job.
+        for future in [pool.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+        return None, pool
+    return load_model(threads), None
+
+
+def serve(workers=1, threads=1):
+    """Engine mode: load the model once, then transcribe jobs read from stdin.
+
+    Each stdin line is a JSON job ``{"audio_path": ..., "output_srt_path": ...,
+    "checkpoint_dir": ...}`` (checkpoint_dir optional) and gets exactly one
+    JSON reply line on stdout: ``{"ok": true}`` or ``{"ok": false, "error":
+    "..."}``. A ``{"event": "ready"}`` line is sent once the model is
+    loaded. While a checkpointed job runs, ``{"event": "progress",
+    "completed": n, "total": m}`` follows each chunk, with the transcript so
+    far in ``<checkpoint_dir>/partial.srt``. Everything else the script
+    prints goes to stderr so it cannot corrupt the protocol.
+    """
+    protocol = os.fdopen(os.dup(1), 'w', buffering=1)
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+
+    def reply(message):
+        protocol.write(json.dumps(message) + "\n")
 
     try:
-        import whisper
-        if torch:
-            # Limit torch to single thread to save resources and prevent OOM
-            torch.set_num_threads(1)
-    except ImportError:
+        model, pool = load_transcriber(workers, threads)
+    except (ImportError, BrokenProcessPool):
         print("Error: Required package (openai-whisper) is not installed.")
         sys.exit(1)
+    reply({"event": "ready"})
 
-    duration = get_duration(audio_path)
-    if duration is None:
-        print("Error: Could not determine audio duration.")
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            job = json.loads(line)
+            checkpoint_dir = job.get("checkpoint_dir")
+
+            def on_progress(completed, total, segments):
+                write_srt(segments, os.path.join(checkpoint_dir, "partial.srt"))
+                reply({"event": "progress", "completed": completed, "total": total})
+
+            transcribe_file(
+                model, job["audio_path"], job["output_srt_path"], pool=pool,
+                checkpoint_dir=checkpoint_dir, on_progress=on_progress if checkpoint_dir else None,
+            )
+            reply({"ok": True})
+        except BrokenProcessPool as e:
+            # A pool process died (most likely OOM); let the worker restart us.
+            reply({"ok": False, "error": f"Transcription process crashed: {e}"})
+            sys.exit(1)
+        except Exception as e:
+            print(f"Error during transcription: {e}")
+            reply({"ok": False, "error": str(e)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe audio to SRT with Whisper.")
+    parser.add_argument('audio_path', nargs='?')
+    parser.add_argument('output_srt_path', nargs='?')
+    parser.add_argument('--serve', action='store_true', help="Run as a long-lived engine (see serve()).")
+    parser.add_argument(
+        '--workers', type=int, default=int(os.environ.get('TRANSCRIBE_WORKERS', 1)),
+        help="Chunks transcribed in parallel, each in its own process with its own model.",
+    )
+    parser.add_argument(
+        '--threads', type=int, default=int(os.environ.get('TRANSCRIBE_THREADS', 1)),
+        help="Torch threads per model.",
+    )
+    args = parser.parse_args()
+    workers, threads = max(1, args.workers), max(1, args.threads)
+
+    if args.serve:
+        serve(workers, threads)
+        return
+
+    if not args.audio_path or not args.output_srt_path:
+        parser.print_usage()
+        sys.exit(1)
+
+    if not os.path.exists(args.audio_path):
+        print(f"Error: Audio file not found at {args.audio_path}")
         sys.exit(1)
 
     try:
-        # Load model (tiny for speed/efficiency/low memory)
-        model = whisper.load_model("tiny")
-
-        all_segments = []
-        chunk_length = 1200  # 20 minutes in seconds
-
-        if duration <= chunk_length + 60: # Extra 60s buffer to avoid splitting very short overflows
-            # Process as a single file if it's short enough
-            all_segments = transcribe_chunk(model, audio_path, 0)
-        else:
-            # Process in chunks to save memory
-            num_chunks = math.ceil(duration / chunk_length)
-            print(f"Processing in {num_chunks} chunks...")
-
-            for i in range(num_chunks):
-                start_time = i * chunk_length
-                print(f"  Chunk {i+1}/{num_chunks} (starting at {start_time}s)...")
-
-                with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_chunk:
-                    tmp_chunk_path = tmp_chunk.name
-
-                try:
-                    # Extract 20-minute chunk using ffmpeg, resampled to 16k mono
-                    extract_cmd = [
-                        'ffmpeg', '-y', '-ss', str(start_time), '-t', str(chunk_length),
-                        '-i', audio_path, '-ar', '16000', '-ac', '1', tmp_chunk_path
-                    ]
-                    subprocess.check_call(extract_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-                    # Transcribe this chunk
-                    chunk_segments = transcribe_chunk(model, tmp_chunk_path, start_time)
-                    all_segments.extend(chunk_segments)
-
-                finally:
-                    if os.path.exists(tmp_chunk_path):
-                        os.remove(tmp_chunk_path)
-
-        # Convert all collected segments to SRT and write to file
-        with open(output_srt_path, 'w', encoding='utf-8') as f:
-            for i, segment in enumerate(all_segments):
-                start = format_timestamp(segment["start"])
-                end = format_timestamp(segment["end"])
-                text = segment["text"]
-                f.write(f"{i+1}\n{start} --> {end}\n{text}\n\n")
-
-        print(f"Successfully transcribed to {output_srt_path}")
+        model, pool = load_transcriber(workers, threads)
+    except (ImportError, BrokenProcessPool):
+        print("Error: Required package (openai-whisper) is not installed.")
+        sys.exit(1)
 
+    try:
+        transcribe_file(model, args.audio_path, args.output_srt_path, pool=pool)
+        print(f"Successfully transcribed to {args.output_srt_path}")
     except Exception as e:
         print(f"Error during transcription: {e}")
         sys.exit(1)
+    finally:
+        if pool is not None:
+            pool.shutdown()
 
 if __name__ == "__main__":
     if torch:
@@ -0,0 +1,86 @@
+"""Cached, per-track facts for serving audio (see stream_track).
+
+Before sending a byte, stream_track needs the file's path, size,
+modification time, MIME type and ETag, the version its URLs carry and
+whether there is an HLS alternative (access comes from player.access).
+These only change when the track's file or owner does, or a rendition is
+ready, so they are worked out then (``refresh_track_media``, after the
+transaction commits) and kept in the cache under the track's id. A range
+request then costs a cache read before the disk read: no query, no stat.
+
+The cache is shared by every service (settings.CACHES), so refreshes made
+by run_media_worker reach the web tier. Receivers in player.models
+refresh the entry on every save and drop it on delete, run_media_worker
+refreshes it when a rendition is ready, and ``track_media`` rebuilds a
+missing one.
+"""
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db import transaction
+from django.urls import reverse
+
+from .streaming import describe_file, media_version
+
+# Backstop for a change nothing refreshes.
+TRACK_MEDIA_TIMEOUT = 24 * 3600
+
+# ``media`` is a streaming.MediaDescriptor; ``hls_url`` is None until a
+# rendition is ready.
+TrackMedia = namedtuple('TrackMedia', 'version media hls_url')
+
+
+def _key(track_id):
+    return f'player:track-media:{track_id}'
+
+
+def describe_track(track):
+    """TrackMedia for a Track; stats its file."""
+    from .models import TrackRendition
+    has_hls = TrackRendition.objects.filter(track_id=track.pk, status='ready').exists()
+    return TrackMedia(
+        media_version(track.file.name, track.file_size), describe_file(track.file),
+        reverse('track_hls', args=[track.pk]) if has_hls else None,
+    )
+
+
+def track_media(track_id, refresh=False):
+    """Cached TrackMedia for a track, or None if there is no such track.
+
+    ``refresh`` rebuilds the entry even if one is cached (for one naming a
+    file that is gone).
+    """
+    from .models import Track
+    entry = None if refresh else cache.get(_key(track_id))
+    if entry is None:
+        track = Track.objects.filter(pk=track_id).only('file', 'file_size').first()
+        if track is None:
+            return None
+        entry = describe_track(track)
+        cache.set(_key(track_id), entry, TRACK_MEDIA_TIMEOUT)
+    return entry
+
+
+def refresh_track_media(tracks):
+    """Recompute these tracks' cached TrackMedia when the current transaction commits."""
+    tracks = list(tracks)
+
+    def refresh():
+        entries = {}
+        for track in tracks:
+            try:
+                entries[_key(track.pk)] = describe_track(track)
+            except (OSError, ValueError):
+                # No file (yet); track_media will try again when asked.
+                cache.delete(_key(track.pk))
+        cache.set_many(entries, TRACK_MEDIA_TIMEOUT)
+
+    if tracks:
+        transaction.on_commit(refresh)
+
+
+def forget_track_media(track_ids):
+    """Drop these tracks' cached TrackMedia when the current transaction commits."""
+    keys = [_key(track_id) for track_id in track_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
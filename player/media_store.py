@@ -0,0 +1,163 @@
+"""Content-addressed storage for track audio and icons.
+
+With MEDIA_CONTENT_ADDRESSED on, Track.file and Track.icon are saved by
+ContentAddressedStorage. A file's name is the SHA-256 of its bytes, under
+``blobs/`` (``blobs/ab/cd/abcd....mp3``), so uploading a file a second
+time reuses the stored copy instead of writing a new one. The hash is
+worked out while the upload arrives (the Hashing*UploadHandlers), or, for
+other files, while they are copied in.
+
+Blob files are shared, so nothing deletes one directly. Each has a
+MediaBlob row counting the Track fields (and finished UploadSessions) that
+name it. When the count drops to zero, the row and the file are deleted.
+Files written or reused within BLOB_GRACE are kept until
+collect_media_blobs sweeps them, because a request may have stored one and
+not yet saved the track that uses it.
+
+Files stored before the setting was turned on keep their names and are
+not counted.
+"""
+import errno
+import hashlib
+import os
+import tempfile
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+BLOB_PREFIX = 'blobs'
+STAGING_DIR = f'{BLOB_PREFIX}/tmp'
+BLOB_GRACE = timedelta(hours=1)
+
+
+def blob_digest(name):
+    """The SHA-256 in a content-addressed file name, or None for any other name."""
+    parts = (name or '').split('/')
+    if len(parts) != 4 or parts[0] != BLOB_PREFIX:
+        return None
+    digest = os.path.splitext(parts[3])[0]
+    return digest if len(digest) == 64 and parts[1:3] == [digest[:2], digest[2:4]] else None
+
+
+def blob_name(digest, extension):
+    return f'{BLOB_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{extension.lower()}'
+
+
+def _hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage (over MEDIA_ROOT) that keeps one copy of each distinct file.
+
+    ``save()`` ignores the name it is given except for the extension, and
+    returns the blob's name. Other names (files stored before switching
+    over) behave as in FileSystemStorage.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The content decides the name; an existing file is the same file.
+        return name
+
+    def _stage(self, content):
+        """Copy ``content`` into the staging directory, hashing it; returns (path, digest)."""
+        staging = self.path(STAGING_DIR)
+        os.makedirs(staging, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=staging)
+        sha256 = hashlib.sha256()
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in content.chunks():
+                sha256.update(chunk)
+                f.write(chunk)
+        return path, sha256.hexdigest()
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1]
+        staged = None
+        if hasattr(content, 'temporary_file_path'):
+            source = content.temporary_file_path()
+            digest = getattr(content, 'sha256', None) or _hash_file(source)
+        else:
+            source, digest = staged = self._stage(content)
+
+        name = blob_name(digest, extension)
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            try:
+                # A hard link puts the file in place atomically and, unlike
+                # a rename, fails if the blob is already there.
+                os.link(source, path)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # The upload's temporary file is on another filesystem.
+                staged = self._stage(content)
+                os.link(staged[0], path)
+            if self.file_permissions_mode is not None:
+                os.chmod(path, self.file_permissions_mode)
+        except FileExistsError:
+            # Stored already; mark it as just used so the sweep leaves it.
+            os.utime(path)
+        finally:
+            if staged:
+                os.unlink(staged[0])
+        return name
+
+    def recently_used(self, name):
+        try:
+            return time.time() - os.path.getmtime(self.path(name)) < BLOB_GRACE.total_seconds()
+        except FileNotFoundError:
+            return False
+
+    def delete(self, name):
+        """Delete ``name``, unless it is a blob still in use or just stored (see module docstring)."""
+        if blob_digest(name) is not None:
+            from .models import MediaBlob
+            if self.recently_used(name) or MediaBlob.objects.filter(name=name, refcount__gt=0).exists():
+                return
+        super().delete(name)
+
+
+def media_storage():
+    """The storage for Track.file and Track.icon in this deployment."""
+    if settings.MEDIA_CONTENT_ADDRESSED:
+        return ContentAddressedStorage()
+    return default_storage
+
+
+class _HashingMixin:
+    """Adds a ``sha256`` attribute to each uploaded file, computed as it arrives."""
+
+    def new_file(self, *args, **kwargs):
+        self._sha256 = hashlib.sha256()
+        return super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        passed_on = super().receive_data_chunk(raw_data, start)
+        if passed_on is None:
+            # This handler kept the chunk (and the next one won't see it).
+            self._sha256.update(raw_data)
+        return passed_on
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        if uploaded is not None:
+            uploaded.sha256 = self._sha256.hexdigest()
+        return uploaded
+
+
+class HashingMemoryFileUploadHandler(_HashingMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(_HashingMixin, TemporaryFileUploadHandler):
+    pass
+
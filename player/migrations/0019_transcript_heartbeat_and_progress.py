@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("player", "0018_podcastprogress_recorded_at_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="transcript",
+            name="heartbeat_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="transcript",
+            name="chunks_completed",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="transcript",
+            name="chunks_total",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("player", "0019_transcript_heartbeat_and_progress"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="track",
+            name="duration_attempts",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="track",
+            name="duration_retry_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
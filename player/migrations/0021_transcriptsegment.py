@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('player', '0020_track_duration_attempts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TranscriptSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('start_ms', models.PositiveIntegerField()),
+                ('end_ms', models.PositiveIntegerField()),
+                ('text', models.TextField()),
+                ('transcript', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='player.transcript')),
+            ],
+            options={
+                'ordering': ['transcript', 'index'],
+                'constraints': [models.UniqueConstraint(fields=('transcript', 'index'), name='unique_transcript_segment_index')],
+            },
+        ),
+    ]
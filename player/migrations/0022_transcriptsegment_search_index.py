@@ -0,0 +1,77 @@
+from django.db import migrations, OperationalError
+
+# Full-text indexes for player/search.py. Neither is known to the ORM, so
+# they are created with raw SQL for whichever database is in use.
+#
+# SQLite: an FTS5 table over player_transcriptsegment kept in sync by
+# triggers. Django rebuilds SQLite tables on most AlterFields, which drops
+# the triggers, so a future migration altering TranscriptSegment must
+# recreate them.
+
+PG_FORWARD = [
+    """ALTER TABLE player_transcriptsegment ADD COLUMN search_vector tsvector
+       GENERATED ALWAYS AS (to_tsvector('english', text)) STORED""",
+    "CREATE INDEX player_transcriptsegment_search_idx ON player_transcriptsegment USING GIN (search_vector)",
+]
+PG_BACKWARD = [
+    "ALTER TABLE player_transcriptsegment DROP COLUMN search_vector",
+]
+
+SQLITE_FORWARD = [
+    """CREATE VIRTUAL TABLE player_transcriptsegment_fts USING fts5(
+       text, content='player_transcriptsegment', content_rowid='id', tokenize='porter unicode61')""",
+    """CREATE TRIGGER player_transcriptsegment_fts_ai AFTER INSERT ON player_transcriptsegment BEGIN
+       INSERT INTO player_transcriptsegment_fts(rowid, text) VALUES (new.id, new.text);
+       END""",
+    """CREATE TRIGGER player_transcriptsegment_fts_ad AFTER DELETE ON player_transcriptsegment BEGIN
+       INSERT INTO player_transcriptsegment_fts(player_transcriptsegment_fts, rowid, text) VALUES ('delete', old.id, old.text);
+       END""",
+    """CREATE TRIGGER player_transcriptsegment_fts_au AFTER UPDATE ON player_transcriptsegment BEGIN
+       INSERT INTO player_transcriptsegment_fts(player_transcriptsegment_fts, rowid, text) VALUES ('delete', old.id, old.text);
+       INSERT INTO player_transcriptsegment_fts(rowid, text) VALUES (new.id, new.text);
+       END""",
+    "INSERT INTO player_transcriptsegment_fts(player_transcriptsegment_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS player_transcriptsegment_fts_ai",
+    "DROP TRIGGER IF EXISTS player_transcriptsegment_fts_ad",
+    "DROP TRIGGER IF EXISTS player_transcriptsegment_fts_au",
+    "DROP TABLE IF EXISTS player_transcriptsegment_fts",
+]
+
+
+def _run(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _run(schema_editor, PG_FORWARD)
+    elif vendor == 'sqlite':
+        try:
+            _run(schema_editor, SQLITE_FORWARD[:1])
+        except OperationalError:
+            # SQLite built without FTS5; search falls back to substring matching.
+            return
+        _run(schema_editor, SQLITE_FORWARD[1:])
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _run(schema_editor, PG_BACKWARD)
+    elif vendor == 'sqlite':
+        _run(schema_editor, SQLITE_BACKWARD)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("player", "0021_transcriptsegment"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
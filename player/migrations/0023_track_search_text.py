@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:02
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction, DatabaseError
+
+from player.text import normalize_search_text, search_grams
+
+
+def index_existing_tracks(apps, schema_editor):
+    Track = apps.get_model('player', 'Track')
+    TrackSearchGram = apps.get_model('player', 'TrackSearchGram')
+    for track in Track.objects.only('id', 'name', 'artist').iterator(chunk_size=500):
+        track.search_text = normalize_search_text(track.name, track.artist)
+        track.save(update_fields=['search_text'])
+        TrackSearchGram.objects.bulk_create(
+            [TrackSearchGram(track_id=track.id, gram=gram) for gram in search_grams(track.search_text)]
+        )
+
+
+def create_trigram_index(apps, schema_editor):
+    # PostgreSQL only: a pg_trgm GIN index lets LIKE '%...%' and word
+    # similarity on search_text use an index (see player/search.py). Without
+    # the extension, search falls back to the TrackSearchGram table.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except DatabaseError:
+        return
+    schema_editor.execute(
+        "CREATE INDEX player_track_search_text_trgm ON player_track USING GIN (search_text gin_trgm_ops)"
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS player_track_search_text_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('player', '0022_transcriptsegment_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='track',
+            name='search_text',
+            field=models.CharField(blank=True, default='', editable=False, max_length=511),
+        ),
+        migrations.CreateModel(
+            name='TrackSearchGram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(max_length=3)),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_grams', to='player.track')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('gram', 'track'), name='unique_track_search_gram')],
+            },
+        ),
+        migrations.RunPython(index_existing_tracks, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('player', '0023_track_search_text'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usertracklastplayed',
+            index=models.Index(fields=['user', '-last_played', 'track'], name='user_last_played_order'),
+        ),
+    ]
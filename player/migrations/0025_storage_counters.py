@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:15
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_storage_counters(apps, schema_editor):
+    UserProfile = apps.get_model('player', 'UserProfile')
+    StorageTotals = apps.get_model('player', 'StorageTotals')
+    Track = apps.get_model('player', 'Track')
+    used = (
+        Track.objects.filter(owner_id=OuterRef('user_id')).order_by()
+        .values('owner_id').annotate(total=Sum('file_size')).values('total')
+    )
+    UserProfile.objects.update(storage_used_bytes=Coalesce(Subquery(used), 0))
+    allocated = UserProfile.objects.aggregate(total=Sum('storage_limit_gb'))['total'] or 0
+    StorageTotals.objects.update_or_create(pk=1, defaults={'allocated_limit_gb': allocated})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('player', '0024_usertracklastplayed_order'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageTotals',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('allocated_limit_gb', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='storage_used_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_storage_counters, migrations.RunPython.noop),
+    ]
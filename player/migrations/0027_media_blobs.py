@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:35
+
+import django.utils.timezone
+import player.media_store
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('player', '0026_uploadsession'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('sha256', models.CharField(db_index=True, max_length=64)),
+                ('size', models.BigIntegerField(default=0)),
+                ('refcount', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='storage_charged',
+            field=models.BooleanField(default=True, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='track',
+            name='file',
+            field=models.FileField(storage=player.media_store.media_storage, upload_to='tracks/'),
+        ),
+        migrations.AlterField(
+            model_name='track',
+            name='icon',
+            field=models.ImageField(blank=True, null=True, storage=player.media_store.media_storage, upload_to='track_icons/'),
+        ),
+        migrations.AddIndex(
+            model_name='track',
+            index=models.Index(fields=['owner', 'file'], name='track_owner_file'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:10
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('player', '0027_media_blobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('profile', models.CharField(max_length=20)),
+                ('source_name', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('file_size', models.BigIntegerField(default=0)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('retry_at', models.DateTimeField(blank=True, null=True)),
+                ('error_message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='player.track')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'retry_at'], name='rendition_queue')],
+                'unique_together': {('track', 'profile')},
+            },
+        ),
+    ]
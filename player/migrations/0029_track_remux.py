@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('player', '0028_track_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='track',
+            name='remux_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='remux_checked_file',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='remux_retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:34
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('player', '0029_track_remux'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetiredFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('retired_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -1,18 +1,95 @@
-from django.db import models
+import os
+import shutil
+import uuid
+from collections import Counter
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.conf import settings
 from django.core.validators import MinValueValidator
+from django.urls import reverse
+from .access import can_access_playlist, invalidate_access, playlist_audience
+from .header_cache import BOOKMARKS, PLAYBACK, invalidate_header
+from .jobs import notify_workers, DURATION_CHANNEL, MEDIA_CHANNEL, TRANSCRIPTION_CHANNEL
+from .media_cache import forget_track_media, refresh_track_media
+from .media_store import blob_digest, media_storage
+from .streaming import media_version
+from .text import normalize_search_text, search_grams
+from .transcripts import parse_srt
+
+GB = 1024 * 1024 * 1024
+
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     storage_limit_gb = models.FloatField(default=settings.DEFAULT_USER_STORAGE_LIMIT_GB, validators=[MinValueValidator(0.0)])
+    # Sum of the file_size of the user's tracks, kept current by Track.save()
+    # and track deletion (reconcile_storage_usage repairs any drift). Lock
+    # the row (select_for_update) around a quota check and the write it
+    # guards so concurrent uploads can't both squeeze under the limit.
+    storage_used_bytes = models.BigIntegerField(default=0)
+    # Full length of the user's resumable uploads not yet turned into tracks
+    # (see player/uploads.py), held against the limit from the start.
+    storage_reserved_bytes = models.BigIntegerField(default=0)
+
+    COUNTER_FIELDS = ('storage_used_bytes', 'storage_reserved_bytes')
 
     def __str__(self):
         return self.user.username
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_storage_limit_gb = instance.__dict__.get('storage_limit_gb')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # The counters only move through F() updates; a full save of a copy
+        # loaded earlier must not write their stale values back.
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def storage_limit_bytes(self):
+        return int(self.storage_limit_gb * GB)
+
+    def has_room_for(self, extra_bytes):
+        return self.storage_used_bytes + self.storage_reserved_bytes + extra_bytes <= self.storage_limit_bytes
+
+
+class StorageTotals(models.Model):
+    """Site-wide storage figures, kept as a single row so checks are one lookup."""
+    # Sum of every UserProfile.storage_limit_gb, maintained by the signals below.
+    allocated_limit_gb = models.FloatField(default=0)
+
+    SINGLETON_PK = 1
+
+    @classmethod
+    def load(cls, lock=False):
+        """The totals row, created if missing; ``lock`` holds it until the transaction ends."""
+        queryset = cls.objects.select_for_update() if lock else cls.objects
+        totals, _ = queryset.get_or_create(pk=cls.SINGLETON_PK)
+        return totals
+
+    @classmethod
+    def adjust_allocated(cls, delta_gb):
+        if not cls.objects.filter(pk=cls.SINGLETON_PK).update(allocated_limit_gb=models.F('allocated_limit_gb') + delta_gb):
+            cls.objects.get_or_create(pk=cls.SINGLETON_PK)
+            cls.objects.filter(pk=cls.SINGLETON_PK).update(allocated_limit_gb=models.F('allocated_limit_gb') + delta_gb)
+
+
+def adjust_storage_used(user_id, delta_bytes, field='storage_used_bytes'):
+    """Add ``delta_bytes`` to one of the user's storage counters with a single UPDATE."""
+    if user_id is not None and delta_bytes:
+        UserProfile.objects.filter(user_id=user_id).update(**{field: models.F(field) + delta_bytes})
+
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
@@ -22,6 +99,25 @@ def create_user_profile(sender, instance, created, **kwargs):
 def save_user_profile(sender, instance, **kwargs):
     instance.userprofile.save()
 
+@receiver(post_save, sender=UserProfile)
+def track_allocated_storage(sender, instance, created, **kwargs):
+    previous = 0 if created else getattr(instance, '_saved_storage_limit_gb', instance.storage_limit_gb)
+    if instance.storage_limit_gb != previous:
+        StorageTotals.adjust_allocated(instance.storage_limit_gb - previous)
+    instance._saved_storage_limit_gb = instance.storage_limit_gb
+
+@receiver(post_delete, sender=UserProfile)
+def release_allocated_storage(sender, instance, **kwargs):
+    StorageTotals.adjust_allocated(-getattr(instance, '_saved_storage_limit_gb', instance.storage_limit_gb))
+
+
+class TrackQuerySet(models.QuerySet):
+    def accessible_by(self, user):
+        """Tracks the user owns, or that sit in a playlist shared with them."""
+        return self.filter(
+            models.Q(owner=user) | models.Q(playlists__accessors=user)
+        ).distinct()
+
 
 class Track(models.Model):
     TYPE_CHOICES = (
@@ -31,11 +127,283 @@ class Track(models.Model):
     name = models.CharField(max_length=255)
     artist = models.CharField(max_length=255, blank=True, null=True)
     type = models.CharField(max_length=10, choices=TYPE_CHOICES)
-    file = models.FileField(upload_to='tracks/')
-    icon = models.ImageField(upload_to='track_icons/', null=True, blank=True)
+    file = models.FileField(upload_to='tracks/', storage=media_storage)
+    icon = models.ImageField(upload_to='track_icons/', null=True, blank=True, storage=media_storage)
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     duration = models.FloatField(default=0)
     file_size = models.BigIntegerField(default=0)
+    # Bookkeeping for the fix_track_durations worker (see player/durations.py):
+    # failed probes so far, and when the track may be probed again.
+    duration_attempts = models.PositiveSmallIntegerField(default=0)
+    duration_retry_at = models.DateTimeField(null=True, blank=True)
+    # Bookkeeping for run_media_worker's remux (see player/remux.py): the
+    # file last made seekable in one request (a new file differs from it),
+    # failed remuxes so far, and when the file may be tried again.
+    remux_checked_file = models.CharField(max_length=100, blank=True, default='', editable=False)
+    remux_attempts = models.PositiveSmallIntegerField(default=0)
+    remux_retry_at = models.DateTimeField(null=True, blank=True)
+    # Normalised "name artist" for library search (see player/search.py);
+    # kept up to date by save() together with its TrackSearchGram rows.
+    search_text = models.CharField(max_length=511, blank=True, default='', editable=False)
+    # Whether file_size counts towards the owner's storage_used_bytes. Of an
+    # owner's tracks sharing one stored file (see player/media_store.py)
+    # only one is charged, so the same upload twice costs its size once.
+    storage_charged = models.BooleanField(default=True, editable=False)
+
+    objects = TrackQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'file'], name='track_owner_file'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    def get_stream_url(self):
+        """The stream URL for this version of the file, which browsers may cache for good."""
+        return f"{reverse('stream_track', args=[self.pk])}?v={media_version(self.file.name, self.file_size)}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_search_text = instance.__dict__.get('search_text')
+        if {'owner_id', 'file_size', 'file', 'storage_charged'} <= instance.__dict__.keys():
+            instance._saved_storage = (
+                instance.owner_id, instance.file_size, instance.__dict__['file'], instance.storage_charged
+            )
+        if {'file', 'icon'} <= instance.__dict__.keys():
+            instance._saved_files = (instance.__dict__['file'], instance.__dict__['icon'])
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.search_text = normalize_search_text(self.name, self.artist)
+        update_fields = kwargs.get('update_fields')
+        storage_fields = {'owner', 'owner_id', 'file', 'file_size'}
+        if update_fields is not None:
+            implied = set()
+            if {'name', 'artist'} & set(update_fields):
+                implied.add('search_text')
+            if storage_fields & set(update_fields):
+                implied.add('storage_charged')
+            if implied:
+                kwargs['update_fields'] = {*update_fields, *implied}
+        if self._state.adding:
+            saved_storage, saved_files = (None, 0, '', False), ('', '')
+        else:
+            # Unknown old values, from a deferred load, are left to
+            # reconcile_storage_usage and collect_media_blobs.
+            tracked = update_fields is None or storage_fields & set(update_fields)
+            saved_storage = getattr(self, '_saved_storage', None) if tracked else None
+            tracked = update_fields is None or {'file', 'icon'} & set(update_fields)
+            saved_files = getattr(self, '_saved_files', None) if tracked else None
+        with transaction.atomic():
+            # Store new files first (FileField.pre_save would, a moment
+            # later): with content-addressed storage, their final names
+            # decide whether the file is one the owner already has.
+            for fieldfile in (self.file, self.icon):
+                if fieldfile and not fieldfile._committed:
+                    fieldfile.save(fieldfile.name, fieldfile.file, save=False)
+            counter_changes = self._charge_storage(saved_storage) if saved_storage is not None else []
+            super().save(*args, **kwargs)
+            for user_id, delta in counter_changes:
+                adjust_storage_used(user_id, delta)
+            if saved_storage is not None and saved_storage[0] != self.owner_id:
+                # A new track, or one given to someone else.
+                invalidate_access([saved_storage[0], self.owner_id])
+            self._saved_storage = (self.owner_id, self.file_size, self.file.name, self.storage_charged)
+            if saved_files is not None:
+                files = Counter((self.file.name, self.icon.name))
+                MediaBlob.acquire((files - Counter(saved_files)).elements())
+                MediaBlob.release((Counter(saved_files) - files).elements())
+                self._saved_files = (self.file.name, self.icon.name)
+                if saved_files[0] != self.file.name:
+                    TrackRendition.queue([self])
+        if self.search_text != getattr(self, '_saved_search_text', ''):
+            self.rebuild_search_grams()
+
+    def _charge_storage(self, saved_storage):
+        """Set storage_charged for this save; returns the (user_id, delta) counter changes it implies."""
+        old_owner_id, old_size, old_name, old_charged = saved_storage
+        if (old_owner_id, old_name) == (self.owner_id, self.file.name):
+            return [(self.owner_id, self.file_size - old_size)] if old_charged else []
+        changes = []
+        if old_charged:
+            changes += pass_on_storage_charge(self.pk, old_owner_id, old_name, old_size)
+        self.storage_charged = not self.file.name or not Track.objects.filter(
+            owner_id=self.owner_id, file=self.file.name, storage_charged=True
+        ).exclude(pk=self.pk).exists()
+        if self.storage_charged:
+            changes.append((self.owner_id, self.file_size))
+        return changes
+
+    def rebuild_search_grams(self):
+        """Replace this track's search trigrams; needed after writes that bypass save()."""
+        with transaction.atomic():
+            TrackSearchGram.objects.filter(track_id=self.pk).delete()
+            TrackSearchGram.objects.bulk_create(
+                [TrackSearchGram(track_id=self.pk, gram=gram) for gram in search_grams(self.search_text)]
+            )
+        self._saved_search_text = self.search_text
+
+
+class TrackRendition(models.Model):
+    """A transcoded copy of a track's audio, with its HLS segmentation (see player/renditions.py).
+
+    Made by run_media_worker from the file named by ``source_name``; the
+    files live under ``directory``, which is unique to the row, so they
+    never change once ready.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    )
+    track = models.ForeignKey(Track, on_delete=models.CASCADE, related_name='renditions')
+    profile = models.CharField(max_length=20)
+    source_name = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    # Size of the progressive file (the HLS segments hold the same audio).
+    file_size = models.BigIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    # The claim lease while a worker has it, then the failure backoff.
+    retry_at = models.DateTimeField(null=True, blank=True)
+    error_message = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('track', 'profile')
+        indexes = [models.Index(fields=['status', 'retry_at'], name='rendition_queue')]
+
+    def __str__(self):
+        return f"{self.profile} rendition of track {self.track_id} ({self.status})"
+
+    @property
+    def directory(self):
+        return f'renditions/{self.track_id}/{self.pk}'
+
+    @classmethod
+    def queue(cls, tracks):
+        """Replace renditions made from other files than these tracks' own with pending ones."""
+        from .renditions import PROFILES
+        current = {track.pk: track.file.name for track in tracks if track.pk}
+        if not current:
+            return
+        stale = [
+            rendition.pk for rendition in cls.objects.filter(track_id__in=current).only('track_id', 'source_name')
+            if rendition.source_name != current[rendition.track_id]
+        ]
+        if stale:
+            cls.objects.filter(pk__in=stale).delete()
+        cls.objects.bulk_create([
+            cls(track_id=track_id, profile=profile, source_name=file_name)
+            for track_id, file_name in current.items() if file_name
+            for profile in PROFILES
+        ], ignore_conflicts=True)
+        notify_workers(MEDIA_CHANNEL)
+
+
+@receiver(post_delete, sender=TrackRendition)
+def delete_rendition_files(sender, instance, **kwargs):
+    from django.core.files.storage import default_storage
+    path = default_storage.path(instance.directory)
+    transaction.on_commit(lambda: shutil.rmtree(path, ignore_errors=True))
+
+
+class TrackSearchGram(models.Model):
+    """One trigram of a track's search_text: the portable library search index."""
+    track = models.ForeignKey(Track, on_delete=models.CASCADE, related_name='search_grams')
+    gram = models.CharField(max_length=3)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['gram', 'track'], name='unique_track_search_gram'),
+        ]
+
+    def __str__(self):
+        return f"{self.gram!r} in track {self.track_id}"
+
+
+@receiver(post_save, sender=Track)
+def wake_duration_worker(sender, instance, **kwargs):
+    if instance.duration == 0 and instance.file_size > 0:
+        notify_workers(DURATION_CHANNEL)
+
+def pass_on_storage_charge(track_pk, owner_id, file_name, file_size):
+    """A charged track no longer has this owner and file: charge another that does, or refund.
+
+    Returns the (user_id, delta) counter changes to make.
+    """
+    if file_name:
+        heir = Track.objects.filter(owner_id=owner_id, file=file_name).exclude(pk=track_pk).order_by('pk').first()
+        if heir is not None:
+            Track.objects.filter(pk=heir.pk).update(storage_charged=True)
+            return []
+    return [(owner_id, -file_size)]
+
+@receiver(post_delete, sender=Track)
+def release_track_storage(sender, instance, **kwargs):
+    # Runs after every row of a bulk delete is gone, so a charge is never
+    # passed on to a track deleted along with this one.
+    if hasattr(instance, '_saved_storage'):
+        owner_id, file_size, file_name, charged = instance._saved_storage
+        if charged:
+            for user_id, delta in pass_on_storage_charge(instance.pk, owner_id, file_name, file_size):
+                adjust_storage_used(user_id, delta)
+    if hasattr(instance, '_saved_files'):
+        MediaBlob.release(instance._saved_files)
+
+
+class MediaBlob(models.Model):
+    """A file in the content-addressed media store (see player/media_store.py).
+
+    ``refcount`` is the number of Track.file and Track.icon values, and
+    finished UploadSessions, naming it. The file is deleted with the row
+    when that reaches zero.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField(default=0)
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} references)"
+
+    @staticmethod
+    def storage():
+        return Track._meta.get_field('file').storage
+
+    @classmethod
+    def acquire(cls, names):
+        """Count a reference to each blob in ``names``; other names are ignored."""
+        for name, count in Counter(name for name in names if blob_digest(name)).items():
+            try:
+                size = cls.storage().size(name)
+            except OSError:
+                size = 0
+            blob, _ = cls.objects.get_or_create(name=name, defaults={'sha256': blob_digest(name), 'size': size})
+            cls.objects.filter(pk=blob.pk).update(refcount=models.F('refcount') + count)
+
+    @classmethod
+    def release(cls, names):
+        """Drop a reference to each blob in ``names``, deleting those left with none."""
+        for name, count in Counter(name for name in names if blob_digest(name)).items():
+            with transaction.atomic():
+                blob = cls.objects.select_for_update().filter(name=name).first()
+                if blob is None:
+                    continue
+                if blob.refcount > count:
+                    cls.objects.filter(pk=blob.pk).update(refcount=models.F('refcount') - count)
+                    continue
+                blob.delete()
+                # The storage checks again that nothing uses it by then.
+                transaction.on_commit(lambda name=name: cls.storage().delete(name))
+
+class RetiredFile(models.Model):
+    """A track file replaced by a remux, kept a while for requests still reading it (see player/remux.py)."""
+    name = models.CharField(max_length=255, unique=True)
+    retired_at = models.DateTimeField(default=timezone.now, db_index=True)
 
     def __str__(self):
         return self.name
@@ -54,11 +422,86 @@ class Transcript(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     processing_started_at = models.DateTimeField(null=True, blank=True)
+    # Refreshed by the worker while it holds the job; a 'processing' transcript
+    # whose heartbeat goes stale is reclaimed by another worker.
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    # Progress of long transcriptions, which are done in chunks. While
+    # processing, content holds the chunks finished so far.
+    chunks_completed = models.PositiveIntegerField(default=0)
+    chunks_total = models.PositiveIntegerField(default=0)
     error_message = models.TextField(blank=True, null=True)
 
     def __str__(self):
         return f"Transcript for {self.track.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was loaded so save() only re-parses changed content.
+        instance._saved_content = instance.__dict__.get('content')
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if self.content != getattr(self, '_saved_content', ''):
+            self.rebuild_segments()
+
+    def rebuild_segments(self, content=None):
+        """Replace this transcript's segments with ones parsed from its SRT.
+
+        save() does this when content changes; callers that write content
+        with QuerySet.update() must call it themselves.
+        """
+        if content is None:
+            content = self.content
+        segments = [
+            TranscriptSegment(transcript_id=self.pk, index=i, start_ms=start_ms, end_ms=end_ms, text=text)
+            for i, (start_ms, end_ms, text) in enumerate(parse_srt(content))
+        ]
+        with transaction.atomic():
+            TranscriptSegment.objects.filter(transcript_id=self.pk).delete()
+            TranscriptSegment.objects.bulk_create(segments, batch_size=1000)
+        self._saved_content = content
+
+    @property
+    def checkpoint_dir(self):
+        # Finished chunks are saved here so an interrupted job can resume.
+        return os.path.join(settings.MEDIA_ROOT, 'transcripts', 'checkpoints', str(self.pk))
+
+    @property
+    def is_partial(self):
+        return self.status == 'processing' and self.chunks_completed > 0 and bool(self.content)
+
+
+class TranscriptSegment(models.Model):
+    """One cue of a transcript, parsed out of its SRT once so reads need no parsing."""
+    transcript = models.ForeignKey(Transcript, on_delete=models.CASCADE, related_name='segments')
+    index = models.PositiveIntegerField()
+    start_ms = models.PositiveIntegerField()
+    end_ms = models.PositiveIntegerField()
+    text = models.TextField()
+
+    class Meta:
+        ordering = ['transcript', 'index']
+        constraints = [
+            models.UniqueConstraint(fields=['transcript', 'index'], name='unique_transcript_segment_index'),
+        ]
+
+    def __str__(self):
+        return f"Segment {self.index} of transcript {self.transcript_id}"
+
+
+@receiver(post_save, sender=Transcript)
+def wake_transcription_worker(sender, instance, **kwargs):
+    # Newly queued work, or a cancellation the worker should act on now.
+    if instance.status in ('pending', 'failed'):
+        notify_workers(TRANSCRIPTION_CHANNEL)
+
+
+@receiver(post_delete, sender=Transcript)
+def delete_transcript_checkpoints(sender, instance, **kwargs):
+    shutil.rmtree(instance.checkpoint_dir, ignore_errors=True)
+
 
 class UserPlaybackState(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -93,6 +536,14 @@ class PodcastProgress(models.Model):
         return f"Progress for {self.user.username} on {self.track.name}"
 
 
+class PlaylistQuerySet(models.QuerySet):
+    def accessible_by(self, user):
+        """Playlists a user may view/play: ones they own or are an accessor of."""
+        return self.filter(
+            models.Q(owner=user) | models.Q(accessors=user)
+        ).distinct()
+
+
 class Playlist(models.Model):
     name = models.CharField(max_length=255)
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -105,12 +556,20 @@ class Playlist(models.Model):
     image = models.ImageField(upload_to='playlist_images/', null=True, blank=True)
     tracks = models.ManyToManyField(Track, through='PlaylistItem', related_name='playlists')
 
+    objects = PlaylistQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_owner_id = instance.__dict__.get('owner_id')
+        return instance
+
     def is_accessible_by(self, user):
         """The owner and any accessor may view/play the playlist."""
-        return self.owner_id == user.id or self.accessors.filter(pk=user.id).exists()
+        return self.owner_id == user.id or can_access_playlist(user, self.pk)
 
 import sys
 class PlaylistItem(models.Model):
@@ -127,12 +586,21 @@ class PlaylistItem(models.Model):
 
 
 class UserTrackLastPlayed(models.Model):
+    """When a user last played a track; one row per (user, track).
+
+    Written by the playback ingest path (player.playback.persist_playback).
+    The (user, -last_played, track) index is the per-user sort order for
+    "last played" listings, which walk it a page at a time.
+    """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     track = models.ForeignKey(Track, on_delete=models.CASCADE)
     last_played = models.DateTimeField(default=timezone.now)
 
     class Meta:
         unique_together = ('user', 'track')
+        indexes = [
+            models.Index(fields=['user', '-last_played', 'track'], name='user_last_played_order'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} last played {self.track.name} at {self.last_played}"
@@ -147,4 +615,114 @@ class Bookmark(models.Model):
     playlist = models.ForeignKey('Playlist', on_delete=models.SET_NULL, null=True, blank=True)
 
     def __str__(self):
-        return f"{self.user.username}'s bookmark: {self.name}"
\ No newline at end of file
+        return f"{self.user.username}'s bookmark: {self.name}"
+
+
+# Keep the cached page header (player.header_cache) in step with the rows it shows.
+
+@receiver([post_save, post_delete], sender=Bookmark)
+def invalidate_bookmark_header(sender, instance, **kwargs):
+    invalidate_header(BOOKMARKS, [instance.user_id])
+
+@receiver([post_save, post_delete], sender=UserPlaybackState)
+def invalidate_playback_header(sender, instance, **kwargs):
+    invalidate_header(PLAYBACK, [instance.user_id])
+
+@receiver([post_save, pre_delete], sender=Track)
+def invalidate_track_headers(sender, instance, created=False, **kwargs):
+    if not created:
+        invalidate_headers_showing([instance.pk])
+
+def invalidate_headers_showing(track_ids):
+    """Invalidate the headers that show these tracks; for writes that skip save()."""
+    # The header shows the track's name, artist, icon and duration.
+    invalidate_header(PLAYBACK, UserPlaybackState.objects.filter(track__in=track_ids).values_list('user_id', flat=True))
+    invalidate_header(BOOKMARKS, Bookmark.objects.filter(track__in=track_ids).values_list('user_id', flat=True))
+
+@receiver([post_save, pre_delete], sender=Playlist)
+def invalidate_playlist_headers(sender, instance, created=False, **kwargs):
+    if not created:
+        invalidate_header(PLAYBACK, UserPlaybackState.objects.filter(playlist=instance).values_list('user_id', flat=True))
+
+
+# Keep the cached stream descriptors (player.media_cache) in step with the files.
+
+@receiver(post_save, sender=Track)
+def refresh_stream_media(sender, instance, **kwargs):
+    refresh_track_media([instance])
+
+@receiver(post_delete, sender=Track)
+def forget_stream_media(sender, instance, **kwargs):
+    forget_track_media([instance.pk])
+
+
+# Keep the cached access grants (player.access) in step with ownership and sharing.
+# Track.save() handles new and re-owned tracks.
+
+@receiver(post_delete, sender=Track)
+def invalidate_track_access(sender, instance, **kwargs):
+    invalidate_access([instance.owner_id])
+
+@receiver(post_save, sender=Playlist)
+def invalidate_saved_playlist_access(sender, instance, **kwargs):
+    invalidate_access([getattr(instance, '_saved_owner_id', None), instance.owner_id, *playlist_audience([instance.pk])])
+    instance._saved_owner_id = instance.owner_id
+
+@receiver(pre_delete, sender=Playlist)
+def invalidate_deleted_playlist_access(sender, instance, **kwargs):
+    # Before the accessor rows go with it.
+    invalidate_access([instance.owner_id, *playlist_audience([instance.pk])])
+
+@receiver([post_save, post_delete], sender=PlaylistItem)
+def invalidate_playlist_item_access(sender, instance, **kwargs):
+    # The owner has the track already; only accessors gain or lose it.
+    invalidate_access(playlist_audience([instance.playlist_id]))
+
+@receiver(m2m_changed, sender=Playlist.accessors.through)
+def invalidate_accessor_access(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        invalidate_access([instance.pk] if reverse else pk_set)
+    elif action == 'pre_clear':
+        invalidate_access([instance.pk] if reverse else playlist_audience([instance.pk]))
+
+@receiver(m2m_changed, sender=Playlist.tracks.through)
+def invalidate_playlist_tracks_access(sender, instance, action, reverse, pk_set, **kwargs):
+    # Playlist.tracks.add() and friends bulk create PlaylistItems, without post_save.
+    if action in ('post_add', 'post_remove'):
+        invalidate_access(playlist_audience(pk_set if reverse else [instance.pk]))
+    elif action == 'pre_clear':
+        if reverse:
+            invalidate_access(playlist_audience(instance.playlistitem_set.values('playlist_id')))
+        else:
+            invalidate_access(playlist_audience([instance.pk]))
+
+
+class UploadSession(models.Model):
+    """A resumable upload, in progress or finished and waiting to become a track.
+
+    See player/uploads.py for the protocol. Its ``length`` is counted in the
+    owner's UserProfile.storage_reserved_bytes for as long as the row exists.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    length = models.BigIntegerField()
+    # Bytes received so far; the .part file is cut back to this on each write.
+    offset = models.BigIntegerField(default=0)
+    # Once complete: the assembled file's name in storage, and its duration
+    # and tags as read from it.
+    file_name = models.CharField(max_length=255, blank=True, default='')
+    metadata = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Upload of {self.filename} ({self.offset}/{self.length})"
+
+    @property
+    def complete(self):
+        return bool(self.file_name)
+
+    @property
+    def part_name(self):
+        return f'tracks/{self.pk}.part'
@@ -0,0 +1,238 @@
+"""Keyset (cursor) pagination.
+
+Instead of COUNT(*) plus OFFSET, each page is fetched as "the next N rows
+after the last one shown", filtering on the ordering columns themselves, so
+deep pages cost the same as the first. The ordering must end in a unique
+column (the primary key) to make it total.
+
+Cursors are opaque, signed tokens holding the ordering values of the row a
+page starts after (or ends before). Invalid or stale tokens fall back to
+the first page, as Paginator.get_page does for bad page numbers.
+"""
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from django.core import signing
+from django.db import connection
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+
+CURSOR_SALT = 'player.pagination'
+
+# One column of a keyset ordering. ``nullable`` columns sort their NULLs
+# last in both directions, like F(name).desc(nulls_last=True).
+SortKey = namedtuple('SortKey', 'name descending nullable', defaults=(False, False))
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        return parse_datetime(value['dt'])
+    return value
+
+
+def _signature(keys):
+    return [f"{'-' if key.descending else ''}{key.name}" for key in keys]
+
+
+def encode_cursor(keys, values, before=False, part=0):
+    return signing.dumps(
+        {'p': part, 'k': _signature(keys), 'v': [_encode_value(value) for value in values], 'b': before},
+        salt=CURSOR_SALT, compress=True,
+    )
+
+
+def decode_cursor(token, parts):
+    """(part, values, before) for a token made for ``parts``, or None if it is missing or invalid.
+
+    ``parts`` is the list of key lists the cursor may belong to. A cursor
+    from another ordering (say, after the sort option changed) counts as
+    invalid.
+    """
+    if not token:
+        return None
+    try:
+        data = signing.loads(token, salt=CURSOR_SALT)
+        part = data['p']
+        if not 0 <= part < len(parts):
+            return None
+        keys = parts[part]
+        if data['k'] != _signature(keys) or len(data['v']) != len(keys):
+            return None
+        return part, [_decode_value(value) for value in data['v']], bool(data['b'])
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        return None
+
+
+def _order_by(keys, reverse):
+    order = []
+    for key in keys:
+        column = F(key.name)
+        direction = column.desc if key.descending != reverse else column.asc
+        if not key.nullable:
+            order.append(direction())
+        elif reverse:
+            # NULLs sit at the far end of the forward ordering, so they
+            # come first when it is walked backwards.
+            order.append(direction(nulls_first=True))
+        else:
+            order.append(direction(nulls_last=True))
+    return order
+
+
+def _beyond(key, value, before):
+    """Q for rows strictly past ``value`` in this column, or None if there are none."""
+    if before:
+        if value is None:
+            return Q(**{f'{key.name}__isnull': False})
+        lookup = 'gt' if key.descending else 'lt'
+        return Q(**{f'{key.name}__{lookup}': value})
+    if value is None:
+        return None
+    lookup = 'lt' if key.descending else 'gt'
+    condition = Q(**{f'{key.name}__{lookup}': value})
+    if key.nullable:
+        condition |= Q(**{f'{key.name}__isnull': True})
+    return condition
+
+
+def _equal(key, value):
+    if value is None:
+        return Q(**{f'{key.name}__isnull': True})
+    return Q(**{key.name: value})
+
+
+def keyset_filter(keys, values, before=False):
+    """Q selecting rows after (or before) the row with ordering ``values``.
+
+    Row-value comparison spelled out column by column:
+    (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ..., with NULL handling.
+    """
+    condition = Q(pk__in=[])
+    prefix = Q()
+    for key, value in zip(keys, values):
+        beyond = _beyond(key, value, before)
+        if beyond is not None:
+            condition |= prefix & beyond
+        prefix &= _equal(key, value)
+    return condition
+
+
+def approximate_count(queryset):
+    """Planner row estimate on PostgreSQL, an exact count elsewhere."""
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPage:
+    """One page of a keyset-paginated queryset.
+
+    Iterable like a Paginator page; ``next_cursor`` / ``prev_cursor`` are
+    tokens for the neighbouring pages (None at either end).
+    """
+
+    def __init__(self, object_list, next_cursor=None, prev_cursor=None, count=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.count = count
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+def _fetch(parts, index, values, reverse, limit):
+    """Up to ``limit`` (part, row) pairs of part ``index`` past ``values`` (None: from its start)."""
+    queryset, keys = parts[index]
+    if values is not None:
+        queryset = queryset.filter(keyset_filter(keys, values, reverse))
+    return [(index, row) for row in queryset.order_by(*_order_by(keys, reverse))[:limit]]
+
+
+def _cursor(parts, entry, before):
+    index, row = entry
+    keys = parts[index][1]
+    return encode_cursor(keys, [getattr(row, key.name) for key in keys], before, index)
+
+
+def _page(parts, entries, has_next, has_previous, count):
+    return KeysetPage(
+        [row for _, row in entries],
+        next_cursor=_cursor(parts, entries[-1], False) if has_next else None,
+        prev_cursor=_cursor(parts, entries[0], True) if has_previous else None,
+        count=count,
+    )
+
+
+def chained_keyset_page(parts, cursor=None, per_page=10, with_count=False):
+    """Return a KeysetPage over several querysets listed one after another.
+
+    ``parts`` is a list of (queryset, keys). Each queryset is ordered by its
+    own keys (a list of SortKeys whose last entry must be unique, normally
+    SortKey('id'), each naming a field or annotation of the rows) and the
+    next one follows where it ends; a page may straddle two of them. Any
+    ordering already on the querysets is replaced.
+    """
+    count = sum(approximate_count(queryset) for queryset, _ in parts) if with_count else None
+    position = decode_cursor(cursor, [keys for _, keys in parts])
+
+    if position is not None:
+        index, values, before = position
+        entries = []
+        while 0 <= index < len(parts) and len(entries) <= per_page:
+            entries += _fetch(parts, index, values, before, per_page + 1 - len(entries))
+            index += -1 if before else 1
+            values = None
+        more = len(entries) > per_page
+        entries = entries[:per_page]
+        if before and more:
+            entries.reverse()
+            return _page(parts, entries, True, True, count)
+        if not before and entries:
+            return _page(parts, entries, more, True, count)
+        # Paging back reached the start (show a full first page rather than
+        # a short one), or everything past the cursor has gone since.
+
+    entries = []
+    for index in range(len(parts)):
+        if len(entries) > per_page:
+            break
+        entries += _fetch(parts, index, None, False, per_page + 1 - len(entries))
+    if not entries:
+        return KeysetPage([], count=count)
+    return _page(parts, entries[:per_page], len(entries) > per_page, False, count)
+
+
+def keyset_page(queryset, keys, cursor=None, per_page=10, with_count=False):
+    """Return the KeysetPage of ``queryset`` ordered by ``keys`` at ``cursor``.
+
+    See chained_keyset_page for what ``keys`` must be.
+    """
+    return chained_keyset_page([(queryset, keys)], cursor, per_page, with_count)
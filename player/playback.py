@@ -0,0 +1,355 @@
+"""Applying playback position samples reported by listening devices.
+
+A sample is one observation of what a device was playing: ``track_id``,
+``position`` and optionally ``playlist_id``, ``shuffle``, ``podcast_only`` and
+``recorded_at`` (epoch ms, when the device captured it). Samples may be live
+heartbeats or progress queued while offline, so everything resolves
+newest-wins on ``recorded_at``: a stale replay never overwrites fresher state
+written by another device.
+
+``apply_playback_samples`` collapses a batch to the newest sample per track
+(plus the newest sample eligible to become the user's current track) and
+writes it with a fixed number of queries regardless of the batch size. With
+``settings.PLAYBACK_FLUSH_INTERVAL`` set, live samples go to the write-behind
+buffer (player.playback_buffer) instead and reach the database in periodic
+bulk flushes; read paths use ``podcast_positions``, ``last_played_times`` and
+``current_playback_state`` so they see buffered positions too.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import models, transaction
+from django.utils import timezone
+
+from .models import Track, Playlist, UserPlaybackState, PodcastProgress, UserTrackLastPlayed
+from .access import access_grants
+from .header_cache import PLAYBACK, invalidate_header
+from .pagination import SortKey
+from .playback_buffer import playback_buffer
+
+# Upper bound on samples accepted in one sync request.
+MAX_SAMPLES_PER_BATCH = 500
+
+# Keyset orderings for "last played" listings (see last_played_order).
+LAST_PLAYED_KEYS = [SortKey('user_last_played', descending=True), SortKey('id')]
+UNPLAYED_KEYS = [SortKey('id')]
+
+
+class PlaybackSample:
+    __slots__ = ('index', 'track_id', 'position', 'playlist_id', 'shuffle', 'podcast_only', 'recorded_at')
+
+    def __init__(self, index, track_id, position, playlist_id, shuffle, podcast_only, recorded_at):
+        self.index = index
+        self.track_id = track_id
+        self.position = position
+        self.playlist_id = playlist_id
+        self.shuffle = shuffle
+        self.podcast_only = podcast_only
+        self.recorded_at = recorded_at
+
+
+class PlaybackSyncResult:
+    def __init__(self):
+        # Indexes (into the submitted list) of samples that were malformed or
+        # referenced a track/playlist the user cannot access.
+        self.rejected = []
+        self.applied_state = False
+        # Podcast track ids whose stored progress now reflects this batch.
+        self.applied_podcast = []
+        # Podcast track ids where the server already had fresher progress.
+        self.stale_podcast = []
+
+
+def parse_recorded_at(recorded_at_ms, now):
+    """Client capture time (epoch ms) as an aware datetime, clamped to ``now``."""
+    if recorded_at_ms is None:
+        return now
+    try:
+        recorded_dt = datetime.fromtimestamp(float(recorded_at_ms) / 1000.0, tz=dt_timezone.utc)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return now
+    # A device with a fast clock must not lock out future updates.
+    return min(recorded_dt, now)
+
+
+def parse_sample(index, data, now):
+    """Build a PlaybackSample from a request dict, or None if it is malformed."""
+    if not isinstance(data, dict):
+        return None
+    track_id = data.get('track_id')
+    position = data.get('position')
+    if track_id is None or position is None:
+        return None
+    try:
+        track_id = int(track_id)
+        position = float(position)
+        playlist_id = int(data['playlist_id']) if data.get('playlist_id') else None
+    except (TypeError, ValueError):
+        return None
+    return PlaybackSample(
+        index=index,
+        track_id=track_id,
+        position=position,
+        playlist_id=playlist_id,
+        shuffle=bool(data.get('shuffle', False)),
+        # When replaying queued per-podcast progress, only touch
+        # PodcastProgress (and last-played), not the user's single
+        # "current track" state.
+        podcast_only=bool(data.get('podcast_only')),
+        recorded_at=parse_recorded_at(data.get('recorded_at'), now),
+    )
+
+
+def collapse_samples(samples):
+    """Reduce samples to ``(state_sample, {track_id: newest_sample})``.
+
+    Ties on ``recorded_at`` go to the sample submitted last.
+    """
+    state_sample = None
+    per_track = {}
+    for sample in samples:
+        if not sample.podcast_only and (state_sample is None or sample.recorded_at >= state_sample.recorded_at):
+            state_sample = sample
+        current = per_track.get(sample.track_id)
+        if current is None or sample.recorded_at >= current.recorded_at:
+            per_track[sample.track_id] = sample
+    return state_sample, per_track
+
+
+def apply_playback_samples(user, raw_samples):
+    """Validate, collapse and persist a batch of raw sample dicts for ``user``."""
+    result = PlaybackSyncResult()
+    now = timezone.now()
+
+    samples = []
+    for index, data in enumerate(raw_samples):
+        sample = parse_sample(index, data, now)
+        if sample is None:
+            result.rejected.append(index)
+        else:
+            samples.append(sample)
+    if not samples:
+        return result
+
+    grants = access_grants(user)
+    track_ids = {s.track_id for s in samples} & grants.track_ids
+    track_types = dict(
+        Track.objects.filter(pk__in=track_ids).values_list('id', 'type')
+    ) if track_ids else {}
+    accessible_playlist_ids = grants.playlist_ids
+
+    accepted = []
+    for sample in samples:
+        if sample.track_id not in track_types or (
+                sample.playlist_id and not sample.podcast_only
+                and sample.playlist_id not in accessible_playlist_ids):
+            result.rejected.append(sample.index)
+        else:
+            accepted.append(sample)
+    result.rejected.sort()
+
+    state_sample, per_track = collapse_samples(accepted)
+    if not per_track:
+        return result
+
+    states = {user.id: state_sample} if state_sample is not None else {}
+    tracks = {(user.id, track_id): sample for track_id, sample in per_track.items()}
+    if playback_buffer.enabled and all(playback_buffer.is_live(s.recorded_at, now) for s in accepted):
+        # The cached page header holds the saved state only; pages apply
+        # the buffered one on top (with_buffered_state), so nothing is
+        # invalidated until the flush writes it.
+        playback_buffer.add(states, tracks, track_types, result)
+    else:
+        # Offline replays (and everything when write-behind is off) are
+        # written straight through so the response reflects the database.
+        with transaction.atomic():
+            persist_playback(states, tracks, track_types, result)
+    return result
+
+
+def _user_track_filter(keys):
+    """Q matching any of the ``(user_id, track_id)`` pairs in ``keys``."""
+    by_user = defaultdict(set)
+    for user_id, track_id in keys:
+        by_user[user_id].add(track_id)
+    q = models.Q()
+    for user_id, track_ids in by_user.items():
+        q |= models.Q(user_id=user_id, track_id__in=track_ids)
+    return q
+
+
+def persist_playback(states, tracks, track_types, result=None):
+    """Write collapsed samples, newest-wins against stored rows.
+
+    ``states`` maps user id -> sample for UserPlaybackState, ``tracks`` maps
+    ``(user_id, track_id)`` -> sample, and ``track_types`` maps every track id
+    in ``tracks`` to its Track.type. Rows for any number of users are written
+    with one upsert per table.
+    """
+    if result is None:
+        result = PlaybackSyncResult()
+
+    if states:
+        existing = dict(
+            UserPlaybackState.objects.filter(user_id__in=states)
+            .values_list('user_id', 'recorded_at')
+        )
+        state_rows = [
+            UserPlaybackState(
+                user_id=user_id,
+                track_id=sample.track_id,
+                last_played_position=sample.position,
+                playlist_id=sample.playlist_id,
+                shuffle=sample.shuffle,
+                recorded_at=sample.recorded_at,
+            )
+            for user_id, sample in states.items()
+            if user_id not in existing or sample.recorded_at >= existing[user_id]
+        ]
+        if state_rows:
+            UserPlaybackState.objects.bulk_create(
+                state_rows,
+                update_conflicts=True,
+                unique_fields=['user'],
+                update_fields=['track', 'last_played_position', 'playlist', 'shuffle', 'recorded_at'],
+            )
+            # bulk_create sends no post_save for the header cache to see.
+            invalidate_header(PLAYBACK, [row.user_id for row in state_rows])
+            result.applied_state = True
+
+    if not tracks:
+        return result
+
+    # Last-played timestamps only ever move forward.
+    last_played = {
+        (user_id, track_id): value for user_id, track_id, value in
+        UserTrackLastPlayed.objects.filter(_user_track_filter(tracks))
+        .values_list('user_id', 'track_id', 'last_played')
+    }
+    last_played_rows = [
+        UserTrackLastPlayed(user_id=user_id, track_id=track_id, last_played=sample.recorded_at)
+        for (user_id, track_id), sample in tracks.items()
+        if (user_id, track_id) not in last_played or sample.recorded_at > last_played[(user_id, track_id)]
+    ]
+    if last_played_rows:
+        UserTrackLastPlayed.objects.bulk_create(
+            last_played_rows,
+            update_conflicts=True,
+            unique_fields=['user', 'track'],
+            update_fields=['last_played'],
+        )
+
+    podcast_samples = {
+        key: sample for key, sample in tracks.items()
+        if track_types.get(key[1]) == 'podcast'
+    }
+    if podcast_samples:
+        progress = {
+            (user_id, track_id): value for user_id, track_id, value in
+            PodcastProgress.objects.filter(_user_track_filter(podcast_samples))
+            .values_list('user_id', 'track_id', 'recorded_at')
+        }
+        progress_rows = []
+        for (user_id, track_id), sample in podcast_samples.items():
+            if (user_id, track_id) not in progress or sample.recorded_at >= progress[(user_id, track_id)]:
+                progress_rows.append(PodcastProgress(
+                    user_id=user_id, track_id=track_id,
+                    position=sample.position, recorded_at=sample.recorded_at,
+                ))
+                result.applied_podcast.append(track_id)
+            else:
+                result.stale_podcast.append(track_id)
+        if progress_rows:
+            PodcastProgress.objects.bulk_create(
+                progress_rows,
+                update_conflicts=True,
+                unique_fields=['user', 'track'],
+                update_fields=['position', 'recorded_at'],
+            )
+    return result
+
+
+def podcast_positions(user, track_ids):
+    """``{track_id: position}`` of the user's saved podcast progress.
+
+    Positions still waiting in the write-behind buffer win over stored rows
+    when they were recorded later.
+    """
+    rows = PodcastProgress.objects.filter(user=user, track_id__in=track_ids).values_list('track_id', 'position', 'recorded_at')
+    positions = {track_id: (position, recorded_at) for track_id, position, recorded_at in rows}
+    for track_id, (position, recorded_at) in playback_buffer.pending_tracks(user.id, track_ids).items():
+        if track_id not in positions or recorded_at >= positions[track_id][1]:
+            positions[track_id] = (position, recorded_at)
+    return {track_id: position for track_id, (position, _) in positions.items()}
+
+
+def last_played_times(user, track_ids):
+    """``{track_id: datetime}`` of when the user last played each track."""
+    times = dict(
+        UserTrackLastPlayed.objects.filter(user=user, track_id__in=track_ids)
+        .values_list('track_id', 'last_played')
+    )
+    for track_id, (_, recorded_at) in playback_buffer.pending_tracks(user.id, track_ids).items():
+        if track_id not in times or recorded_at > times[track_id]:
+            times[track_id] = recorded_at
+    return times
+
+
+def played_tracks(user, tracks):
+    """The Track queryset ``tracks`` narrowed to ones ``user`` has played.
+
+    Rows carry ``user_last_played``. Ordered by LAST_PLAYED_KEYS the query
+    reads UserTrackLastPlayed's (user, -last_played, track) index in order,
+    so a keyset page costs the same however long the history is. Plays still
+    in the write-behind buffer show up once flushed.
+    """
+    return tracks.filter(usertracklastplayed__user=user).annotate(
+        user_last_played=models.F('usertracklastplayed__last_played')
+    )
+
+
+def last_played_order(user, tracks):
+    """chained_keyset_page parts listing ``tracks`` most recently played first.
+
+    Tracks the user never played follow, oldest first.
+    """
+    unplayed = tracks.filter(~models.Exists(
+        UserTrackLastPlayed.objects.filter(user=user, track=models.OuterRef('pk'))
+    ))
+    return [(played_tracks(user, tracks), LAST_PLAYED_KEYS), (unplayed, UNPLAYED_KEYS)]
+
+
+def saved_playback_state(user):
+    """The user's UserPlaybackState as written to the database, or None."""
+    return UserPlaybackState.objects.select_related('track', 'playlist').filter(user=user).first()
+
+
+def current_playback_state(user):
+    """The user's UserPlaybackState, with any newer buffered state applied.
+
+    Returns None if the user has never played anything. A buffered state is
+    applied to an unsaved copy; callers must not save it.
+    """
+    return with_buffered_state(user, saved_playback_state(user))
+
+
+def with_buffered_state(user, state):
+    """``state`` (from saved_playback_state, or None) with any newer buffered state applied.
+
+    Only reads the local buffer, plus the track and playlist if the buffered
+    state has moved to others. ``state`` may be changed; callers must not
+    save it.
+    """
+    pending = playback_buffer.pending_state(user.id)
+    if pending is None or (state is not None and pending.recorded_at < state.recorded_at):
+        return state
+    if state is None:
+        state = UserPlaybackState(user=user)
+    if state.track_id != pending.track_id:
+        state.track = Track.objects.filter(pk=pending.track_id).first()
+    if state.playlist_id != pending.playlist_id:
+        state.playlist = Playlist.objects.filter(pk=pending.playlist_id).first() if pending.playlist_id else None
+    state.last_played_position = pending.position
+    state.shuffle = pending.shuffle
+    state.recorded_at = pending.recorded_at
+    return state
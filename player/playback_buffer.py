@@ -0,0 +1,268 @@
+"""Write-behind buffer for playback positions.
+
+Live heartbeats used to land on UserPlaybackState, PodcastProgress and
+UserTrackLastPlayed as soon as they arrived. With write-behind enabled
+(``settings.PLAYBACK_FLUSH_INTERVAL`` > 0) they are instead upserted into a
+small SQLite file on the web host, keyed by (user, track) and newest-wins on
+``recorded_at``. Every worker process on the host shares that file, so any
+worker can merge unflushed positions into what it reads, and a background
+thread in each worker periodically drains the file and persists everything
+with one bulk upsert per table (see ``player.playback.persist_playback``).
+Workers also flush on exit.
+"""
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+# Samples captured longer ago than this are offline replays, not heartbeats;
+# they are written straight through rather than buffered.
+LIVE_WINDOW = timedelta(seconds=60)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    user_id INTEGER PRIMARY KEY,
+    track_id INTEGER NOT NULL,
+    position REAL NOT NULL,
+    playlist_id INTEGER,
+    shuffle INTEGER NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS track (
+    user_id INTEGER NOT NULL,
+    track_id INTEGER NOT NULL,
+    track_type TEXT NOT NULL,
+    position REAL NOT NULL,
+    recorded_at REAL NOT NULL,
+    PRIMARY KEY (user_id, track_id)
+);
+"""
+
+UPSERT_STATE = """
+INSERT INTO state (user_id, track_id, position, playlist_id, shuffle, recorded_at)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (user_id) DO UPDATE SET
+    track_id = excluded.track_id, position = excluded.position,
+    playlist_id = excluded.playlist_id, shuffle = excluded.shuffle,
+    recorded_at = excluded.recorded_at
+WHERE excluded.recorded_at >= state.recorded_at
+"""
+
+UPSERT_TRACK = """
+INSERT INTO track (user_id, track_id, track_type, position, recorded_at)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (user_id, track_id) DO UPDATE SET
+    track_type = excluded.track_type, position = excluded.position,
+    recorded_at = excluded.recorded_at
+WHERE excluded.recorded_at >= track.recorded_at
+"""
+
+
+def _still_existing(states, tracks):
+    """``states`` and ``tracks`` without samples whose user or track is gone."""
+    from django.contrib.auth.models import User
+    from .models import Playlist, Track
+    user_ids = set(states) | {user_id for user_id, _ in tracks}
+    track_ids = {sample.track_id for sample in states.values()} | {track_id for _, track_id in tracks}
+    playlist_ids = {sample.playlist_id for sample in states.values() if sample.playlist_id is not None}
+    user_ids = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+    track_ids = set(Track.objects.filter(pk__in=track_ids).values_list('pk', flat=True))
+    playlist_ids = set(Playlist.objects.filter(pk__in=playlist_ids).values_list('pk', flat=True))
+    for sample in states.values():
+        if sample.playlist_id not in playlist_ids:
+            sample.playlist_id = None
+    return (
+        {user_id: sample for user_id, sample in states.items()
+         if user_id in user_ids and sample.track_id in track_ids},
+        {key: sample for key, sample in tracks.items() if key[0] in user_ids and key[1] in track_ids},
+    )
+
+
+def _to_epoch(dt):
+    return dt.timestamp()
+
+
+def _from_epoch(value):
+    return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+
+
+class PlaybackBuffer:
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._flusher = None
+        self._flusher_pid = None
+        self._stop = threading.Event()
+        self._atexit_registered = False
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'PLAYBACK_FLUSH_INTERVAL', 0) > 0
+
+    def is_live(self, recorded_at, now):
+        return now - recorded_at <= LIVE_WINDOW
+
+    def _connect(self):
+        """Per-thread connection to the buffer file (reopened after a fork)."""
+        path = settings.PLAYBACK_BUFFER_PATH
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.key == (path, os.getpid()):
+            return conn
+        conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        self._local.conn = conn
+        self._local.key = (path, os.getpid())
+        return conn
+
+    def add(self, states, tracks, track_types, result):
+        """Buffer collapsed samples (same shapes as ``persist_playback``).
+
+        ``result`` records what was accepted relative to the buffer; the
+        database comparison happens at flush time.
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for user_id, sample in states.items():
+                cursor = conn.execute(UPSERT_STATE, (
+                    user_id, sample.track_id, sample.position, sample.playlist_id,
+                    int(sample.shuffle), _to_epoch(sample.recorded_at),
+                ))
+                if cursor.rowcount:
+                    result.applied_state = True
+            for (user_id, track_id), sample in tracks.items():
+                cursor = conn.execute(UPSERT_TRACK, (
+                    user_id, track_id, track_types[track_id], sample.position,
+                    _to_epoch(sample.recorded_at),
+                ))
+                if track_types[track_id] == 'podcast':
+                    (result.applied_podcast if cursor.rowcount else result.stale_podcast).append(track_id)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._ensure_flusher()
+
+    def pending_tracks(self, user_id, track_ids):
+        """``{track_id: (position, recorded_at)}`` of unflushed samples."""
+        if not self.enabled or not os.path.exists(settings.PLAYBACK_BUFFER_PATH):
+            return {}
+        track_ids = set(track_ids)
+        rows = self._connect().execute(
+            'SELECT track_id, position, recorded_at FROM track WHERE user_id = ?', (user_id,)
+        ).fetchall()
+        return {
+            track_id: (position, _from_epoch(recorded_at))
+            for track_id, position, recorded_at in rows if track_id in track_ids
+        }
+
+    def pending_state(self, user_id):
+        """The user's unflushed current-track sample, or None."""
+        if not self.enabled or not os.path.exists(settings.PLAYBACK_BUFFER_PATH):
+            return None
+        row = self._connect().execute(
+            'SELECT track_id, position, playlist_id, shuffle, recorded_at FROM state WHERE user_id = ?',
+            (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        from .playback import PlaybackSample
+        track_id, position, playlist_id, shuffle, recorded_at = row
+        return PlaybackSample(None, track_id, position, playlist_id, bool(shuffle), False, _from_epoch(recorded_at))
+
+    def _drain(self):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            state_rows = conn.execute(
+                'SELECT user_id, track_id, position, playlist_id, shuffle, recorded_at FROM state'
+            ).fetchall()
+            track_rows = conn.execute(
+                'SELECT user_id, track_id, track_type, position, recorded_at FROM track'
+            ).fetchall()
+            conn.execute('DELETE FROM state')
+            conn.execute('DELETE FROM track')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return state_rows, track_rows
+
+    def flush(self):
+        """Move everything buffered on this host into the database.
+
+        Returns the number of buffered rows drained. Samples for users,
+        tracks or playlists deleted since they were buffered are dropped
+        (a deleted playlist only leaves the sample's playlist unset). If the
+        database is unavailable (OperationalError) the rows are put back
+        (newest-wins) for the next flush; any other error drops them, as
+        putting them back would fail every later flush the same way.
+        """
+        if not os.path.exists(settings.PLAYBACK_BUFFER_PATH):
+            return 0
+        from .playback import PlaybackSample, PlaybackSyncResult, persist_playback
+
+        with self._lock:
+            state_rows, track_rows = self._drain()
+            if not state_rows and not track_rows:
+                return 0
+            states = {
+                user_id: PlaybackSample(None, track_id, position, playlist_id, bool(shuffle), False, _from_epoch(recorded_at))
+                for user_id, track_id, position, playlist_id, shuffle, recorded_at in state_rows
+            }
+            tracks = {
+                (user_id, track_id): PlaybackSample(None, track_id, position, None, False, True, _from_epoch(recorded_at))
+                for user_id, track_id, _, position, recorded_at in track_rows
+            }
+            track_types = {track_id: track_type for _, track_id, track_type, _, _ in track_rows}
+            states, tracks = _still_existing(states, tracks)
+            try:
+                with transaction.atomic():
+                    persist_playback(states, tracks, track_types)
+            except OperationalError:
+                self.add(states, tracks, track_types, PlaybackSyncResult())
+                raise
+            return len(state_rows) + len(track_rows)
+
+    def _run(self):
+        while not self._stop.wait(settings.PLAYBACK_FLUSH_INTERVAL):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Error flushing playback buffer")
+            finally:
+                connection.close()
+
+    def _flush_at_exit(self):
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Error flushing playback buffer at exit")
+
+    def _ensure_flusher(self):
+        pid = os.getpid()
+        if self._flusher is not None and self._flusher_pid == pid and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher_pid == pid and self._flusher.is_alive():
+                return
+            self._stop = threading.Event()
+            self._flusher = threading.Thread(target=self._run, name='playback-buffer-flusher', daemon=True)
+            self._flusher_pid = pid
+            self._flusher.start()
+            if not self._atexit_registered:
+                atexit.register(self._flush_at_exit)
+                self._atexit_registered = True
+
+
+playback_buffer = PlaybackBuffer()
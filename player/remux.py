@@ -0,0 +1,261 @@
+"""Lossless remux of uploaded audio so that playback and seeks need one range request.
+
+An MP4/M4A whose index (the ``moov`` box) follows the audio (``mdat``)
+makes a browser fetch the end of the file before it can play or seek, and
+a VBR MP3 without a Xing or VBRI seek table leaves it guessing which byte
+a time is at, so every seek lands wrong and is retried. run_media_worker
+claims tracks whose file has not been checked yet (``remux_checked_file``
+differs from ``file``) and, for files with either problem, has ffmpeg copy
+the streams into a new file: MP4s with ``+faststart``, MP3s with the Xing
+header (and table of contents) ffmpeg's muxer writes. Nothing is
+re-encoded.
+
+Stored files never change (stream URLs, ETags and content-addressed blobs
+rely on it), so the result is stored as a new file and every track naming
+the old one is switched to it with Track.save, which moves the storage
+charge and blob references and queues new renditions. Renditions wait for
+the check (renditions.renditions_due), so they are made from the
+remuxed file. Work is claimed as in player.durations: a retry_at lease,
+then a backoff, then quarantine after MAX_ATTEMPTS failures (the file is
+still played as it is).
+
+The old file is not deleted straight away: a stream request may have read
+the cached description of it (player.media_cache) just before the switch.
+It is recorded as a RetiredFile, and run_media_worker deletes it
+(``delete_retired_files``) once RETIRED_FILE_GRACE has passed.
+"""
+import os
+import struct
+import tempfile
+from datetime import timedelta
+
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .media_store import blob_digest
+from .models import RetiredFile, Track
+from .renditions import run_ffmpeg
+
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = timedelta(minutes=10)
+# How long a claimed batch is reserved for the worker that claimed it.
+CLAIM_LEASE = timedelta(minutes=30)
+# How long a file replaced by a remux is kept for requests still reading it.
+RETIRED_FILE_GRACE = timedelta(hours=1)
+
+MP4 = 'mp4'
+MP3 = 'mp3'
+# ffmpeg output options per container; ``-c copy`` keeps every stream as it is.
+REMUX_ARGS = {
+    MP4: ['-map', '0', '-c', 'copy', '-movflags', '+faststart', '-f', 'mp4'],
+    MP3: ['-map', '0:a:0', '-map', '0:v?', '-c', 'copy', '-write_xing', '1', '-id3v2_version', '3', '-f', 'mp3'],
+}
+
+# Frames whose bitrates are compared to tell a VBR MP3 from a CBR one.
+MP3_SCAN_FRAMES = 200
+# How far past any ID3v2 tag the first MP3 frame is looked for.
+MP3_SYNC_WINDOW = 64 * 1024
+# Layer III bitrates (kbps) by bitrate index, for MPEG-1 and MPEG-2/2.5.
+_MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Sample rates by MPEG version bits, then sample rate index.
+_MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def _mp4_moov_after_mdat(f):
+    """True if the top-level ``mdat`` box comes before ``moov``."""
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    offset = 0
+    while offset + 8 <= end:
+        f.seek(offset)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        if size == 1:
+            if offset + 16 > end:
+                return False
+            size = struct.unpack('>Q', f.read(8))[0]
+        elif size == 0:
+            size = end - offset
+        if kind == b'moov':
+            return False
+        if kind == b'mdat':
+            return True
+        if size < 8:
+            return False
+        offset += size
+    return False
+
+
+def _mp3_frame(header):
+    """(length, bitrate, xing offset) of the Layer III frame with this 4-byte header, or None."""
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version, layer = (header[1] >> 3) & 3, (header[1] >> 1) & 3
+    bitrate_index, rate_index = header[2] >> 4, (header[2] >> 2) & 3
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = _MP3_BITRATES[1 if mpeg1 else 2][bitrate_index]
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+    length = (144 if mpeg1 else 72) * bitrate * 1000 // sample_rate + ((header[2] >> 1) & 1)
+    mono = header[3] >> 6 == 3
+    side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+    return length, bitrate, 4 + side_info
+
+
+def _mp3_lacks_seek_table(f):
+    """True for a VBR MP3 whose first frame carries no Xing or VBRI header."""
+    head = f.read(10)
+    start = 0
+    if head[:3] == b'ID3' and len(head) == 10:
+        size = 0
+        for byte in head[6:10]:
+            size = (size << 7) | (byte & 0x7F)
+        # Header, tag and, if flagged, a footer.
+        start = 10 + size + (10 if head[5] & 0x10 else 0)
+    f.seek(start)
+    window = f.read(MP3_SYNC_WINDOW)
+    for i in range(len(window) - 3):
+        frame = _mp3_frame(window[i:i + 4])
+        if frame is not None:
+            start += i
+            break
+    else:
+        return False
+
+    f.seek(start)
+    first = f.read(frame[0])
+    if first[frame[2]:frame[2] + 4] in (b'Xing', b'Info') or first[36:40] == b'VBRI':
+        return False
+    bitrates, offset = {frame[1]}, start + frame[0]
+    for _ in range(MP3_SCAN_FRAMES):
+        f.seek(offset)
+        frame = _mp3_frame(f.read(4))
+        if frame is None:
+            break
+        bitrates.add(frame[1])
+        offset += frame[0]
+    return len(bitrates) > 1
+
+
+def remux_kind(path):
+    """MP4 or MP3 if the file at ``path`` needs remuxing to seek in one request, else None.
+
+    MP4s are recognised by their ``ftyp`` box. MP3 has no such signature
+    (other containers hold bytes that look like frame headers), so only
+    ``.mp3`` files are scanned for frames.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(12)
+        f.seek(0)
+        if head[4:8] == b'ftyp':
+            return MP4 if _mp4_moov_after_mdat(f) else None
+        if os.path.splitext(path)[1].lower() != '.mp3':
+            return None
+        return MP3 if _mp3_lacks_seek_table(f) else None
+
+
+def tracks_needing_remux():
+    return Track.objects.filter(
+        file_size__gt=0, remux_attempts__lt=MAX_ATTEMPTS,
+    ).exclude(remux_checked_file=F('file')).filter(
+        Q(remux_retry_at__isnull=True) | Q(remux_retry_at__lte=timezone.now())
+    )
+
+
+def claim_tracks(batch_size):
+    """Reserve up to ``batch_size`` tracks whose files need checking and return them.
+
+    As in durations.claim_tracks, the exact lease time is the claim token.
+    """
+    ids = list(tracks_needing_remux().order_by('id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    lease = timezone.now() + CLAIM_LEASE
+    tracks_needing_remux().filter(pk__in=ids).update(remux_retry_at=lease)
+    return list(Track.objects.filter(pk__in=ids, remux_retry_at=lease).order_by('id'))
+
+
+def remux_track(track):
+    """Store a remuxed copy of the track's file; returns its name, or None if the file is fine as it is."""
+    field = Track._meta.get_field('file')
+    source = field.storage.path(track.file.name)
+    kind = remux_kind(source)
+    if kind is None:
+        return None
+    extension = os.path.splitext(track.file.name)[1]
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, 'remuxed' + extension)
+        run_ffmpeg('-i', source, *REMUX_ARGS[kind], '-fflags', '+bitexact', output)
+        if remux_kind(output) is not None:
+            raise RuntimeError(f'ffmpeg did not make the {kind} file seekable')
+        with open(output, 'rb') as f:
+            return field.storage.save(field.generate_filename(None, os.path.basename(track.file.name)), File(f))
+
+
+def record_results(results):
+    """Save a batch of (track, remuxed file name or None, error) results.
+
+    A remuxed file replaces the old one in every track that still names
+    it; files that needed nothing are marked checked. Returns (remuxed,
+    failed): the tracks switched to a new file, and the claimed tracks
+    whose remux failed, backed off or quarantined.
+    """
+    storage = Track._meta.get_field('file').storage
+    now = timezone.now()
+    remuxed, failed = [], []
+    for track, new_name, error in results:
+        old_name = track.file.name
+        if error is not None:
+            track.remux_attempts += 1
+            track.remux_retry_at = (
+                now + RETRY_BACKOFF * 2 ** (track.remux_attempts - 1)
+                if track.remux_attempts < MAX_ATTEMPTS else None
+            )
+            failed.append(track)
+        elif new_name is None:
+            Track.objects.filter(file=old_name).exclude(remux_checked_file=old_name).update(
+                remux_checked_file=old_name, remux_attempts=0, remux_retry_at=None,
+            )
+        else:
+            size = storage.size(new_name)
+            with transaction.atomic():
+                switched = list(Track.objects.select_for_update().filter(file=old_name))
+                if switched and blob_digest(old_name) is not None:
+                    # Marks the blob as just used, so releasing its last
+                    # reference below leaves the file to delete_retired_files.
+                    os.utime(storage.path(old_name))
+                for other in switched:
+                    other.file = new_name
+                    other.file_size = size
+                    other.remux_checked_file = new_name
+                    other.remux_attempts = 0
+                    other.remux_retry_at = None
+                    other.save()
+                if switched:
+                    RetiredFile.objects.update_or_create(name=old_name, defaults={'retired_at': timezone.now()})
+            if not switched:
+                # Replaced meanwhile (the check runs again for the new file).
+                storage.delete(new_name)
+            remuxed.extend(switched)
+    Track.objects.bulk_update(failed, ['remux_attempts', 'remux_retry_at'])
+    return remuxed, failed
+
+
+def delete_retired_files():
+    """Delete the files retired over RETIRED_FILE_GRACE ago that no track names again; returns how many."""
+    storage = Track._meta.get_field('file').storage
+    deleted = 0
+    due = RetiredFile.objects.filter(retired_at__lte=timezone.now() - RETIRED_FILE_GRACE)
+    for retired in due.order_by('id'):
+        with transaction.atomic():
+            retired.delete()
+            if not Track.objects.filter(file=retired.name).exists():
+                # A blob is still left alone if anything references it.
+                transaction.on_commit(lambda name=retired.name: storage.delete(name))
+                deleted += 1
+    return deleted
@@ -0,0 +1,191 @@
+"""Low-bitrate renditions of track audio, and HLS for them.
+
+Originals can be 320 kbps MP3s or WAV/FLAC masters, which stall on mobile
+data and fill the offline store. For every track, the run_media_worker
+command makes a TrackRendition per entry in PROFILES with ffmpeg: a
+progressive file (Opus or AAC at a low bitrate) and the same audio cut into
+fMP4 segments under a VOD HLS playlist. ``renditions_for`` describes the
+ready ones to the player and the offline downloader, which choose by codec
+support and connection, and ``hls_master_playlist`` offers them to HLS
+clients as variants.
+
+Renditions are derived data, so they are not charged to the owner's
+storage. They are remade, as new rows in new directories, whenever the
+track's file changes (TrackRendition.queue). Work is claimed as in
+player.durations: a retry_at lease, then a backoff, then quarantine after
+MAX_ATTEMPTS failures.
+"""
+import os
+import re
+import shutil
+import subprocess
+from collections import namedtuple
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.db.models import F, Q
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Track, TrackRendition
+
+# ``encoder_args`` go to ffmpeg after the input; ``hls_codecs`` is the CODECS
+# attribute of the variant in the master playlist.
+Profile = namedtuple('Profile', 'codec bitrate extension mime_type hls_codecs encoder_args')
+
+PROFILES = {
+    'opus-32': Profile('opus', 32, '.opus', 'audio/ogg; codecs=opus', 'opus',
+                       ['-c:a', 'libopus', '-b:a', '32k', '-ac', '1']),
+    'opus-64': Profile('opus', 64, '.opus', 'audio/ogg; codecs=opus', 'opus',
+                       ['-c:a', 'libopus', '-b:a', '64k']),
+    'aac-64': Profile('aac', 64, '.m4a', 'audio/mp4; codecs="mp4a.40.2"', 'mp4a.40.2',
+                      ['-c:a', 'aac', '-b:a', '64k', '-movflags', '+faststart']),
+    'aac-128': Profile('aac', 128, '.m4a', 'audio/mp4; codecs="mp4a.40.2"', 'mp4a.40.2',
+                       ['-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart']),
+}
+
+AUDIO_NAME = 'audio'
+HLS_PLAYLIST_NAME = 'index.m3u8'
+HLS_INIT_NAME = 'init.mp4'
+HLS_SEGMENT_SECONDS = 6
+# The only names rendition_file will serve out of a rendition's directory.
+FILE_NAME_RE = re.compile(r'(audio\.(opus|m4a)|index\.m3u8|init\.mp4|seg\d{5}\.m4s)')
+CONTENT_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.mp4': 'audio/mp4',
+    '.m4s': 'audio/mp4',
+    '.m4a': 'audio/mp4',
+    '.opus': 'audio/ogg',
+}
+
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = timedelta(minutes=10)
+# How long a claimed rendition is reserved for the worker that claimed it.
+CLAIM_LEASE = timedelta(minutes=30)
+
+
+def audio_name(rendition):
+    return AUDIO_NAME + PROFILES[rendition.profile].extension
+
+
+def renditions_for(track, renditions):
+    """JSON-ready descriptions of the ready ``renditions`` of ``track``, lowest bitrate first."""
+    ready = sorted(
+        (r for r in renditions if r.status == 'ready' and r.profile in PROFILES),
+        key=lambda r: PROFILES[r.profile].bitrate,
+    )
+    return [{
+        'profile': rendition.profile,
+        'codec': PROFILES[rendition.profile].codec,
+        'bitrate': PROFILES[rendition.profile].bitrate,
+        'mime_type': PROFILES[rendition.profile].mime_type,
+        'size': rendition.file_size,
+        'url': reverse('rendition_file', args=[track.pk, rendition.pk, audio_name(rendition)]),
+    } for rendition in ready]
+
+
+def hls_master_playlist(track, renditions):
+    """An HLS master playlist with a variant per ready rendition, or None if there are none."""
+    lines = ['#EXTM3U', '#EXT-X-VERSION:7', '#EXT-X-INDEPENDENT-SEGMENTS']
+    ready = [r for r in renditions if r.status == 'ready' and r.profile in PROFILES]
+    for rendition in sorted(ready, key=lambda r: PROFILES[r.profile].bitrate):
+        profile = PROFILES[rendition.profile]
+        # Peak bandwidth in bits/s, with room for the fMP4 framing.
+        lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={profile.bitrate * 1100},CODECS="{profile.hls_codecs}"')
+        lines.append(reverse('rendition_file', args=[track.pk, rendition.pk, HLS_PLAYLIST_NAME]))
+    return '\n'.join(lines) + '\n' if len(lines) > 3 else None
+
+
+def renditions_due():
+    from .remux import MAX_ATTEMPTS as REMUX_MAX_ATTEMPTS
+    return TrackRendition.objects.filter(
+        status='pending', attempts__lt=MAX_ATTEMPTS,
+    ).filter(Q(retry_at__isnull=True) | Q(retry_at__lte=timezone.now())).filter(
+        # Not while the file may yet be replaced by a remux (player.remux).
+        Q(track__remux_checked_file=F('track__file')) | Q(track__remux_attempts__gte=REMUX_MAX_ATTEMPTS)
+    )
+
+
+def claim_renditions(batch_size):
+    """Reserve up to ``batch_size`` pending renditions and return them.
+
+    As in durations.claim_tracks, the exact lease time is the claim token.
+    """
+    ids = list(renditions_due().order_by('id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    lease = timezone.now() + CLAIM_LEASE
+    renditions_due().filter(pk__in=ids).update(retry_at=lease)
+    return list(
+        TrackRendition.objects.filter(pk__in=ids, retry_at=lease).select_related('track').order_by('id')
+    )
+
+
+def run_ffmpeg(*args):
+    """Run ffmpeg quietly; raises RuntimeError, with the end of its stderr, if it fails."""
+    try:
+        subprocess.run(
+            ['ffmpeg', '-nostdin', '-v', 'error', '-y', *args],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        )
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f'ffmpeg exited with {e.returncode}: {(e.stderr or "").strip()[-500:]}') from e
+
+
+def make_rendition(rendition):
+    """Transcode the source and segment the result for HLS; returns the progressive file's size."""
+    profile = PROFILES[rendition.profile]
+    source = Track._meta.get_field('file').storage.path(rendition.source_name)
+    if not os.path.exists(source):
+        raise FileNotFoundError(f'File not found at {source}')
+    directory = default_storage.path(rendition.directory)
+    # Leftovers of an attempt that died part way.
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+    audio_path = os.path.join(directory, audio_name(rendition))
+    run_ffmpeg('-i', source, '-map', '0:a:0', '-vn', *profile.encoder_args, audio_path)
+    # The HLS copy is a remux of the progressive file, not a second encode.
+    run_ffmpeg(
+        '-i', audio_path, '-map', '0:a:0', '-c', 'copy',
+        '-f', 'hls', '-hls_time', str(HLS_SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+        '-hls_segment_type', 'fmp4', '-hls_fmp4_init_filename', HLS_INIT_NAME,
+        '-hls_segment_filename', os.path.join(directory, 'seg%05d.m4s'),
+        os.path.join(directory, HLS_PLAYLIST_NAME),
+    )
+    return os.path.getsize(audio_path)
+
+
+def record_results(results):
+    """Save a batch of (rendition, size, error) results in one bulk update.
+
+    A rendition whose track moved on to another file meanwhile has been
+    deleted (TrackRendition.queue); what was made for it is deleted too.
+    Returns (made, failed), without those.
+    """
+    now = timezone.now()
+    made, failed = [], []
+    for rendition, size, error in results:
+        if error is None:
+            rendition.status = 'ready'
+            rendition.file_size = size
+            rendition.retry_at = None
+            rendition.error_message = ''
+            made.append(rendition)
+        else:
+            rendition.attempts += 1
+            rendition.error_message = error
+            if rendition.attempts < MAX_ATTEMPTS:
+                rendition.retry_at = now + RETRY_BACKOFF * 2 ** (rendition.attempts - 1)
+            else:
+                rendition.status = 'failed'
+                rendition.retry_at = None
+            failed.append(rendition)
+    TrackRendition.objects.bulk_update(
+        made + failed, ['status', 'file_size', 'attempts', 'retry_at', 'error_message'],
+    )
+    existing = set(TrackRendition.objects.filter(pk__in=[r.pk for r in made + failed]).values_list('pk', flat=True))
+    for rendition in made + failed:
+        if rendition.pk not in existing:
+            shutil.rmtree(default_storage.path(rendition.directory), ignore_errors=True)
+    return [r for r in made if r.pk in existing], [r for r in failed if r.pk in existing]
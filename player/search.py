@@ -0,0 +1,271 @@
+"""Library search: full-text over transcript segments, fuzzy over tracks.
+
+Transcripts
+-----------
+
+PostgreSQL keeps a generated ``search_vector`` tsvector column on
+player_transcriptsegment with a GIN index; SQLite keeps an FTS5 table that
+triggers mirror from it (both created by migration 0022). Results are
+ranked (ts_rank / bm25) and come with a highlighted snippet. Other
+databases, or SQLite without FTS5, fall back to a case-insensitive
+substring scan in segment order.
+
+Query syntax: words must all match (stemmed), "quoted words" must appear
+as a phrase, and word* matches any word starting with it. The last word is
+always treated as a prefix, since results are shown while the user types.
+
+Tracks
+------
+Name/artist search matches Track.search_text (see player/text.py). A track
+matches when it contains the normalised query, as icontains did; only if
+nothing does are near misses (typos) accepted. PostgreSQL answers both with
+a pg_trgm GIN index (migration 0023) where it has one; elsewhere the
+TrackSearchGram table narrows candidates to tracks sharing the query's
+trigrams.
+"""
+import math
+import re
+from collections import namedtuple
+
+from django.db import connection
+from django.db.models import Count, Q
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+
+from .models import Track, TrackSearchGram, TranscriptSegment
+from .text import normalize_search_text, search_grams
+
+PAGE_SIZE = 20
+# Share of the query's trigrams a near miss must have.
+FUZZY_THRESHOLD = 0.6
+FTS_TABLE = 'player_transcriptsegment_fts'
+# Made by migration 0023 on PostgreSQL, if pg_trgm could be installed.
+TRIGRAM_INDEX = 'player_track_search_text_trgm'
+TS_CONFIG = 'english'
+
+# Snippet highlight markers: control characters can't appear in transcript
+# text, so they survive HTML escaping and are then turned into <mark>.
+_START, _STOP = '\x02', '\x03'
+
+Term = namedtuple('Term', 'words prefix')
+SearchHit = namedtuple('SearchHit', 'segment rank snippet')
+
+_TOKEN = re.compile(r'"([^"]*)"?|(\S+)')
+_WORD = re.compile(r'\w+')
+
+
+def parse_query(query):
+    """Split a search box query into Terms (a phrase is one Term of several words)."""
+    terms = []
+    matches = list(_TOKEN.finditer(query))
+    for n, match in enumerate(matches):
+        phrase, bare = match.groups()
+        words = _WORD.findall(phrase if phrase is not None else bare)
+        if not words:
+            continue
+        is_last = n == len(matches) - 1 and not query[match.end():].strip()
+        prefix = bare is not None and (bare.endswith('*') or is_last)
+        terms.append(Term(tuple(word.lower() for word in words), prefix))
+    return terms
+
+
+def _tsquery(terms):
+    parts = []
+    for term in terms:
+        words = list(term.words)
+        if term.prefix:
+            words[-1] += ':*'
+        parts.append(' <-> '.join(words) if len(words) > 1 else words[0])
+    return ' & '.join(f'({part})' for part in parts)
+
+
+def _fts5_query(terms):
+    return ' AND '.join(
+        '"{}"{}'.format(' '.join(term.words), '*' if term.prefix else '') for term in terms
+    )
+
+
+def _fts5_available():
+    return FTS_TABLE in connection.introspection.table_names()
+
+
+def _highlight(snippet):
+    return escape(snippet).replace(_START, '<mark>').replace(_STOP, '</mark>')
+
+
+def _highlight_terms(text, terms):
+    """Mark every occurrence of the query words in ``text`` (fallback search)."""
+    words = sorted({word for term in terms for word in term.words}, key=len, reverse=True)
+    pattern = re.compile('|'.join(re.escape(word) for word in words), re.IGNORECASE)
+    return _highlight(pattern.sub(lambda m: f'{_START}{m.group(0)}{_STOP}', text))
+
+
+def _ranked_ids(terms, tracks, limit, offset):
+    """[(segment id, rank, raw snippet)] best first, or None if no index is available."""
+    segments = TranscriptSegment._meta.db_table
+    transcripts = TranscriptSegment._meta.get_field('transcript').related_model._meta.db_table
+    track_sql, track_params = tracks.values('pk').query.sql_with_params()
+
+    if connection.vendor == 'postgresql':
+        # ts_headline is expensive, so it only runs on the page of hits.
+        sql = f'''
+            SELECT m.id, m.rank, ts_headline(%s, s.text, to_tsquery(%s, %s), %s)
+            FROM (
+                SELECT s.id, ts_rank(s.search_vector, q) AS rank
+                FROM {segments} s
+                JOIN {transcripts} t ON t.id = s.transcript_id,
+                     to_tsquery(%s, %s) q
+                WHERE s.search_vector @@ q AND t.track_id IN ({track_sql})
+                ORDER BY rank DESC, s.id
+                LIMIT %s OFFSET %s
+            ) m
+            JOIN {segments} s ON s.id = m.id
+            ORDER BY m.rank DESC, m.id
+        '''
+        tsquery = _tsquery(terms)
+        headline_options = f'StartSel={_START}, StopSel={_STOP}, MaxWords=30, MinWords=12, MaxFragments=1'
+        params = [TS_CONFIG, TS_CONFIG, tsquery, headline_options, TS_CONFIG, tsquery, *track_params, limit, offset]
+    elif connection.vendor == 'sqlite' and _fts5_available():
+        sql = f'''
+            SELECT s.id, bm25({FTS_TABLE}) AS rank,
+                   snippet({FTS_TABLE}, 0, %s, %s, '…', 24)
+            FROM {FTS_TABLE}
+            JOIN {segments} s ON s.id = {FTS_TABLE}.rowid
+            JOIN {transcripts} t ON t.id = s.transcript_id
+            WHERE {FTS_TABLE} MATCH %s AND t.track_id IN ({track_sql})
+            ORDER BY rank, s.id
+            LIMIT %s OFFSET %s
+        '''
+        params = [_START, _STOP, _fts5_query(terms), *track_params, limit, offset]
+    else:
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def search_segments(query, tracks, page=1):
+    """Return (hits, has_next) for page ``page`` of ``query`` among segments of ``tracks``.
+
+    ``tracks`` is a Track queryset limiting what may be searched (e.g.
+    Track.objects.accessible_by(user)). ``hits`` holds at most PAGE_SIZE
+    SearchHits, best first.
+    """
+    terms = parse_query(query)
+    if not terms:
+        return [], False
+    offset = (max(1, page) - 1) * PAGE_SIZE
+
+    rows = _ranked_ids(terms, tracks, PAGE_SIZE + 1, offset)
+    if rows is None:
+        segments = list(
+            TranscriptSegment.objects
+            .filter(transcript__track__in=tracks.values('pk'), text__icontains=query.strip().strip('"*'))
+            .select_related('transcript__track')
+            .order_by('transcript_id', 'index')[offset:offset + PAGE_SIZE + 1]
+        )
+        hits = [SearchHit(segment, None, _highlight_terms(segment.text, terms)) for segment in segments]
+    else:
+        by_id = TranscriptSegment.objects.select_related('transcript__track').in_bulk([row[0] for row in rows])
+        hits = [SearchHit(by_id[pk], rank, _highlight(snippet)) for pk, rank, snippet in rows if pk in by_id]
+
+    return hits[:PAGE_SIZE], len(hits) > PAGE_SIZE
+
+
+def _has_trigram_index():
+    """True if migration 0023 made the pg_trgm index; checked once per connection.
+
+    The migration skips the index when the pg_trgm extension cannot be
+    installed, and search then uses the TrackSearchGram table as on other
+    databases.
+    """
+    if connection.vendor != 'postgresql':
+        return False
+    found = getattr(connection, '_player_trigram_index', None)
+    if found is None:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = %s)', [TRIGRAM_INDEX])
+            found = connection._player_trigram_index = cursor.fetchone()[0]
+    return found
+
+
+def _track_column():
+    return f'"{Track._meta.db_table}"."search_text"'
+
+
+def _gram_hits(tracks, grams):
+    """Per-track count of ``grams`` present, for tracks in ``tracks``."""
+    return (
+        TrackSearchGram.objects.filter(gram__in=grams, track__in=tracks.values('pk'))
+        .values('track_id').annotate(hits=Count('gram'))
+    )
+
+
+def _fuzzy_tracks(tracks, normalized, grams):
+    if _has_trigram_index():
+        # <% is word similarity above pg_trgm.word_similarity_threshold.
+        return tracks.alias(
+            similar=RawSQL(f'%s <%% {_track_column()}', (normalized,))
+        ).filter(similar=True)
+    needed = max(1, math.ceil(len(grams) * FUZZY_THRESHOLD))
+    return tracks.filter(pk__in=_gram_hits(tracks, grams).filter(hits__gte=needed).values('track_id'))
+
+
+def matching_tracks(tracks, query):
+    """Narrow the Track queryset ``tracks`` to name/artist matches for ``query``.
+
+    Keeps the queryset's own ordering. Tracks containing the query win; if
+    there are none, near misses are returned instead.
+    """
+    normalized = normalize_search_text(query)
+    if not normalized:
+        return tracks
+    exact = tracks.filter(search_text__contains=normalized)
+    grams = search_grams(normalized)
+    if not grams:
+        return exact
+    if not _has_trigram_index():
+        # Every trigram of a substring is a trigram of the text, so only
+        # tracks having all of them need the LIKE check.
+        exact = exact.filter(pk__in=_gram_hits(tracks, grams).filter(hits=len(grams)).values('track_id'))
+    if exact.exists():
+        return exact
+    return _fuzzy_tracks(tracks, normalized, grams)
+
+
+def rank_tracks(tracks, query, limit=10):
+    """The ``limit`` tracks best matching ``query``, best first (for typeahead).
+
+    Tracks containing the query rank first, those starting with it ahead of
+    the rest; then near misses by trigram similarity; ties by name.
+    """
+    normalized = normalize_search_text(query)
+    grams = search_grams(normalized)
+    if not normalized:
+        return []
+    if not grams:
+        candidates = tracks.filter(search_text__contains=normalized).order_by('name')[:limit * 5]
+        scores = {track.pk: 1.0 for track in candidates}
+        found = {track.pk: track for track in candidates}
+    elif _has_trigram_index():
+        candidates = tracks.annotate(
+            score=RawSQL(f'word_similarity(%s, {_track_column()})', (normalized,)),
+        ).alias(
+            similar=RawSQL(f'%s <%% {_track_column()}', (normalized,)),
+        ).filter(Q(similar=True) | Q(search_text__contains=normalized)).order_by('-score', 'name')[:limit * 5]
+        found = {track.pk: track for track in candidates}
+        scores = {track.pk: track.score for track in candidates}
+    else:
+        needed = max(1, math.ceil(len(grams) * FUZZY_THRESHOLD))
+        hits = _gram_hits(tracks, grams).filter(hits__gte=needed).order_by('-hits', 'track_id')[:limit * 5]
+        scores = {row['track_id']: row['hits'] / len(grams) for row in hits}
+        found = Track.objects.in_bulk(list(scores))
+
+    def sort_key(track):
+        text = track.search_text
+        contains = normalized in text
+        starts = text.startswith(normalized) or f' {normalized}' in text
+        return (not contains, not starts, -scores[track.pk], track.name.lower())
+
+    return sorted(found.values(), key=sort_key)[:limit]
@@ -0,0 +1,357 @@
+"""Sending track audio to the client.
+
+Views do the auth/ACL checks and then hand the file to ``serve_file``, which
+picks a backend from ``settings.MEDIA_STREAM_BACKEND``:
+
+* ``'django'`` (default) serves the bytes from the worker, answering
+  conditional requests (ETag, Last-Modified, If-Range) and single, suffix
+  and multiple (multipart/byteranges) ranges. Single-part responses carry
+  the open file as ``file_to_stream`` so a WSGI server with a
+  ``wsgi.file_wrapper`` (gunicorn) sends the range with ``sendfile(2)``;
+  otherwise the file is read in large, block-aligned chunks. Under ASGI
+  the chunks are read in worker threads (``AsyncChunks``).
+* ``'x-accel'`` returns an empty response with ``X-Accel-Redirect`` so the
+  fronting nginx serves the file (and handles Range) from an ``internal``
+  location mapped to MEDIA_ROOT.
+* ``'x-sendfile'`` does the same for Apache/lighttpd via ``X-Sendfile``.
+
+Whichever backend runs, ``serve_file`` sets Cache-Control: stream URLs that
+carry the file's version (``?v=``, see Track.get_stream_url) may be cached
+for good, anything else is revalidated.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import mimetypes
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+from django.utils.module_loading import import_string
+
+from .media_store import blob_digest
+
+
+range_spec_re = re.compile(r'(\d*)\s*-\s*(\d*)')
+
+# Large enough that a sync worker spends its time in the kernel rather than
+# in Python; a multiple of the page size so reads stay aligned.
+STREAM_BLOCK_SIZE = 256 * 1024
+
+# A Range header asking for more pieces than this is ignored (the whole file
+# is sent) rather than answered with a multipart body of tiny parts.
+MAX_RANGES = 16
+
+# A versioned URL (see media_version) always names the same bytes, so the
+# browser may keep them; any other URL is revalidated against the ETag.
+IMMUTABLE_CACHE_CONTROL = f'private, max-age={int(timedelta(days=365).total_seconds())}, immutable'
+REVALIDATE_CACHE_CONTROL = 'private, no-cache'
+
+
+class RangeFileWrapper:
+    """File-like view of ``length`` bytes of ``filelike`` starting at ``offset``.
+
+    It is both the response iterator and the ``file_to_stream`` handed to the
+    WSGI server: ``fileno()`` exposes the underlying descriptor (already
+    positioned at ``offset``) for sendfile, while ``read()`` never returns
+    bytes past the end of the range for servers that iterate instead.
+    """
+
+    def __init__(self, filelike, blksize=STREAM_BLOCK_SIZE, offset=0, length=None):
+        self.filelike = filelike
+        self.filelike.seek(offset, os.SEEK_SET)
+        self.offset = offset
+        self.remaining = length
+        self.blksize = blksize
+
+    def fileno(self):
+        return self.filelike.fileno()
+
+    def read(self, size=-1):
+        if self.remaining is not None:
+            if self.remaining <= 0:
+                return b''
+            size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.filelike.read(size)
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        self.offset += len(data)
+        return data
+
+    def close(self):
+        self.filelike.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # Trim the first read so every later one starts on a block boundary.
+        data = self.read(self.blksize - (self.offset % self.blksize))
+        if not data:
+            raise StopIteration()
+        return data
+
+
+class AsyncChunks:
+    """Async iterator over a chunk iterator whose reads block (a RangeFileWrapper, say).
+
+    Under ASGI a StreamingHttpResponse needs an async iterator, or Django
+    reads the whole body into memory first. Each chunk is read in a worker
+    thread, so the event loop carries on serving other listeners meanwhile.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self._iterator = iter(chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await asyncio.to_thread(next, self._iterator, None)
+        if chunk is None:
+            raise StopAsyncIteration
+        return chunk
+
+    def close(self):
+        self.chunks.close()
+
+
+def guess_content_type(path):
+    content_type, _ = mimetypes.guess_type(path)
+    return content_type or 'application/octet-stream'
+
+
+def media_version(file_name, file_size):
+    """Short token naming the bytes a track's file holds, for versioned stream URLs.
+
+    Stored files are never overwritten in place: a new file gets a new name
+    (a new digest, when content-addressed), so the name and size identify it.
+    """
+    digest = blob_digest(file_name) or hashlib.sha256(f'{file_name}:{file_size}'.encode()).hexdigest()
+    return digest[:16]
+
+
+# What serving a stored file needs to know about it, gathered by one stat
+# (describe_file) so it can be cached instead of looked up on every request.
+# ``name`` and ``path`` are as on a FieldFile, so either can be served.
+MediaDescriptor = namedtuple('MediaDescriptor', 'name path size last_modified etag content_type')
+
+
+def describe_file(fieldfile):
+    """A MediaDescriptor for a stored file.
+
+    The strong ETag is the content hash for content-addressed files, and
+    the size and modification time otherwise.
+    """
+    return _describe(fieldfile.name, fieldfile.path)
+
+
+def describe_path(name):
+    """A MediaDescriptor for the file called ``name`` in default_storage."""
+    return _describe(name, default_storage.path(name))
+
+
+def _describe(name, path):
+    stat = os.stat(path)
+    digest = blob_digest(name)
+    etag = f'"{digest}"' if digest else f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    return MediaDescriptor(name, path, stat.st_size, int(stat.st_mtime), etag, guess_content_type(name))
+
+
+def if_range_matches(request, etag, last_modified):
+    """False if an If-Range header says the client's copy is stale (so Range must be ignored)."""
+    if_range = request.META.get('HTTP_IF_RANGE', '').strip()
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        # Strong comparison; a weak validator never matches.
+        return if_range == etag
+    if if_range.startswith('W/'):
+        return False
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def parse_ranges(range_header, size):
+    """The ``(first_byte, last_byte)`` pairs a Range header asks for, merged and in order.
+
+    Handles ``a-b``, open-ended ``a-`` and suffix ``-n`` ranges, several to a
+    header. Returns None if the header is not a byte range this understands
+    (the whole file should be sent) and an empty list if no range overlaps
+    the file (416).
+    """
+    units, _, spec = range_header.partition('=')
+    if units.strip().lower() != 'bytes' or not spec.strip():
+        return None
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        match = range_spec_re.fullmatch(part)
+        if not match or not any(match.groups()):
+            return None
+        first_byte, last_byte = match.groups()
+        if not first_byte:
+            suffix_length = int(last_byte)
+            if suffix_length > 0 and size > 0:
+                ranges.append((max(0, size - suffix_length), size - 1))
+            continue
+        first_byte = int(first_byte)
+        if last_byte and int(last_byte) < first_byte:
+            return None
+        if first_byte < size:
+            ranges.append((first_byte, min(int(last_byte), size - 1) if last_byte else size - 1))
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    merged = []
+    for first_byte, last_byte in sorted(ranges):
+        if merged and first_byte <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last_byte))
+        else:
+            merged.append((first_byte, last_byte))
+    return merged
+
+
+class MultipartRangeBody:
+    """A multipart/byteranges body: each range of ``filelike`` with its own part headers."""
+
+    def __init__(self, filelike, ranges, size, content_type, blksize=STREAM_BLOCK_SIZE):
+        self.filelike = filelike
+        self.ranges = ranges
+        self.blksize = blksize
+        self.boundary = uuid.uuid4().hex
+        self.part_headers = [
+            (
+                f'--{self.boundary}\r\nContent-Type: {content_type}\r\n'
+                f'Content-Range: bytes {first_byte}-{last_byte}/{size}\r\n\r\n'
+            ).encode('ascii')
+            for first_byte, last_byte in ranges
+        ]
+        self.closing = f'--{self.boundary}--\r\n'.encode('ascii')
+
+    @property
+    def content_type(self):
+        return f'multipart/byteranges; boundary={self.boundary}'
+
+    def __len__(self):
+        return (
+            sum(len(headers) + last_byte - first_byte + 1 + 2
+                for headers, (first_byte, last_byte) in zip(self.part_headers, self.ranges))
+            + len(self.closing)
+        )
+
+    def __iter__(self):
+        for headers, (first_byte, last_byte) in zip(self.part_headers, self.ranges):
+            yield headers
+            yield from RangeFileWrapper(self.filelike, self.blksize, first_byte, last_byte - first_byte + 1)
+            yield b'\r\n'
+        yield self.closing
+
+    def close(self):
+        self.filelike.close()
+
+
+def serve_in_process(request, fieldfile, content_type):
+    media = fieldfile if isinstance(fieldfile, MediaDescriptor) else describe_file(fieldfile)
+    etag, last_modified, size = media.etag, media.last_modified, media.size
+    headers = {'ETag': etag, 'Last-Modified': http_date(last_modified), 'Accept-Ranges': 'bytes'}
+    # 304 for If-None-Match / If-Modified-Since, 412 for If-Match / If-Unmodified-Since.
+    unconditional = HttpResponse(headers=headers)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified, response=unconditional)
+    if response is not unconditional:
+        return response
+
+    ranges = None
+    if 'HTTP_RANGE' in request.META and if_range_matches(request, etag, last_modified):
+        ranges = parse_ranges(request.META['HTTP_RANGE'], size)
+
+    asynchronous = isinstance(request, ASGIRequest)
+    if ranges == []:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif ranges and len(ranges) > 1:
+        body = MultipartRangeBody(open(media.path, 'rb'), ranges, size, content_type)
+        response = StreamingHttpResponse(
+            AsyncChunks(body) if asynchronous else body, status=206, content_type=body.content_type,
+        )
+        response['Content-Length'] = str(len(body))
+    else:
+        f = open(media.path, 'rb')
+        if ranges:
+            [(first_byte, last_byte)] = ranges
+            length = last_byte - first_byte + 1
+            body = RangeFileWrapper(f, offset=first_byte, length=length)
+            status = 206
+            response_headers = {'Content-Range': f'bytes {first_byte}-{last_byte}/{size}'}
+        else:
+            length = size
+            body = RangeFileWrapper(f, length=size)
+            status, response_headers = 200, {}
+        response = StreamingHttpResponse(
+            AsyncChunks(body) if asynchronous else body, status=status, content_type=content_type,
+            headers=response_headers,
+        )
+        response['Content-Length'] = str(length)
+        if not asynchronous:
+            # Picked up by WSGIHandler and passed to wsgi.file_wrapper (sendfile).
+            response.file_to_stream = body
+            response.block_size = STREAM_BLOCK_SIZE
+
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def serve_x_accel_redirect(request, fieldfile, content_type):
+    response = HttpResponse(content_type=content_type)
+    response['X-Accel-Redirect'] = quote(settings.MEDIA_ACCEL_REDIRECT_PREFIX + fieldfile.name)
+    return response
+
+
+def serve_x_sendfile(request, fieldfile, content_type):
+    response = HttpResponse(content_type=content_type)
+    response['X-Sendfile'] = fieldfile.path
+    return response
+
+
+STREAM_BACKENDS = {
+    'django': serve_in_process,
+    'x-accel': serve_x_accel_redirect,
+    'x-sendfile': serve_x_sendfile,
+}
+
+
+def get_stream_backend():
+    backend = getattr(settings, 'MEDIA_STREAM_BACKEND', 'django')
+    if backend in STREAM_BACKENDS:
+        return STREAM_BACKENDS[backend]
+    # Allow a dotted path to a custom backend callable.
+    return import_string(backend)
+
+
+def serve_file(request, fieldfile, content_type=None, filename=None, as_attachment=False, immutable=False):
+    """Respond with the contents of ``fieldfile`` (a FieldFile or MediaDescriptor) via the configured backend.
+
+    ``filename`` and ``as_attachment`` set Content-Disposition. Pass
+    ``immutable`` only when the URL pins the file's version (see
+    media_version), so browsers keep the audio instead of revalidating it.
+    """
+    if content_type is None:
+        content_type = (
+            fieldfile.content_type if isinstance(fieldfile, MediaDescriptor) else guess_content_type(fieldfile.name)
+        )
+    response = get_stream_backend()(request, fieldfile, content_type)
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+    if (filename or as_attachment) and response.status_code in (200, 206):
+        response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+    return response
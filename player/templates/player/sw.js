@@ -86,9 +86,15 @@ function buildAudioResponse(request, record) {
         });
     }
 
-    const match = /bytes=(\d+)-(\d*)/.exec(rangeHeader);
-    let start = match ? parseInt(match[1], 10) : 0;
+    // Only the first range is answered; a suffix range ("bytes=-500") asks
+    // for the last bytes of the file.
+    const match = /bytes=(\d*)-(\d*)/.exec(rangeHeader);
+    let start = (match && match[1]) ? parseInt(match[1], 10) : 0;
     let end = (match && match[2]) ? parseInt(match[2], 10) : total - 1;
+    if (match && !match[1] && match[2]) {
+        start = Math.max(0, total - end);
+        end = total - 1;
+    }
     if (isNaN(start) || start < 0) start = 0;
     if (isNaN(end) || end >= total) end = total - 1;
     if (start > end) start = 0;
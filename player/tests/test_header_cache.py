@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from player.header_cache import PLAYBACK
+from player.models import Bookmark, Track, UserPlaybackState
+from player.playback import apply_playback_samples
+from player.playback_buffer import playback_buffer
+
+LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'header-tests'}}
+
+
+class HeaderContextTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='listener', password='pw')
+        self.client.force_login(self.user)
+        self.track = Track.objects.create(name='Episode', owner=self.user, type='podcast', duration=100)
+        Bookmark.objects.create(user=self.user, name='Intro', track=self.track, position=5)
+        UserPlaybackState.objects.create(user=self.user, track=self.track, last_played_position=12)
+
+    def header_queries(self, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(*args, **kwargs)
+        tables = ('"player_bookmark"', '"player_userplaybackstate"')
+        return response, [q['sql'] for q in queries if any(f'FROM {table}' in q['sql'] for table in tables)]
+
+    def test_partials_do_not_touch_header_data(self):
+        _, queries = self.header_queries(reverse('track_list'), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(queries, [])
+
+    def test_full_page_loads_each_section_once(self):
+        response, queries = self.header_queries(reverse('track_list'))
+        self.assertContains(response, 'Intro')
+        self.assertEqual(len(queries), 2)
+
+
+@override_settings(CACHES=LOCMEM)
+class HeaderCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='listener', password='pw')
+        self.client.force_login(self.user)
+        self.track = Track.objects.create(name='Episode', owner=self.user, type='podcast', duration=100)
+
+    def page(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('playlist_list'))
+        header_sql = [q['sql'] for q in queries if 'player_bookmark' in q['sql'] or 'player_userplaybackstate' in q['sql']]
+        return response, header_sql
+
+    def test_cached_between_requests_until_written(self):
+        self.page()
+        response, queries = self.page()
+        self.assertEqual(queries, [])
+        self.assertContains(response, 'No bookmarks saved yet.')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Bookmark.objects.create(user=self.user, name='Chapter two', track=self.track, position=30)
+        response, queries = self.page()
+        self.assertContains(response, 'Chapter two')
+        self.assertEqual(len(queries), 1)
+
+    def test_playback_sync_refreshes_header(self):
+        response, _ = self.page()
+        self.assertIsNone(response.context['playback_state'] or None)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_playback_samples(self.user, [{'track_id': self.track.id, 'position': 42}])
+        response, _ = self.page()
+        self.assertEqual(response.context['playback_state'].last_played_position, 42)
+
+    def test_buffered_heartbeats_leave_the_cache_alone(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        buffered = self.settings(
+            PLAYBACK_FLUSH_INTERVAL=3600, PLAYBACK_BUFFER_PATH=os.path.join(tmpdir, 'buffer.sqlite3'),
+        )
+        with buffered:
+            with self.captureOnCommitCallbacks(execute=True):
+                apply_playback_samples(self.user, [{'track_id': self.track.id, 'position': 10}])
+            self.page()
+            version = cache.get(f'player:header:{PLAYBACK}:version:{self.user.pk}')
+
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                apply_playback_samples(self.user, [{'track_id': self.track.id, 'position': 42}])
+            self.assertEqual(callbacks, [])
+            response, queries = self.page()
+            self.assertEqual(queries, [])
+            self.assertEqual(response.context['playback_state'].last_played_position, 42)
+            self.assertEqual(cache.get(f'player:header:{PLAYBACK}:version:{self.user.pk}'), version)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                playback_buffer.flush()
+            self.page()
+        response, _ = self.page()
+        self.assertEqual(response.context['playback_state'].last_played_position, 42)
+
+    def test_track_rename_refreshes_bookmarks(self):
+        Bookmark.objects.create(user=self.user, name='Intro', track=self.track)
+        self.page()
+        self.track.name = 'Renamed episode'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.track.save()
+        response, _ = self.page()
+        self.assertContains(response, 'Renamed episode')
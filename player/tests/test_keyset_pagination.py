@@ -0,0 +1,121 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db.models import Max
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from player.models import Track, Transcript, UserTrackLastPlayed
+from player.pagination import SortKey, encode_cursor, keyset_page
+
+
+class KeysetPageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='listener', password='pw')
+        # Duplicate names make the id tiebreak matter.
+        self.tracks = [
+            Track.objects.create(name=f'Track {n // 2}', owner=self.user, type='song')
+            for n in range(7)
+        ]
+        self.keys = [SortKey('name'), SortKey('id')]
+        self.expected = sorted(self.tracks, key=lambda t: (t.name, t.id))
+
+    def walk_forward(self, queryset, keys, per_page):
+        seen, page = [], keyset_page(queryset, keys, per_page=per_page)
+        seen += page.object_list
+        while page.has_next:
+            page = keyset_page(queryset, keys, cursor=page.next_cursor, per_page=per_page)
+            seen += page.object_list
+        return seen, page
+
+    def test_forward_walk_visits_every_row_once_in_order(self):
+        seen, last = self.walk_forward(Track.objects.all(), self.keys, 3)
+        self.assertEqual(seen, self.expected)
+        self.assertTrue(last.has_previous)
+        self.assertIsNone(last.next_cursor)
+
+    def test_previous_cursor_returns_preceding_page(self):
+        first = keyset_page(Track.objects.all(), self.keys, per_page=2)
+        second = keyset_page(Track.objects.all(), self.keys, cursor=first.next_cursor, per_page=2)
+        third = keyset_page(Track.objects.all(), self.keys, cursor=second.next_cursor, per_page=2)
+        back = keyset_page(Track.objects.all(), self.keys, cursor=third.prev_cursor, per_page=2)
+        self.assertEqual(back.object_list, second.object_list)
+        self.assertTrue(back.has_next)
+        self.assertTrue(back.has_previous)
+
+        # Stepping back onto the start gives an ordinary first page.
+        start = keyset_page(Track.objects.all(), self.keys, cursor=back.prev_cursor, per_page=2)
+        self.assertEqual(start.object_list, first.object_list)
+        self.assertFalse(start.has_previous)
+
+    def test_nullable_descending_key_keeps_nulls_last(self):
+        now = timezone.now()
+        for n, track in enumerate(self.tracks[:3]):
+            track.played = now - timedelta(days=n)
+            UserTrackLastPlayed.objects.create(user=self.user, track=track, last_played=track.played)
+        queryset = Track.objects.annotate(played=Max('usertracklastplayed__last_played'))
+        keys = [SortKey('played', descending=True, nullable=True), SortKey('id')]
+
+        seen, last = self.walk_forward(queryset, keys, 2)
+        self.assertEqual([t.pk for t in seen], [t.pk for t in self.tracks])
+
+        back = keyset_page(queryset, keys, cursor=last.prev_cursor, per_page=2)
+        self.assertEqual([t.pk for t in back], [t.pk for t in self.tracks[4:6]])
+
+    def test_bad_or_foreign_cursor_falls_back_to_first_page(self):
+        other_keys = [SortKey('name', descending=True), SortKey('id')]
+        for cursor in ('garbage', encode_cursor(other_keys, ["Track 1", 1])):
+            page = keyset_page(Track.objects.all(), self.keys, cursor=cursor, per_page=3)
+            self.assertEqual(page.object_list, self.expected[:3])
+            self.assertFalse(page.has_previous)
+
+    def test_count_only_when_asked(self):
+        self.assertIsNone(keyset_page(Track.objects.all(), self.keys).count)
+        self.assertEqual(keyset_page(Track.objects.all(), self.keys, with_count=True).count, 7)
+
+
+class KeysetViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='listener', password='pw')
+        self.client.force_login(self.user)
+        for n in range(12):
+            Track.objects.create(name=f'Track {n:02}', owner=self.user, type='song')
+
+    def test_track_list_ajax_returns_cursors(self):
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        first = self.client.get(reverse('track_list'), {'count': '1'}, **ajax).json()
+        self.assertEqual(first['approximate_count'], 12)
+        self.assertIsNone(first['prev_cursor'])
+
+        second = self.client.get(reverse('track_list'), {'cursor': first['next_cursor']}, **ajax).json()
+        self.assertIn('Track 10', second['track_html'])
+        self.assertNotIn('Track 09', second['track_html'])
+        self.assertIsNone(second['next_cursor'])
+        self.assertIsNotNone(second['prev_cursor'])
+        self.assertIsNone(second['approximate_count'])
+
+    def test_transcript_list_pages_newest_first(self):
+        base = timezone.now()
+        for n, track in enumerate(Track.objects.order_by('name')[:12]):
+            transcript = Transcript.objects.create(track=track, status='completed')
+            Transcript.objects.filter(pk=transcript.pk).update(created_at=base - timedelta(minutes=n))
+        Transcript.objects.create(track=Track.objects.create(name='Other', owner=User.objects.create_user('x'), type='song'))
+
+        response = self.client.get(reverse('transcript_list'))
+        page = response.context['transcripts']
+        self.assertEqual(len(page), 12)
+        self.assertFalse(page.has_next)
+
+        Transcript.objects.bulk_create([
+            Transcript(track=Track.objects.create(name=f'Extra {n:02}', owner=self.user, type='song'), status='completed')
+            for n in range(10)
+        ])
+        first = self.client.get(reverse('transcript_list')).context['transcripts']
+        self.assertTrue(first.has_next)
+        more = self.client.get(
+            reverse('transcript_list'), {'cursor': first.next_cursor}, HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        ).json()
+        self.assertIn('Track 11', more['rows_html'])
+        self.assertNotIn('Other', more['rows_html'])
+        self.assertIsNone(more['next_cursor'])
@@ -0,0 +1,89 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from player.models import Playlist, PlaylistItem, Track, TrackSearchGram
+from player import search
+from player.search import matching_tracks, rank_tracks
+
+
+class TrackSearchIndexTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='listener', password='pw')
+        self.client.force_login(self.user)
+
+    def make(self, name, artist=None, owner=None):
+        return Track.objects.create(name=name, artist=artist, owner=owner or self.user, type='song')
+
+    def names(self, query):
+        return sorted(matching_tracks(Track.objects.filter(owner=self.user), query).values_list('name', flat=True))
+
+    def test_save_maintains_search_text_and_grams(self):
+        track = self.make('Café Society', 'Böb')
+        self.assertEqual(track.search_text, 'cafe society bob')
+        self.assertIn('soc', set(track.search_grams.values_list('gram', flat=True)))
+
+        track.name = 'Night Drive'
+        track.save()
+        grams = set(TrackSearchGram.objects.filter(track=track).values_list('gram', flat=True))
+        self.assertIn('nig', grams)
+        self.assertNotIn('soc', grams)
+
+    def test_substring_matches_like_icontains(self):
+        self.make('Apple', 'Artist A')
+        self.make('Banana', 'Artist B')
+        self.assertEqual(self.names('ppl'), ['Apple'])
+        self.assertEqual(self.names('artist b'), ['Banana'])
+        self.assertEqual(self.names('CAFE'), [])
+
+    def test_accents_and_punctuation_are_ignored(self):
+        self.make('Beyoncé — Halo')
+        self.assertEqual(self.names('beyonce halo'), ['Beyoncé — Halo'])
+
+    def test_typos_fall_back_to_near_misses(self):
+        self.make('Bohemian Rhapsody', 'Queen')
+        self.make('Hotel California', 'Eagles')
+        self.assertEqual(self.names('rhapsodie'), ['Bohemian Rhapsody'])
+
+    def test_typeahead_ranks_prefix_matches_first_and_respects_access(self):
+        self.make('The Night Shift')
+        self.make('Nightcall')
+        self.make('Nighthawks', owner=User.objects.create_user(username='other', password='pw'))
+        response = self.client.get(reverse('track_typeahead'), {'q': 'night'})
+        self.assertEqual([r['name'] for r in response.json()], ['Nightcall', 'The Night Shift'])
+
+    def test_typeahead_includes_shared_playlist_tracks(self):
+        other = User.objects.create_user(username='sharer', password='pw')
+        shared = self.make('Shared Song', owner=other)
+        playlist = Playlist.objects.create(name='Mix', owner=other)
+        playlist.accessors.add(self.user)
+        PlaylistItem.objects.create(playlist=playlist, track=shared, order=0)
+        names = [t.name for t in rank_tracks(Track.objects.accessible_by(self.user), 'shared')]
+        self.assertEqual(names, ['Shared Song'])
+
+
+class TrigramIndexDetectionTests(TestCase):
+    def postgres(self, index_exists):
+        connection = mock.MagicMock(vendor='postgresql', _player_trigram_index=None)
+        connection.cursor.return_value.__enter__.return_value.fetchone.return_value = (index_exists,)
+        return connection
+
+    def test_postgres_without_the_index_uses_search_grams(self):
+        connection = self.postgres(index_exists=False)
+        with mock.patch('player.search.connection', connection):
+            self.assertFalse(search._has_trigram_index())
+            self.assertFalse(search._has_trigram_index())
+        # Looked up once, then remembered on the connection.
+        self.assertEqual(connection.cursor.call_count, 1)
+
+    def test_postgres_with_the_index_uses_it(self):
+        with mock.patch('player.search.connection', self.postgres(index_exists=True)):
+            self.assertTrue(search._has_trigram_index())
+
+    def test_other_databases_use_search_grams(self):
+        connection = mock.MagicMock(vendor='sqlite')
+        with mock.patch('player.search.connection', connection):
+            self.assertFalse(search._has_trigram_index())
+        connection.cursor.assert_not_called()
@@ -0,0 +1,168 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from player.media_store import ContentAddressedStorage, blob_digest
+from player.models import MediaBlob, Track, UserProfile
+
+
+class ContentAddressedTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.storage = ContentAddressedStorage()
+        for name in ('file', 'icon'):
+            field = Track._meta.get_field(name)
+            self.addCleanup(setattr, field, 'storage', field.storage)
+            field.storage = self.storage
+        # No grace period, so unused blobs go at once.
+        grace = mock.patch('player.media_store.BLOB_GRACE', timedelta(0))
+        grace.start()
+        self.addCleanup(grace.stop)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def blob_files(self):
+        root = os.path.join(self.media_root, 'blobs')
+        return sorted(
+            name for _, _, names in os.walk(root) for name in names
+        ) if os.path.isdir(root) else []
+
+
+class ContentAddressedStorageTests(ContentAddressedTestCase):
+    def test_identical_content_is_stored_once(self):
+        first = self.storage.save('tracks/a.mp3', ContentFile(b'same bytes'))
+        second = self.storage.save('tracks/b.MP3', ContentFile(b'same bytes'))
+        other = self.storage.save('tracks/c.mp3', ContentFile(b'other bytes'))
+
+        digest = hashlib.sha256(b'same bytes').hexdigest()
+        self.assertEqual(first, f'blobs/{digest[:2]}/{digest[2:4]}/{digest}.mp3')
+        self.assertEqual(second, first)
+        self.assertNotEqual(other, first)
+        self.assertEqual(blob_digest(first), digest)
+        self.assertIsNone(blob_digest('tracks/a.mp3'))
+        self.assertEqual(len(self.blob_files()), 2)
+
+    def test_uses_the_hash_computed_during_upload(self):
+        upload = SimpleUploadedFile('a.mp3', b'bytes')
+        upload.temporary_file_path = lambda: self.write_temp(b'bytes')
+        upload.sha256 = 'f' * 64
+        self.assertEqual(self.storage.save('tracks/a.mp3', upload), f'blobs/ff/ff/{"f" * 64}.mp3')
+
+    def write_temp(self, data):
+        fd, path = tempfile.mkstemp(dir=self.media_root)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return path
+
+
+class SharedTrackFileTests(ContentAddressedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='listener', password='pw')
+        self.other = User.objects.create_user(username='other', password='pw')
+
+    def add(self, owner, data=b'episode bytes', icon=None):
+        return Track.objects.create(
+            name='Episode', owner=owner, type='podcast', file=ContentFile(data, name='episode.mp3'),
+            icon=icon, file_size=len(data),
+        )
+
+    def used(self, user):
+        return UserProfile.objects.get(user=user).storage_used_bytes
+
+    def test_same_file_twice_is_charged_once(self):
+        first = self.add(self.user)
+        second = self.add(self.user)
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual((first.storage_charged, second.storage_charged), (True, False))
+        self.assertEqual(self.used(self.user), 13)
+        self.assertEqual(MediaBlob.objects.get().refcount, 2)
+
+        # Another user storing the same bytes shares the blob but pays for it.
+        self.add(self.other)
+        self.assertEqual(self.used(self.other), 13)
+        self.assertEqual(MediaBlob.objects.get().refcount, 3)
+
+    def test_deleting_passes_the_charge_on_then_frees_the_blob(self):
+        first = self.add(self.user)
+        second = self.add(self.user)
+
+        Track.objects.get(pk=first.pk).delete()
+        self.assertEqual(self.used(self.user), 13)
+        self.assertTrue(Track.objects.get(pk=second.pk).storage_charged)
+        self.assertEqual(len(self.blob_files()), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Track.objects.get(pk=second.pk).delete()
+        self.assertEqual(self.used(self.user), 0)
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertEqual(self.blob_files(), [])
+
+    def test_bulk_delete_refunds_once(self):
+        self.add(self.user)
+        self.add(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            Track.objects.filter(owner=self.user).delete()
+        self.assertEqual(self.used(self.user), 0)
+        self.assertEqual(self.blob_files(), [])
+
+    def test_replacing_the_file_moves_the_references(self):
+        track = self.add(self.user)
+        keeper = self.add(self.other)
+        track = Track.objects.get(pk=track.pk)
+        track.file = ContentFile(b'a new recording', name='episode.mp3')
+        track.file_size = 15
+        track.save()
+        self.assertEqual(self.used(self.user), 15)
+        self.assertEqual(MediaBlob.objects.get(name=keeper.file.name).refcount, 1)
+        self.assertEqual(MediaBlob.objects.get(name=track.file.name).refcount, 1)
+
+    def test_collect_recounts_and_sweeps(self):
+        track = self.add(self.user)
+        orphan = self.storage.save('tracks/orphan.mp3', ContentFile(b'never used'))
+        MediaBlob.objects.filter(name=track.file.name).update(refcount=7)
+
+        out = StringIO()
+        call_command('collect_media_blobs', stdout=out)
+        self.assertIn('Recounted 1 blob(s). Deleted 1 unused file(s).', out.getvalue())
+        self.assertEqual(MediaBlob.objects.get().refcount, 1)
+        self.assertFalse(self.storage.exists(orphan))
+        self.assertTrue(self.storage.exists(track.file.name))
+
+    def test_reconcile_repairs_charge_flags(self):
+        first = self.add(self.user)
+        second = self.add(self.user)
+        Track.objects.filter(pk=second.pk).update(storage_charged=True)
+        call_command('reconcile_storage_usage', stdout=StringIO())
+        self.assertEqual(
+            list(Track.objects.order_by('pk').values_list('storage_charged', flat=True)), [True, False]
+        )
+        self.assertEqual(self.used(self.user), 13)
+        self.assertEqual(first.pk, Track.objects.get(storage_charged=True).pk)
+
+    def test_playlist_upload_of_duplicate_files(self):
+        self.client.force_login(self.user)
+        files = [SimpleUploadedFile(f'{name}.mp3', b'feed episode') for name in ('one', 'copy of one')]
+        with mock.patch('player.ingest.read_audio_metadata', return_value={'duration': 5}):
+            response = self.client.post(reverse('upload_playlist'), {
+                'name': 'Feed', 'default_track_type': 'podcast', 'tracks': files,
+            }, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.blob_files()), 1)
+        self.assertEqual(MediaBlob.objects.get().refcount, 2)
+        self.assertEqual(self.used(self.user), 12)
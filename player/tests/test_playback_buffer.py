@@ -0,0 +1,115 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from player.models import PodcastProgress, Playlist, PlaylistItem, Track, UserPlaybackState, UserTrackLastPlayed
+from player.playback_buffer import playback_buffer
+
+
+def ms(dt):
+    return int(dt.timestamp() * 1000)
+
+
+class PlaybackWriteBehindTests(TestCase):
+    """Live heartbeats are buffered and reach the database on flush."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            PLAYBACK_FLUSH_INTERVAL=3600,
+            PLAYBACK_BUFFER_PATH=os.path.join(self.tmpdir, 'buffer.sqlite3'),
+            MEDIA_ROOT=self.tmpdir,
+        )
+        self.settings_override.enable()
+
+        self.user = User.objects.create_user('listener', password='pw')
+        self.podcast = Track.objects.create(
+            name='Podcast', owner=self.user, type='podcast', duration=600,
+            file=ContentFile(b'x', name='p.mp3'),
+        )
+        self.playlist = Playlist.objects.create(name='Shows', owner=self.user)
+        PlaylistItem.objects.create(playlist=self.playlist, track=self.podcast, order=0)
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def post_samples(self, samples):
+        return self.client.post(
+            '/api/sync_playback_state/',
+            data=json.dumps({'samples': samples}),
+            content_type='application/json',
+        )
+
+    def test_live_heartbeat_is_buffered_until_flush(self):
+        response = self.post_samples([{'track_id': self.podcast.id, 'position': 42, 'recorded_at': ms(timezone.now())}])
+        self.assertTrue(response.json()['applied_state'])
+        self.assertFalse(PodcastProgress.objects.exists())
+        self.assertFalse(UserPlaybackState.objects.exists())
+
+        self.assertEqual(playback_buffer.flush(), 2)
+        self.assertEqual(PodcastProgress.objects.get(user=self.user, track=self.podcast).position, 42)
+        self.assertEqual(UserPlaybackState.objects.get(user=self.user).last_played_position, 42)
+        self.assertTrue(UserTrackLastPlayed.objects.filter(user=self.user, track=self.podcast).exists())
+        self.assertEqual(playback_buffer.flush(), 0)
+
+    def test_reads_merge_unflushed_positions(self):
+        PodcastProgress.objects.create(
+            user=self.user, track=self.podcast, position=5,
+            recorded_at=timezone.now() - timedelta(minutes=5),
+        )
+        self.post_samples([{'track_id': self.podcast.id, 'position': 77, 'recorded_at': ms(timezone.now())}])
+
+        data = self.client.get(reverse('playlist_tracks_api', args=[self.playlist.id])).json()
+        self.assertEqual(data[0]['position'], 77)
+        response = self.client.get(reverse('track_list'))
+        self.assertEqual(response.context['tracks'].object_list[0].position, 77)
+        response = self.client.get(reverse('playlist_detail', args=[self.playlist.id]))
+        self.assertEqual(response.context['playback_state'].last_played_position, 77)
+
+    def test_flush_keeps_newer_database_rows(self):
+        self.post_samples([{'track_id': self.podcast.id, 'position': 10, 'recorded_at': ms(timezone.now() - timedelta(seconds=30))}])
+        PodcastProgress.objects.create(user=self.user, track=self.podcast, position=500, recorded_at=timezone.now())
+        playback_buffer.flush()
+        self.assertEqual(PodcastProgress.objects.get(user=self.user, track=self.podcast).position, 500)
+
+    def test_offline_replay_is_written_through(self):
+        stale = timezone.now() - timedelta(hours=2)
+        response = self.post_samples([
+            {'track_id': self.podcast.id, 'position': 9, 'recorded_at': ms(stale), 'podcast_only': True},
+        ])
+        self.assertEqual(response.json()['applied_podcast'], [self.podcast.id])
+        self.assertEqual(PodcastProgress.objects.get(user=self.user, track=self.podcast).position, 9)
+
+    def test_samples_for_deleted_tracks_do_not_block_the_flush(self):
+        other = User.objects.create_user('other', password='pw')
+        song = Track.objects.create(name='Song', owner=other, type='podcast', file=ContentFile(b'y', name='s.mp3'))
+        now = ms(timezone.now())
+        self.post_samples([{'track_id': self.podcast.id, 'position': 42, 'playlist_id': self.playlist.id, 'recorded_at': now}])
+        self.client.force_login(other)
+        self.post_samples([{'track_id': song.id, 'position': 7, 'recorded_at': now}])
+
+        self.podcast.delete()
+        self.assertEqual(playback_buffer.flush(), 4)
+        self.assertEqual(PodcastProgress.objects.get(user=other, track=song).position, 7)
+        self.assertEqual(UserPlaybackState.objects.get(user=other).last_played_position, 7)
+        self.assertFalse(UserPlaybackState.objects.filter(user=self.user).exists())
+        # Nothing was put back to fail the next flush.
+        self.assertEqual(playback_buffer.flush(), 0)
+
+    def test_samples_keep_their_track_when_the_playlist_is_deleted(self):
+        self.post_samples([{'track_id': self.podcast.id, 'position': 42, 'playlist_id': self.playlist.id, 'recorded_at': ms(timezone.now())}])
+        self.playlist.delete()
+        playback_buffer.flush()
+        state = UserPlaybackState.objects.get(user=self.user)
+        self.assertEqual(state.last_played_position, 42)
+        self.assertIsNone(state.playlist_id)
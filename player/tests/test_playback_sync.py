@@ -1,9 +1,13 @@
 import json
+import shutil
+import tempfile
 from datetime import timedelta
 
 from django.contrib.auth.models import User
 from django.core.files.base import ContentFile
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from player.models import PodcastProgress, Track, UserPlaybackState, UserTrackLastPlayed
@@ -21,6 +25,10 @@ class PlaybackSyncTests(TestCase):
     """
 
     def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
         self.user = User.objects.create_user('listener', password='pw')
         self.podcast = Track.objects.create(
             name='Podcast', owner=self.user, type='podcast', duration=600,
@@ -32,6 +40,10 @@ class PlaybackSyncTests(TestCase):
         )
         self.client.force_login(self.user)
 
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
     def post_state(self, **payload):
         return self.client.post(
             '/api/update_playback_state/',
@@ -126,3 +138,101 @@ class PlaybackSyncTests(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertTrue(response.json()['applied_state'])
+
+
+class BatchedPlaybackSyncTests(TestCase):
+    """sync_playback_state: many samples in, newest per track applied."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.user = User.objects.create_user('listener', password='pw')
+        self.other = User.objects.create_user('other', password='pw')
+        self.podcast = Track.objects.create(
+            name='Podcast', owner=self.user, type='podcast', duration=600,
+            file=ContentFile(b'x', name='p.mp3'),
+        )
+        self.song = Track.objects.create(
+            name='Song', owner=self.user, type='song', duration=180,
+            file=ContentFile(b'x', name='s.mp3'),
+        )
+        self.foreign = Track.objects.create(
+            name='Not mine', owner=self.other, type='song',
+            file=ContentFile(b'x', name='f.mp3'),
+        )
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def post_samples(self, samples):
+        return self.client.post(
+            '/api/sync_playback_state/',
+            data=json.dumps({'samples': samples}),
+            content_type='application/json',
+        )
+
+    def test_collapses_to_newest_sample_per_track(self):
+        base = timezone.now() - timedelta(minutes=10)
+        samples = [
+            {'track_id': self.podcast.id, 'position': p, 'recorded_at': ms(base + timedelta(seconds=p))}
+            for p in (30, 10, 20)
+        ]
+        samples.append({'track_id': self.song.id, 'position': 5, 'recorded_at': ms(base + timedelta(seconds=1))})
+        response = self.post_samples(samples)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['accepted'], 4)
+        self.assertEqual(data['applied_podcast'], [self.podcast.id])
+
+        progress = PodcastProgress.objects.get(user=self.user, track=self.podcast)
+        self.assertEqual(progress.position, 30)
+        state = UserPlaybackState.objects.get(user=self.user)
+        self.assertEqual(state.track_id, self.podcast.id)
+        self.assertEqual(state.last_played_position, 30)
+        self.assertEqual(UserTrackLastPlayed.objects.filter(user=self.user).count(), 2)
+
+    def test_offline_podcast_replay_reports_stale_tracks(self):
+        recent = timezone.now() - timedelta(minutes=1)
+        PodcastProgress.objects.create(user=self.user, track=self.podcast, position=300, recorded_at=recent)
+        stale = timezone.now() - timedelta(hours=1)
+        response = self.post_samples([
+            {'track_id': self.podcast.id, 'position': 10, 'recorded_at': ms(stale), 'podcast_only': True},
+        ])
+        data = response.json()
+        self.assertFalse(data['applied_state'])
+        self.assertEqual(data['stale_podcast'], [self.podcast.id])
+        self.assertFalse(UserPlaybackState.objects.filter(user=self.user).exists())
+        self.assertEqual(PodcastProgress.objects.get(user=self.user, track=self.podcast).position, 300)
+
+    def test_rejects_malformed_and_inaccessible_samples(self):
+        response = self.post_samples([
+            {'track_id': self.foreign.id, 'position': 1},
+            {'position': 1},
+            {'track_id': self.song.id, 'position': 2},
+        ])
+        data = response.json()
+        self.assertEqual(data['rejected'], [0, 1])
+        self.assertEqual(data['accepted'], 1)
+        self.assertEqual(UserPlaybackState.objects.get(user=self.user).track_id, self.song.id)
+
+    def test_write_queries_do_not_grow_with_batch_size(self):
+        def batch(size, start):
+            return [
+                {'track_id': (self.podcast.id, self.song.id)[i % 2], 'position': i,
+                 'recorded_at': ms(start + timedelta(seconds=i))}
+                for i in range(size)
+            ]
+
+        with CaptureQueriesContext(connection) as small:
+            self.post_samples(batch(2, timezone.now() - timedelta(hours=1)))
+        with CaptureQueriesContext(connection) as large:
+            self.post_samples(batch(100, timezone.now() - timedelta(minutes=30)))
+        self.assertEqual(len(large), len(small))
+
+    def test_missing_samples_is_bad_request(self):
+        response = self.client.post('/api/sync_playback_state/', data='{}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
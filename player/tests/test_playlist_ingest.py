@@ -0,0 +1,107 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from player.ingest import IngestProgress, ingest_files
+from player.models import GB, Playlist, Track, TrackSearchGram, UserProfile
+from player.search import matching_tracks
+
+LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'ingest-tests'}}
+
+
+def png(name='icon.png'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (2, 2)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(CACHES=LOCMEM)
+class PlaylistIngestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='listener', password='pw')
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def stored(self, directory):
+        path = os.path.join(self.media_root, directory)
+        return sorted(os.listdir(path)) if os.path.isdir(path) else []
+
+    def post(self, files, **extra):
+        return self.client.post(reverse('upload_playlist'), {
+            'name': 'Series', 'default_track_type': 'podcast', 'tracks': files, **extra,
+        }, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+    def test_tracks_are_bulk_created_like_saved_ones(self):
+        files = [SimpleUploadedFile(f'Episode {n}.mp3', b'x' * (n * 10)) for n in range(1, 4)]
+        with mock.patch('player.ingest.read_audio_metadata', return_value={'duration': 60}):
+            response = self.post(files, default_track_icon=png(), progress_id='abc123')
+        self.assertEqual(response.status_code, 200)
+
+        playlist = Playlist.objects.get()
+        tracks = [item.track for item in playlist.playlistitem_set.order_by('order').select_related('track')]
+        self.assertEqual([track.name for track in tracks], ['Episode 1', 'Episode 2', 'Episode 3'])
+        self.assertEqual({track.duration for track in tracks}, {60})
+        self.assertEqual(len(self.stored('tracks')), 3)
+
+        # One icon file, shared by every track.
+        self.assertEqual(len(self.stored('track_icons')), 1)
+        self.assertEqual({track.icon.name for track in tracks}, {f'track_icons/{self.stored("track_icons")[0]}'})
+
+        self.assertEqual(UserProfile.objects.get(user=self.user).storage_used_bytes, 60)
+        self.assertTrue(TrackSearchGram.objects.filter(track=tracks[0]).exists())
+        self.assertEqual(matching_tracks(Track.objects.all(), 'episode 2').get(), tracks[1])
+
+        response = self.client.get(reverse('upload_progress', args=['abc123']))
+        self.assertEqual(response.json(), {'stage': 'done', 'done': 3, 'total': 3})
+
+    def test_rejected_upload_leaves_no_files(self):
+        UserProfile.objects.filter(user=self.user).update(storage_limit_gb=15 / GB)
+        response = self.post([SimpleUploadedFile('big.mp3', b'x' * 20)], default_track_icon=png())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((self.stored('tracks'), self.stored('track_icons')), ([], []))
+
+    def test_failed_ingestion_removes_stored_files(self):
+        files = [SimpleUploadedFile(f'{n}.mp3', b'x') for n in range(3)]
+        with mock.patch('player.ingest.read_audio_metadata', side_effect=[{'duration': 1}, OSError, {'duration': 1}]):
+            response = self.post(files, progress_id='failing')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.stored('tracks'), [])
+        self.assertFalse(Playlist.objects.exists())
+        self.assertEqual(self.client.get(reverse('upload_progress', args=['failing'])).json()['stage'], 'failed')
+
+    def test_progress_is_published_from_the_calling_thread(self):
+        published_in = []
+        publish = IngestProgress._publish
+
+        def recording_publish(progress):
+            published_in.append(threading.get_ident())
+            publish(progress)
+
+        files = [SimpleUploadedFile(f'{n}.mp3', b'x') for n in range(4)]
+        with mock.patch.object(IngestProgress, '_publish', recording_publish), \
+                mock.patch('player.ingest.read_audio_metadata', return_value={'duration': 1}):
+            progress = IngestProgress(self.user.pk, 'abc123', len(files))
+            ingested = ingest_files(files, progress)
+        self.assertEqual([file.filename for file in ingested], ['0.mp3', '1.mp3', '2.mp3', '3.mp3'])
+        self.assertEqual(progress.done, 4)
+        self.assertEqual(set(published_in), {threading.get_ident()})
+
+    def test_progress_is_private(self):
+        self.assertEqual(self.client.get(reverse('upload_progress', args=['unknown'])).status_code, 404)
@@ -0,0 +1,207 @@
+import io
+import os
+import shutil
+import struct
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from player import remux
+from player.models import RetiredFile, Track, TrackRendition, UserProfile
+from player.renditions import renditions_due
+from player.tests.test_renditions import fake_make_rendition
+
+
+def box(kind, payload=b''):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def mp4(faststart):
+    boxes = [box(b'moov', b'index'), box(b'mdat', b'audio' * 20)]
+    return box(b'ftyp', b'M4A \x00\x00\x00\x00') + b''.join(boxes if faststart else boxes[::-1])
+
+
+def mp3_frame(bitrate_index, tag=b''):
+    """An MPEG-1 Layer III frame at 44.1 kHz, joint stereo; ``tag`` goes where a Xing header would."""
+    bitrate = remux._MP3_BITRATES[1][bitrate_index]
+    length = 144 * bitrate * 1000 // 44100
+    frame = bytes([0xFF, 0xFB, bitrate_index << 4, 0x40]) + bytes(32) + tag
+    return frame + bytes(length - len(frame))
+
+
+def mp3(bitrate_indexes, first_tag=b'', id3=b''):
+    frames = [mp3_frame(index, first_tag if i == 0 else b'') for i, index in enumerate(bitrate_indexes)]
+    if id3:
+        size = len(id3)
+        syncsafe = bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+        id3 = b'ID3\x03\x00\x00' + syncsafe + id3
+    return id3 + b''.join(frames)
+
+
+VBR = [9, 11, 10, 9, 13, 9] * 4
+CBR = [9] * 24
+
+
+class RemuxKindTests(TestCase):
+    def kind(self, content, suffix='.mp3'):
+        with tempfile.NamedTemporaryFile(suffix=suffix) as f:
+            f.write(content)
+            f.flush()
+            return remux.remux_kind(f.name)
+
+    def test_mp4(self):
+        self.assertEqual(self.kind(mp4(faststart=False)), remux.MP4)
+        self.assertIsNone(self.kind(mp4(faststart=True)))
+
+    def test_mp3(self):
+        self.assertEqual(self.kind(mp3(VBR)), remux.MP3)
+        self.assertEqual(self.kind(mp3(VBR, id3=b'TIT2' + bytes(300))), remux.MP3)
+        self.assertIsNone(self.kind(mp3(VBR, first_tag=b'Xing')))
+        self.assertIsNone(self.kind(mp3(CBR)))
+
+    def test_other_files_are_left_alone(self):
+        self.assertIsNone(self.kind(b'RIFF' + bytes(100)))
+        self.assertIsNone(self.kind(b''))
+
+    def test_only_mp3_files_are_scanned_for_frames(self):
+        self.assertEqual(self.kind(mp3(VBR), suffix='.MP3'), remux.MP3)
+        for suffix in ('.wav', '.flac', ''):
+            self.assertIsNone(self.kind(mp3(VBR), suffix=suffix), suffix)
+        self.assertEqual(self.kind(mp4(faststart=False), suffix='.m4a'), remux.MP4)
+
+
+class RemuxWorkerTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='owner', password='pw')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def make_track(self, content, name='episode.m4a'):
+        return Track.objects.create(
+            name='Episode', owner=self.user, type='podcast',
+            file=ContentFile(content, name=name), file_size=len(content),
+        )
+
+    def run_worker(self, fake_ffmpeg=None):
+        def faststart(*args):
+            with open(args[-1], 'wb') as f:
+                f.write(mp4(faststart=True) + b'moved')
+
+        with mock.patch('player.remux.run_ffmpeg', side_effect=fake_ffmpeg or faststart) as ffmpeg, \
+                mock.patch('player.management.commands.run_media_worker.make_rendition', fake_make_rendition), \
+                self.captureOnCommitCallbacks(execute=True):
+            call_command('run_media_worker', '--once', stdout=io.StringIO())
+        return ffmpeg
+
+    def test_remuxed_file_replaces_the_original(self):
+        track = self.make_track(mp4(faststart=False))
+        old_path = track.file.path
+        used = UserProfile.objects.get(user=self.user).storage_used_bytes
+
+        ffmpeg = self.run_worker()
+        self.assertIn('+faststart', ffmpeg.call_args.args)
+        track.refresh_from_db()
+        self.assertNotEqual(track.file.path, old_path)
+        with open(track.file.path, 'rb') as f:
+            self.assertEqual(f.read(), mp4(faststart=True) + b'moved')
+        self.assertEqual(track.file_size, len(mp4(faststart=True) + b'moved'))
+        self.assertEqual(track.remux_checked_file, track.file.name)
+        self.assertEqual(UserProfile.objects.get(user=self.user).storage_used_bytes, used + 5)
+        # Renditions were made from the remuxed file.
+        self.assertEqual(
+            set(TrackRendition.objects.filter(track=track).values_list('source_name', 'status')),
+            {(track.file.name, 'ready')},
+        )
+
+    def test_replaced_file_is_kept_for_a_while(self):
+        track = self.make_track(mp4(faststart=False))
+        old_path = track.file.path
+        self.run_worker()
+        self.assertTrue(os.path.exists(old_path))
+        self.assertEqual(remux.delete_retired_files(), 0)
+
+        RetiredFile.objects.update(retired_at=timezone.now() - remux.RETIRED_FILE_GRACE)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(remux.delete_retired_files(), 1)
+        self.assertFalse(os.path.exists(old_path))
+        self.assertFalse(RetiredFile.objects.exists())
+
+    def test_tracks_sharing_a_file_are_switched_together(self):
+        track = self.make_track(mp4(faststart=False))
+        copy = Track.objects.create(
+            name='Copy', owner=self.user, type='podcast', file=track.file.name, file_size=track.file_size,
+        )
+        ffmpeg = self.run_worker()
+        self.assertEqual(ffmpeg.call_count, 1)
+        track.refresh_from_db()
+        copy.refresh_from_db()
+        self.assertEqual(copy.file.name, track.file.name)
+        self.assertEqual(copy.remux_checked_file, track.file.name)
+
+    def test_seekable_files_are_only_checked(self):
+        track = self.make_track(mp3(CBR), name='song.mp3')
+        name = track.file.name
+        ffmpeg = self.run_worker()
+        ffmpeg.assert_not_called()
+        track.refresh_from_db()
+        self.assertEqual(track.file.name, name)
+        self.assertEqual(track.remux_checked_file, name)
+        self.assertEqual(remux.claim_tracks(5), [])
+
+    def test_edited_file_is_checked_again(self):
+        track = self.make_track(mp3(CBR), name='song.mp3')
+        self.run_worker()
+        track.refresh_from_db()
+        track.file = ContentFile(mp3(VBR), name='vbr.mp3')
+        track.save()
+        self.assertEqual([t.pk for t in remux.claim_tracks(5)], [track.pk])
+
+    def test_renditions_wait_for_the_check(self):
+        track = self.make_track(mp4(faststart=False))
+        self.assertFalse(renditions_due().filter(track=track).exists())
+        Track.objects.filter(pk=track.pk).update(remux_checked_file=track.file.name)
+        self.assertTrue(renditions_due().filter(track=track).exists())
+
+    def test_failures_back_off_then_quarantine(self):
+        track = self.make_track(mp4(faststart=False))
+        for attempt in range(1, remux.MAX_ATTEMPTS + 1):
+            Track.objects.filter(pk=track.pk).update(remux_retry_at=None)
+            claimed, = remux.claim_tracks(5)
+            remux.record_results([(claimed, None, 'ffmpeg exited with 1')])
+            claimed.refresh_from_db()
+            self.assertEqual(claimed.remux_attempts, attempt)
+        self.assertIsNone(claimed.remux_retry_at)
+        self.assertEqual(remux.claim_tracks(5), [])
+        # The original is played as it is, and renditions go ahead.
+        self.assertTrue(renditions_due().filter(track=track).exists())
+
+    def test_backoff_delays_retry(self):
+        track = self.make_track(mp4(faststart=False))
+        self.run_worker(fake_ffmpeg=RuntimeError('ffmpeg exited with 1'))
+        track.refresh_from_db()
+        self.assertEqual(track.remux_attempts, 1)
+        self.assertEqual(remux.claim_tracks(5), [])
+        Track.objects.filter(pk=track.pk).update(remux_retry_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(remux.claim_tracks(5)), 1)
+
+    def test_output_that_is_still_not_seekable_fails(self):
+        track = self.make_track(mp4(faststart=False))
+
+        def no_faststart(*args):
+            with open(args[-1], 'wb') as f:
+                f.write(mp4(faststart=False))
+
+        claimed, = remux.claim_tracks(5)
+        with mock.patch('player.remux.run_ffmpeg', side_effect=no_faststart), self.assertRaises(RuntimeError):
+            remux.remux_track(claimed)
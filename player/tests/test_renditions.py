@@ -0,0 +1,214 @@
+import io
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from player.models import Playlist, PlaylistItem, Track, TrackRendition
+from player.renditions import MAX_ATTEMPTS, PROFILES, audio_name, claim_renditions, make_rendition, record_results
+
+LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'rendition-tests'}}
+
+
+def fake_make_rendition(rendition):
+    """Write what ffmpeg would: the progressive file, a media playlist, an init segment and one segment."""
+    directory = default_storage.path(rendition.directory)
+    os.makedirs(directory, exist_ok=True)
+    files = {
+        audio_name(rendition): b'a' * PROFILES[rendition.profile].bitrate,
+        'index.m3u8': b'#EXTM3U\n#EXT-X-MAP:URI="init.mp4"\n#EXTINF:6.0,\nseg00000.m4s\n#EXT-X-ENDLIST\n',
+        'init.mp4': b'init',
+        'seg00000.m4s': b'segment',
+    }
+    for name, content in files.items():
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(content)
+    return len(files[audio_name(rendition)])
+
+
+@override_settings(CACHES=LOCMEM)
+class RenditionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.owner = User.objects.create_user(username='owner', password='pw')
+        self.stranger = User.objects.create_user(username='stranger', password='pw')
+        self.track = Track.objects.create(
+            name='Episode', owner=self.owner, type='podcast',
+            file=ContentFile(b'original audio', name='episode.mp3'), file_size=14,
+        )
+        # Checked for remuxing already (see test_remux).
+        Track.objects.filter(pk=self.track.pk).update(remux_checked_file=self.track.file.name)
+        self.client.force_login(self.owner)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def run_worker(self):
+        with mock.patch('player.management.commands.run_media_worker.make_rendition', fake_make_rendition), \
+                self.captureOnCommitCallbacks(execute=True):
+            call_command('run_media_worker', '--once', stdout=io.StringIO())
+
+    def test_queued_for_every_profile_when_created(self):
+        renditions = TrackRendition.objects.filter(track=self.track)
+        self.assertEqual(set(renditions.values_list('profile', flat=True)), set(PROFILES))
+        self.assertEqual({r.source_name for r in renditions}, {self.track.file.name})
+        self.assertTrue(all(r.status == 'pending' for r in renditions))
+
+    def test_new_file_replaces_renditions(self):
+        self.run_worker()
+        old = TrackRendition.objects.filter(track=self.track).first()
+        old_directory = default_storage.path(old.directory)
+        self.assertTrue(os.path.isdir(old_directory))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.track.file = ContentFile(b'new audio', name='episode2.mp3')
+            self.track.save()
+        renditions = TrackRendition.objects.filter(track=self.track)
+        self.assertEqual(renditions.count(), len(PROFILES))
+        self.assertEqual({r.status for r in renditions}, {'pending'})
+        self.assertEqual({r.source_name for r in renditions}, {self.track.file.name})
+        self.assertFalse(os.path.exists(old_directory))
+
+    def test_other_saves_keep_renditions(self):
+        self.run_worker()
+        self.track.name = 'Renamed'
+        self.track.save()
+        self.assertFalse(TrackRendition.objects.filter(track=self.track).exclude(status='ready').exists())
+
+    def test_worker_makes_every_rendition(self):
+        self.run_worker()
+        self.assertEqual(
+            set(TrackRendition.objects.filter(track=self.track).values_list('status', flat=True)), {'ready'}
+        )
+        self.assertEqual(claim_renditions(10), [])
+
+    def test_failures_back_off_then_quarantine(self):
+        TrackRendition.objects.exclude(profile='opus-32').delete()
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            TrackRendition.objects.update(retry_at=None)
+            claimed, = claim_renditions(5)
+            record_results([(claimed, 0, 'ffmpeg exited with 1')])
+            claimed.refresh_from_db()
+            self.assertEqual(claimed.attempts, attempt)
+        self.assertEqual(claimed.status, 'failed')
+        self.assertEqual(claim_renditions(5), [])
+
+    def test_backoff_delays_retry(self):
+        TrackRendition.objects.exclude(profile='opus-32').delete()
+        claimed, = claim_renditions(5)
+        record_results([(claimed, 0, 'ffmpeg exited with 1')])
+        self.assertEqual(claim_renditions(5), [])
+        TrackRendition.objects.update(retry_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(claim_renditions(5)), 1)
+
+    def test_rendition_made_for_a_replaced_file_is_discarded(self):
+        TrackRendition.objects.exclude(profile='opus-32').delete()
+        claimed, = claim_renditions(5)
+        size = fake_make_rendition(claimed)
+        TrackRendition.objects.filter(pk=claimed.pk).delete()
+        self.assertEqual(record_results([(claimed, size, None)]), ([], []))
+        self.assertFalse(os.path.exists(default_storage.path(claimed.directory)))
+
+    def test_ffmpeg_transcodes_then_segments(self):
+        rendition = TrackRendition.objects.get(track=self.track, profile='aac-64')
+
+        def fake_run(args, **kwargs):
+            with open(args[-1], 'wb') as f:
+                f.write(b'out')
+
+        with mock.patch('player.renditions.subprocess.run', side_effect=fake_run) as run:
+            self.assertEqual(make_rendition(rendition), 3)
+        transcode, segment = (call.args[0] for call in run.call_args_list)
+        self.assertIn('aac', transcode)
+        self.assertEqual(transcode[-1], default_storage.path(f'{rendition.directory}/audio.m4a'))
+        self.assertIn('hls', segment)
+        self.assertIn('copy', segment)
+
+    def test_api_advertises_renditions_lowest_bitrate_first(self):
+        playlist = Playlist.objects.create(name='Mix', owner=self.owner)
+        PlaylistItem.objects.create(playlist=playlist, track=self.track)
+        url = reverse('playlist_tracks_api', args=[playlist.pk])
+
+        track_data, = self.client.get(url).json()
+        self.assertEqual(track_data['renditions'], [])
+        self.assertIsNone(track_data['hls_url'])
+
+        self.run_worker()
+        track_data, = self.client.get(url).json()
+        bitrates = [r['bitrate'] for r in track_data['renditions']]
+        self.assertEqual(bitrates, sorted(bitrates))
+        self.assertEqual(track_data['renditions'][0]['profile'], 'opus-32')
+        self.assertEqual(track_data['hls_url'], reverse('track_hls', args=[self.track.pk]))
+        self.assertEqual(self.client.get(track_data['renditions'][0]['url']).status_code, 200)
+
+    def test_stream_links_to_hls_once_ready(self):
+        stream_url = reverse('stream_track', args=[self.track.pk])
+        self.assertNotIn('Link', self.client.get(stream_url))
+        self.run_worker()
+        self.assertIn(reverse('track_hls', args=[self.track.pk]), self.client.get(stream_url)['Link'])
+
+    def test_master_playlist_lists_variants(self):
+        hls_url = reverse('track_hls', args=[self.track.pk])
+        self.assertEqual(self.client.get(hls_url).status_code, 404)
+        self.run_worker()
+
+        response = self.client.get(hls_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.apple.mpegurl')
+        body = response.content.decode()
+        self.assertEqual(body.count('#EXT-X-STREAM-INF'), len(PROFILES))
+        variant = next(line for line in body.splitlines() if line.endswith('index.m3u8'))
+        segment_url = variant.rsplit('/', 1)[0] + '/seg00000.m4s'
+        self.assertEqual(b''.join(self.client.get(segment_url).streaming_content), b'segment')
+
+    def test_rendition_files_are_immutable(self):
+        self.run_worker()
+        rendition = TrackRendition.objects.get(track=self.track, profile='aac-128')
+        response = self.client.get(reverse('rendition_file', args=[self.track.pk, rendition.pk, 'audio.m4a']))
+        self.assertEqual(response['Content-Type'], 'audio/mp4')
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_only_rendition_files_are_served(self):
+        self.run_worker()
+        rendition = TrackRendition.objects.get(track=self.track, profile='opus-32')
+        with open(default_storage.path(f'{rendition.directory}/notes.txt'), 'w') as f:
+            f.write('not audio')
+        for name in ('notes.txt', 'audio.m4a', '..'):
+            url = reverse('rendition_file', args=[self.track.pk, rendition.pk, name])
+            self.assertEqual(self.client.get(url).status_code, 404, name)
+        other = Track.objects.create(name='Other', owner=self.owner, type='song')
+        url = reverse('rendition_file', args=[other.pk, rendition.pk, 'audio.opus'])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_stranger_cannot_reach_renditions(self):
+        self.run_worker()
+        rendition = TrackRendition.objects.get(track=self.track, profile='opus-32')
+        self.client.force_login(self.stranger)
+        for url in (
+            reverse('track_hls', args=[self.track.pk]),
+            reverse('rendition_file', args=[self.track.pk, rendition.pk, 'audio.opus']),
+        ):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_deleting_the_track_deletes_rendition_files(self):
+        self.run_worker()
+        directory = default_storage.path(f'renditions/{self.track.pk}')
+        self.assertTrue(os.listdir(directory))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.track.delete()
+        self.assertEqual(os.listdir(directory), [])
@@ -0,0 +1,188 @@
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from player.models import GB, Playlist, Track, UploadSession, UserProfile
+
+OCTET_STREAM = 'application/offset+octet-stream'
+
+
+class ResumableUploadTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='listener', password='pw')
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def profile(self):
+        return UserProfile.objects.get(user=self.user)
+
+    def create(self, filename='song.mp3', length=10):
+        encoded = base64.b64encode(filename.encode()).decode()
+        return self.client.post(
+            reverse('upload_create'), HTTP_UPLOAD_LENGTH=str(length), HTTP_UPLOAD_METADATA=f'filename {encoded}'
+        )
+
+    def patch(self, location, offset, data, checksum=None):
+        headers = {'HTTP_UPLOAD_OFFSET': str(offset)}
+        if checksum:
+            headers['HTTP_UPLOAD_CHECKSUM'] = checksum
+        return self.client.patch(location, data, content_type=OCTET_STREAM, **headers)
+
+    def upload(self, data, filename='song.mp3'):
+        location = self.create(filename, len(data))['Location']
+        self.assertEqual(self.patch(location, 0, data).status_code, 204)
+        return UploadSession.objects.get()
+
+    def test_chunks_resume_from_the_reported_offset(self):
+        response = self.create(length=10)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Tus-Resumable'], '1.0.0')
+        location = response['Location']
+        self.assertEqual(self.profile().storage_reserved_bytes, 10)
+
+        response = self.patch(location, 0, b'01234')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response['Upload-Offset'], '5')
+
+        response = self.client.head(location)
+        self.assertEqual(response['Upload-Offset'], '5')
+        self.assertEqual(response['Upload-Length'], '10')
+        self.assertEqual(response['Cache-Control'], 'no-store')
+
+        self.assertEqual(self.patch(location, 3, b'34567').status_code, 409)
+        self.assertEqual(self.patch(location, 5, b'56789').status_code, 204)
+
+        session = UploadSession.objects.get()
+        self.assertTrue(session.complete)
+        self.assertTrue(session.file_name.startswith('tracks/song'))
+        with open(os.path.join(self.media_root, session.file_name), 'rb') as f:
+            self.assertEqual(f.read(), b'0123456789')
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, session.part_name)))
+        self.assertEqual(self.client.get(location).json()['complete'], True)
+
+    def test_checksum_mismatch_discards_the_chunk(self):
+        location = self.create(length=4)['Location']
+        bad = 'sha256 ' + base64.b64encode(hashlib.sha256(b'nope').digest()).decode()
+        self.assertEqual(self.patch(location, 0, b'data', bad).status_code, 460)
+        self.assertEqual(self.client.head(location)['Upload-Offset'], '0')
+
+        good = 'sha256 ' + base64.b64encode(hashlib.sha256(b'data').digest()).decode()
+        self.assertEqual(self.patch(location, 0, b'data', good).status_code, 204)
+        self.assertTrue(UploadSession.objects.get().complete)
+
+    def test_rejects_other_content_types_and_overlong_chunks(self):
+        location = self.create(length=4)['Location']
+        response = self.client.patch(location, b'data', content_type='audio/mpeg', HTTP_UPLOAD_OFFSET='0')
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(self.patch(location, 0, b'too long').status_code, 400)
+
+    def test_reservation_counts_against_the_quota(self):
+        UserProfile.objects.filter(user=self.user).update(storage_limit_gb=15 / GB)
+        self.assertEqual(self.create(length=10).status_code, 201)
+        response = self.create(length=10)
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('storage limit', response.json()['message'])
+
+        response = self.client.delete(reverse('upload_detail', args=[UploadSession.objects.get().pk]))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.profile().storage_reserved_bytes, 0)
+        self.assertEqual(self.create(length=10).status_code, 201)
+
+    def test_other_users_uploads_are_hidden(self):
+        location = self.create(length=4)['Location']
+        other = User.objects.create_user(username='other', password='pw')
+        self.client.force_login(other)
+        self.assertEqual(self.patch(location, 0, b'data').status_code, 404)
+
+    def test_completion_reads_metadata_once(self):
+        metadata = {'duration': 12.5, 'title': 'Song', 'artist': 'Band'}
+        with mock.patch('player.uploads.read_audio_metadata', return_value=metadata) as read:
+            session = self.upload(b'audio')
+        read.assert_called_once()
+        self.assertEqual(session.metadata, metadata)
+
+    def test_upload_track_uses_the_finished_upload(self):
+        with mock.patch('player.uploads.read_audio_metadata', return_value={'duration': 42}):
+            session = self.upload(b'x' * 100)
+        with mock.patch('player.views.MutagenFile') as mutagen:
+            response = self.client.post(reverse('upload_track'), {
+                'name': 'Song', 'type': 'song', 'upload_id': str(session.pk),
+            }, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        mutagen.assert_not_called()
+
+        track = Track.objects.get()
+        self.assertEqual(track.file.name, session.file_name)
+        self.assertEqual((track.file_size, track.duration), (100, 42))
+        self.assertFalse(UploadSession.objects.exists())
+        profile = self.profile()
+        self.assertEqual((profile.storage_used_bytes, profile.storage_reserved_bytes), (100, 0))
+
+        response = self.client.post(reverse('upload_track'), {
+            'name': 'Again', 'type': 'song', 'upload_id': str(session.pk),
+        }, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 400)
+
+    def test_upload_playlist_uses_finished_uploads(self):
+        self.upload(b'a' * 10, 'one.mp3')
+        location = self.create('two.mp3', 20)['Location']
+        self.assertEqual(self.patch(location, 0, b'b' * 20).status_code, 204)
+        ids = [str(pk) for pk in UploadSession.objects.order_by('created_at').values_list('pk', flat=True)]
+
+        response = self.client.post(reverse('upload_playlist'), {
+            'name': 'Mix', 'default_track_type': 'song', 'upload_ids': ids,
+        }, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        playlist = Playlist.objects.get()
+        self.assertEqual(
+            list(playlist.playlistitem_set.order_by('order').values_list('track__name', flat=True)), ['one', 'two']
+        )
+        profile = self.profile()
+        self.assertEqual((profile.storage_used_bytes, profile.storage_reserved_bytes), (30, 0))
+
+    def test_stale_uploads_are_purged(self):
+        location = self.create(length=10)['Location']
+        self.patch(location, 0, b'01234')
+        session = UploadSession.objects.get()
+        UploadSession.objects.filter(pk=session.pk).update(updated_at=timezone.now() - timedelta(days=2))
+
+        out = StringIO()
+        call_command('purge_stale_uploads', stdout=out)
+        self.assertIn('Purged 1', out.getvalue())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, session.part_name)))
+        self.assertEqual(self.profile().storage_reserved_bytes, 0)
+
+    def test_media_worker_purges_stale_uploads(self):
+        location = self.create(length=10)['Location']
+        self.patch(location, 0, b'01234')
+        UploadSession.objects.update(updated_at=timezone.now() - timedelta(days=2))
+
+        out = StringIO()
+        call_command('run_media_worker', '--once', stdout=out)
+        self.assertIn('Purged 1', out.getvalue())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(self.profile().storage_reserved_bytes, 0)
+
+    def test_reconcile_repairs_reserved_bytes(self):
+        self.create(length=10)
+        UserProfile.objects.filter(user=self.user).update(storage_reserved_bytes=99)
+        call_command('reconcile_storage_usage', stdout=StringIO())
+        self.assertEqual(self.profile().storage_reserved_bytes, 10)
@@ -1,6 +1,7 @@
 from django.test import TestCase
+from django.urls import reverse
 from django.contrib.auth.models import User
-from player.models import Track, UserTrackLastPlayed
+from player.models import Playlist, PlaylistItem, Track, UserTrackLastPlayed
 from django.utils import timezone
 from datetime import timedelta
 
@@ -34,3 +35,51 @@ class SortingTest(TestCase):
         self.assertEqual(tracks[0].name, 'Track 2')
         self.assertEqual(tracks[1].name, 'Track 1')
         self.assertEqual(tracks[2].name, 'Track 3')
+
+
+class LastPlayedPagingTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.other = User.objects.create_user(username='other', password='password')
+        self.client.force_login(self.user)
+        now = timezone.now()
+        self.played = []
+        for n in range(14):
+            track = Track.objects.create(name=f'Track {n:02}', owner=self.user, type='song')
+            if n % 2 == 0:
+                UserTrackLastPlayed.objects.create(user=self.user, track=track, last_played=now - timedelta(hours=n))
+                self.played.append(track)
+            else:
+                # Someone else's plays never count towards this user's order.
+                UserTrackLastPlayed.objects.create(user=self.other, track=track, last_played=now)
+        self.unplayed = [t for t in Track.objects.order_by('id') if t not in self.played]
+
+    def test_pages_run_from_played_into_unplayed(self):
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        first = self.client.get('/', {'sort': 'last_played'})
+        self.assertEqual(list(first.context['tracks'].object_list), (self.played + self.unplayed)[:10])
+
+        cursor = first.context['tracks'].next_cursor
+        second = self.client.get('/', {'sort': 'last_played', 'cursor': cursor}, **ajax).json()
+        for track in self.unplayed[3:]:
+            self.assertIn(track.name, second['track_html'])
+        self.assertIsNone(second['next_cursor'])
+
+        back = self.client.get('/', {'sort': 'last_played', 'cursor': second['prev_cursor']})
+        self.assertEqual(list(back.context['tracks'].object_list), (self.played + self.unplayed)[:10])
+
+    def test_recently_played_api_pages_by_last_play(self):
+        shared = Track.objects.create(name='Shared', owner=self.other, type='podcast')
+        playlist = Playlist.objects.create(name='Shared', owner=self.other)
+        PlaylistItem.objects.create(playlist=playlist, track=shared, order=0)
+        playlist.accessors.add(self.user)
+        UserTrackLastPlayed.objects.create(user=self.user, track=shared, last_played=timezone.now() + timedelta(hours=1))
+        hidden = Track.objects.create(name='Hidden', owner=self.other, type='song')
+        UserTrackLastPlayed.objects.create(user=self.user, track=hidden, last_played=timezone.now())
+
+        url = reverse('recently_played_api')
+        first = self.client.get(url, {'limit': 5}).json()
+        self.assertEqual([t['name'] for t in first['tracks']], ['Shared'] + [t.name for t in self.played[:4]])
+        rest = self.client.get(url, {'limit': 5, 'cursor': first['next_cursor']}).json()
+        self.assertEqual([t['name'] for t in rest['tracks']], [t.name for t in self.played[4:]])
+        self.assertIsNone(rest['next_cursor'])
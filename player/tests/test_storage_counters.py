@@ -0,0 +1,113 @@
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from player.models import GB, StorageTotals, Track, UserProfile
+
+
+class StorageCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='listener', password='pw')
+        self.other = User.objects.create_user(username='other', password='pw')
+
+    def used(self, user):
+        return UserProfile.objects.get(user=user).storage_used_bytes
+
+    def test_track_writes_move_the_owner_counter(self):
+        track = Track.objects.create(name='A', owner=self.user, type='song', file_size=1000)
+        Track.objects.create(name='B', owner=self.user, type='song', file_size=500)
+        self.assertEqual(self.used(self.user), 1500)
+
+        track = Track.objects.get(pk=track.pk)
+        track.file_size = 700
+        track.save()
+        self.assertEqual(self.used(self.user), 1200)
+
+        track.owner = self.other
+        track.save()
+        self.assertEqual(self.used(self.user), 500)
+        self.assertEqual(self.used(self.other), 700)
+
+        track.name = 'Renamed'
+        track.save(update_fields=['name'])
+        self.assertEqual(self.used(self.other), 700)
+
+        Track.objects.filter(owner=self.user).delete()
+        Track.objects.get(pk=track.pk).delete()
+        self.assertEqual(self.used(self.user), 0)
+        self.assertEqual(self.used(self.other), 0)
+
+    def test_saving_a_stale_profile_keeps_the_counter(self):
+        profile = UserProfile.objects.get(user=self.user)
+        Track.objects.create(name='A', owner=self.user, type='song', file_size=1000)
+        profile.storage_limit_gb = 2
+        profile.save()
+        self.assertEqual(self.used(self.user), 1000)
+
+    def test_allocated_total_follows_profiles(self):
+        start = StorageTotals.load().allocated_limit_gb
+        profile = UserProfile.objects.get(user=self.user)
+        profile.storage_limit_gb += 3
+        profile.save()
+        self.assertAlmostEqual(StorageTotals.load().allocated_limit_gb, start + 3)
+
+        self.other.delete()
+        self.assertAlmostEqual(
+            StorageTotals.load().allocated_limit_gb, start + 3 - settings.DEFAULT_USER_STORAGE_LIMIT_GB
+        )
+
+    def test_reconcile_reports_and_repairs_drift(self):
+        Track.objects.create(name='A', owner=self.user, type='song', file_size=1000)
+        UserProfile.objects.filter(user=self.user).update(storage_used_bytes=42)
+        StorageTotals.objects.update(allocated_limit_gb=0)
+
+        out = StringIO()
+        call_command('reconcile_storage_usage', '--dry-run', stdout=out)
+        self.assertIn('listener', out.getvalue())
+        self.assertEqual(self.used(self.user), 42)
+
+        call_command('reconcile_storage_usage', stdout=StringIO())
+        self.assertEqual(self.used(self.user), 1000)
+        self.assertAlmostEqual(StorageTotals.load().allocated_limit_gb, 2 * settings.DEFAULT_USER_STORAGE_LIMIT_GB)
+
+        out = StringIO()
+        call_command('reconcile_storage_usage', stdout=out)
+        self.assertIn('accurate', out.getvalue())
+
+
+class UploadQuotaTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='listener', password='pw')
+        self.client.force_login(self.user)
+        UserProfile.objects.filter(user=self.user).update(storage_limit_gb=1500 / GB)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def upload(self, name, size):
+        return self.client.post(reverse('upload_track'), {
+            'name': name, 'type': 'song', 'file': SimpleUploadedFile(f'{name}.mp3', b'x' * size),
+        }, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+    def test_upload_is_checked_against_the_counter(self):
+        self.assertEqual(self.upload('first', 1000).status_code, 200)
+        self.assertEqual(UserProfile.objects.get(user=self.user).storage_used_bytes, 1000)
+
+        response = self.upload('second', 1000)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('storage limit', str(response.json()['errors']))
+        self.assertEqual(Track.objects.filter(owner=self.user).count(), 1)
+
+        self.assertEqual(self.upload('third', 500).status_code, 200)
+        self.assertEqual(UserProfile.objects.get(user=self.user).storage_used_bytes, 1500)
@@ -0,0 +1,227 @@
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from player.media_cache import track_media
+from player.models import Track
+
+
+class StreamTrackTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.user = User.objects.create_user(username='listener', password='pw')
+        self.content = bytes(range(256)) * 40
+        self.track = Track.objects.create(
+            name='Episode', owner=self.user, type='podcast',
+            file=ContentFile(self.content, name='episode.mp3'),
+            file_size=len(self.content),
+        )
+        self.url = reverse('stream_track', args=[self.track.id])
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_full_response(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Type'], 'audio/mpeg')
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_range_response_stops_at_range_end(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-299')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Length'], '200')
+        self.assertEqual(response['Content-Range'], f'bytes 100-299/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:300])
+
+    def test_open_ended_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10000-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[10000:])
+
+    def test_file_is_exposed_for_sendfile(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=4096-')
+        self.assertEqual(response.file_to_stream.fileno(), response.file_to_stream.filelike.fileno())
+        response.close()
+
+    @override_settings(MEDIA_STREAM_BACKEND='x-accel')
+    def test_x_accel_redirect_offload(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.track.file.name)
+        self.assertEqual(response['Content-Type'], 'audio/mpeg')
+        self.assertEqual(response.content, b'')
+
+    @override_settings(MEDIA_STREAM_BACKEND='x-sendfile')
+    def test_x_sendfile_offload(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], self.track.file.path)
+
+    def test_suffix_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-500')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes {len(self.content) - 500}-{len(self.content) - 1}/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-500:])
+
+    def test_multiple_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9, 20-29, 25-39, -5')
+        self.assertEqual(response.status_code, 206)
+        content_type, boundary = response['Content-Type'].split('; boundary=')
+        self.assertEqual(content_type, 'multipart/byteranges')
+        body = b''.join(response.streaming_content)
+        self.assertEqual(response['Content-Length'], str(len(body)))
+        size = len(self.content)
+        expected = b''.join(
+            f'--{boundary}\r\nContent-Type: audio/mpeg\r\nContent-Range: bytes {a}-{b}/{size}\r\n\r\n'.encode()
+            + self.content[a:b + 1] + b'\r\n'
+            for a, b in [(0, 9), (20, 39), (size - 5, size - 1)]
+        ) + f'--{boundary}--\r\n'.encode()
+        self.assertEqual(body, expected)
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_malformed_range_sends_whole_file(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=300-100')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        response.close()
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"something-else"')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+    def test_if_range(self):
+        etag = self.client.get(self.url, HTTP_RANGE='bytes=0-0')['ETag']
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        response.close()
+        # The client's copy is stale, so it gets the whole current file.
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_versioned_url_is_immutable(self):
+        response = self.client.get(self.track.get_stream_url())
+        self.assertIn('immutable', response['Cache-Control'])
+        response.close()
+        response = self.client.get(self.url)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        response.close()
+        response = self.client.get(self.url + '?v=0000')
+        self.assertNotIn('immutable', response['Cache-Control'])
+        response.close()
+
+    def test_download_has_validators(self):
+        response = self.client.get(reverse('download_track', args=[self.track.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment; filename="episode', response['Content-Disposition'])
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        response = self.client.get(reverse('download_track', args=[self.track.id]), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    async def test_asgi_reads_asynchronously(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url, headers={'range': 'bytes=100-299'})
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response.is_async)
+        self.assertFalse(hasattr(response, 'file_to_stream'))
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.content[100:300])
+
+    async def test_asgi_opens_the_file_off_the_event_loop(self):
+        await self.async_client.aforce_login(self.user)
+        opened_in = []
+
+        def recording_open(*args, **kwargs):
+            opened_in.append(threading.get_ident())
+            return open(*args, **kwargs)
+
+        with mock.patch('player.streaming.open', recording_open, create=True):
+            response = await self.async_client.get(self.url)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.content)
+        self.assertTrue(opened_in)
+        self.assertNotIn(threading.get_ident(), opened_in)
+
+    def test_stranger_cannot_stream(self):
+        User.objects.create_user(username='stranger', password='pw')
+        self.client.login(username='stranger', password='pw')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+
+
+LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'stream-tests'}}
+
+
+@override_settings(CACHES=LOCMEM)
+class CachedTrackMediaTests(StreamTrackTests):
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            super().setUp()
+
+    def test_range_request_runs_no_query_or_stat(self):
+        self.client.get(self.url).close()
+        with CaptureQueriesContext(connection) as queries, mock.patch('player.streaming.os.stat') as stat:
+            response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+        self.assertFalse(any('player_' in q['sql'] for q in queries))
+        stat.assert_not_called()
+
+    def test_described_when_saved(self):
+        with mock.patch('player.streaming.os.stat') as stat:
+            response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+        stat.assert_not_called()
+        self.assertEqual(b''.join(response.streaming_content), self.content[:10])
+
+    def test_new_file_is_served_after_edit(self):
+        self.client.get(self.url).close()
+        new_content = b'a different recording'
+        self.track.file = ContentFile(new_content, name='episode.mp3')
+        self.track.file_size = len(new_content)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.track.save()
+        response = self.client.get(self.url)
+        self.assertEqual(b''.join(response.streaming_content), new_content)
+
+    def test_description_of_a_deleted_file_is_rebuilt(self):
+        self.client.get(self.url).close()
+        # Switched to a new file (as by a remux) without refreshing the cache.
+        storage = Track._meta.get_field('file').storage
+        new_name = storage.save('tracks/remuxed.mp3', ContentFile(b'remuxed audio'))
+        Track.objects.filter(pk=self.track.pk).update(file=new_name, file_size=13)
+        os.remove(self.track.file.path)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'remuxed audio')
+
+    def test_deleted_track_is_forgotten(self):
+        track_id = self.track.pk
+        self.client.get(self.url).close()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.track.delete()
+        self.assertIsNone(track_media(track_id))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
@@ -0,0 +1,108 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from player.access import access_grants, can_access_playlist, can_access_track
+from player.models import Playlist, PlaylistItem, Track
+from player.playback import apply_playback_samples
+
+LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'access-tests'}}
+
+
+class AccessGrantTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='pw')
+        self.accessor = User.objects.create_user(username='accessor', password='pw')
+        self.shared = Track.objects.create(name='Shared', owner=self.owner, type='song')
+        self.private = Track.objects.create(name='Private', owner=self.owner, type='song')
+        self.playlist = Playlist.objects.create(name='Mix', owner=self.owner)
+        PlaylistItem.objects.create(playlist=self.playlist, track=self.shared)
+        self.playlist.accessors.add(self.accessor)
+
+    def test_matches_the_join(self):
+        for user in (self.owner, self.accessor):
+            self.assertEqual(
+                access_grants(user).track_ids,
+                set(Track.objects.accessible_by(user).values_list('id', flat=True)),
+            )
+            self.assertEqual(
+                access_grants(user).playlist_ids,
+                set(Playlist.objects.accessible_by(user).values_list('id', flat=True)),
+            )
+
+    def test_built_in_one_query(self):
+        with self.assertNumQueries(1):
+            access_grants(self.accessor)
+
+
+@override_settings(CACHES=LOCMEM)
+class CachedAccessTests(AccessGrantTests):
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+        self.stranger = User.objects.create_user(username='stranger', password='pw')
+
+    def change(self, write, *args, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            write(*args, **kwargs)
+
+    def test_checks_after_the_first_hit_no_queries(self):
+        access_grants(self.accessor)
+        with self.assertNumQueries(0):
+            self.assertTrue(can_access_track(self.accessor, self.shared.pk))
+            self.assertFalse(can_access_track(self.accessor, self.private.pk))
+            self.assertTrue(can_access_playlist(self.accessor, self.playlist.pk))
+
+    def test_stream_checks_access_without_the_join(self):
+        self.client.force_login(self.accessor)
+        url = reverse('stream_track', args=[self.private.pk])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(any('player_playlist_accessors' in q['sql'] for q in queries))
+
+    def test_accessor_changes(self):
+        self.assertFalse(can_access_track(self.stranger, self.shared.pk))
+        self.change(self.playlist.accessors.add, self.stranger)
+        self.assertTrue(can_access_track(self.stranger, self.shared.pk))
+        self.assertTrue(can_access_playlist(self.stranger, self.playlist.pk))
+
+        self.change(self.stranger.accessible_playlists.remove, self.playlist)
+        self.assertFalse(can_access_track(self.stranger, self.shared.pk))
+
+        self.change(self.playlist.accessors.clear)
+        self.assertFalse(can_access_playlist(self.accessor, self.playlist.pk))
+
+    def test_playlist_item_changes(self):
+        self.assertFalse(can_access_track(self.accessor, self.private.pk))
+        self.change(PlaylistItem.objects.create, playlist=self.playlist, track=self.private)
+        self.assertTrue(can_access_track(self.accessor, self.private.pk))
+
+        self.change(PlaylistItem.objects.filter(track=self.private).delete)
+        self.assertFalse(can_access_track(self.accessor, self.private.pk))
+
+        self.change(self.playlist.tracks.add, self.private)
+        self.assertTrue(can_access_track(self.accessor, self.private.pk))
+
+    def test_new_and_deleted_tracks_and_playlists(self):
+        access_grants(self.owner)
+        with self.captureOnCommitCallbacks(execute=True):
+            track = Track.objects.create(name='New', owner=self.owner, type='song')
+        self.assertTrue(can_access_track(self.owner, track.pk))
+
+        playlist_id = self.playlist.pk
+        self.change(self.playlist.delete)
+        self.assertFalse(can_access_playlist(self.owner, playlist_id))
+        self.assertFalse(can_access_playlist(self.accessor, playlist_id))
+        self.assertFalse(can_access_track(self.accessor, self.shared.pk))
+
+    def test_playback_rejects_tracks_outside_the_grants(self):
+        result = apply_playback_samples(self.accessor, [
+            {'track_id': self.shared.pk, 'position': 5},
+            {'track_id': self.private.pk, 'position': 5},
+        ])
+        self.assertEqual(result.rejected, [1])
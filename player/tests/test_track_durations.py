@@ -0,0 +1,104 @@
+import io
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from player import durations
+from player.durations import MAX_ATTEMPTS, claim_tracks, record_results
+from player.header_cache import PLAYBACK, cached_header
+from player.media_cache import track_media
+from player.models import Track, UserPlaybackState
+
+LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'duration-tests'}}
+
+
+class DurationBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+
+    def make_track(self, name, **fields):
+        fields.setdefault('file_size', 1000)
+        return Track.objects.create(name=name, owner=self.user, type='podcast', file=f'tracks/{name}.mp3', **fields)
+
+    def test_claims_a_batch_once(self):
+        tracks = [self.make_track(f't{i}') for i in range(3)]
+        self.make_track('done', duration=12)
+        self.make_track('empty', file_size=0)
+
+        claimed = claim_tracks(2)
+        self.assertEqual([t.pk for t in claimed], [tracks[0].pk, tracks[1].pk])
+        self.assertEqual([t.pk for t in claim_tracks(10)], [tracks[2].pk])
+        self.assertEqual(claim_tracks(10), [])
+
+    def test_failures_back_off_then_quarantine(self):
+        track = self.make_track('broken')
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            Track.objects.filter(pk=track.pk).update(duration_retry_at=None)
+            claimed, = claim_tracks(5)
+            record_results([(claimed, 0)])
+            claimed.refresh_from_db()
+            self.assertEqual(claimed.duration_attempts, attempt)
+        self.assertIsNone(claimed.duration_retry_at)
+        self.assertEqual(claim_tracks(5), [])
+
+    def test_backoff_delays_retry(self):
+        track = self.make_track('flaky')
+        claimed, = claim_tracks(5)
+        record_results([(claimed, 0)])
+        self.assertEqual(claim_tracks(5), [])
+        Track.objects.filter(pk=track.pk).update(duration_retry_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(claim_tracks(5)), 1)
+
+    def test_command_probes_every_track_in_batches(self):
+        good = self.make_track('good')
+        bad = self.make_track('bad')
+
+        def fake_probe(path):
+            return (42.0, []) if path.endswith('good.mp3') else (0, ['unreadable'])
+
+        with mock.patch('player.management.commands.fix_track_durations.probe_duration', side_effect=fake_probe):
+            call_command('fix_track_durations', '--once', '--batch-size', '1', stdout=io.StringIO())
+        good.refresh_from_db()
+        bad.refresh_from_db()
+        self.assertEqual(good.duration, 42.0)
+        self.assertEqual(bad.duration_attempts, 1)
+        self.assertIsNotNone(bad.duration_retry_at)
+
+
+@override_settings(CACHES=LOCMEM)
+class DurationCacheTests(DurationBatchTests):
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+
+    def test_found_durations_reach_cached_headers(self):
+        track = self.make_track('episode')
+        UserPlaybackState.objects.create(user=self.user, track=track)
+        build = lambda: Track.objects.get(pk=track.pk).duration
+        self.assertEqual(cached_header(PLAYBACK, self.user.pk, build), 0)
+
+        claimed, = claim_tracks(5)
+        with mock.patch('player.media_cache.describe_track', return_value='described') as describe, \
+                self.captureOnCommitCallbacks(execute=True):
+            record_results([(claimed, 42.0)])
+        self.assertEqual(cached_header(PLAYBACK, self.user.pk, build), 42.0)
+        describe.assert_called_once_with(claimed)
+        self.assertEqual(track_media(track.pk), 'described')
+
+
+class ProbeDurationTests(TestCase):
+    def test_falls_through_probes_until_one_succeeds(self):
+        probes = (
+            ('first', mock.Mock(side_effect=ValueError('bad header'))),
+            ('second', mock.Mock(return_value=0)),
+            ('third', mock.Mock(return_value=61.5)),
+        )
+        with mock.patch.object(durations, 'PROBES', probes), mock.patch('os.path.exists', return_value=True):
+            duration, errors = durations.probe_duration('/audio.mp3')
+        self.assertEqual(duration, 61.5)
+        self.assertEqual(errors, ['first failed: bad header'])
@@ -0,0 +1,142 @@
+import io
+import math
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from player.management import transcribe_slim
+from player.management.transcribe_slim import (
+    CHUNK_LENGTH, CHUNK_OVERLAP, PcmBuffer, SAMPLE_RATE, np, plan_chunks, stitch_segments, transcribe_file,
+)
+
+
+def seg(start, end, text):
+    return {"start": start, "end": end, "text": text}
+
+
+class PlanChunksTests(SimpleTestCase):
+    def test_short_file_is_one_whole_chunk(self):
+        chunks = plan_chunks(CHUNK_LENGTH + 30)
+        self.assertEqual(len(chunks), 1)
+        self.assertIsNone(chunks[0].length)
+
+    def test_long_file_chunks_overlap_and_own_disjoint_intervals(self):
+        chunks = plan_chunks(3 * CHUNK_LENGTH + 500)
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(chunks[0].start, 0)
+        self.assertEqual(chunks[1].start, CHUNK_LENGTH - CHUNK_OVERLAP)
+        self.assertEqual(chunks[1].length, CHUNK_LENGTH + 2 * CHUNK_OVERLAP)
+        for previous, current in zip(chunks, chunks[1:]):
+            self.assertEqual(previous.owned_end, current.owned_start)
+        self.assertEqual(chunks[-1].owned_end, math.inf)
+
+
+class StitchSegmentsTests(SimpleTestCase):
+    def setUp(self):
+        self.chunks = plan_chunks(2 * CHUNK_LENGTH + 500)
+
+    def test_boundary_segment_heard_by_both_chunks_is_kept_once(self):
+        boundary = CHUNK_LENGTH
+        first = [seg(boundary - 10, boundary - 4, "before"), seg(boundary - 3, boundary + 1, "across")]
+        second = [seg(boundary - 3, boundary + 1, "across"), seg(boundary + 2, boundary + 6, "after")]
+        stitched = stitch_segments(self.chunks, [first, second, []])
+        self.assertEqual([s["text"] for s in stitched], ["before", "across", "after"])
+
+    def test_differently_split_boundary_is_trimmed_not_overlapping(self):
+        boundary = CHUNK_LENGTH
+        first = [seg(boundary - 4, boundary + 1, "hello there")]
+        second = [seg(boundary - 1, boundary + 4, "there friend")]
+        stitched = stitch_segments(self.chunks, [first, second, []])
+        self.assertEqual(len(stitched), 2)
+        self.assertLessEqual(stitched[0]["end"], stitched[1]["start"])
+
+    def test_segments_from_every_chunk_are_merged_in_time_order(self):
+        parts = [[seg(10, 12, "a")], [seg(CHUNK_LENGTH + 10, CHUNK_LENGTH + 12, "b")], [seg(2 * CHUNK_LENGTH + 1, 2 * CHUNK_LENGTH + 3, "c")]]
+        self.assertEqual([s["text"] for s in stitch_segments(self.chunks, parts)], ["a", "b", "c"])
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class PcmBufferTests(SimpleTestCase):
+    def pcm(self, values):
+        return io.BytesIO(np.array(values, dtype=np.int16).tobytes())
+
+    def test_converts_s16le_to_float32(self):
+        samples = PcmBuffer().fill(self.pcm([0, 16384, -32768]))
+        self.assertEqual(samples.dtype, np.float32)
+        self.assertEqual(samples.tolist(), [0.0, 0.5, -1.0])
+
+    def test_grows_for_long_input_and_reuses_memory(self):
+        buffer = PcmBuffer()
+        long_input = list(range(-1000, 1000)) * (SAMPLE_RATE // 10)
+        samples = buffer.fill(self.pcm(long_input))
+        self.assertEqual(samples.size, len(long_input))
+        self.assertAlmostEqual(float(samples[1]), -999 / 32768.0)
+
+        again = buffer.fill(self.pcm([100, 200]))
+        self.assertEqual(again.size, 2)
+        self.assertTrue(np.shares_memory(samples, again))
+
+
+class FakeModel:
+    def __init__(self):
+        self.calls = []
+
+    def transcribe(self, audio, **kwargs):
+        self.calls.append(audio)
+        return {"segments": [{"start": 100, "end": 102, "text": f"chunk {audio}"}]}
+
+
+class CheckpointResumeTests(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.audio = os.path.join(self.tmpdir, 'episode.mp3')
+        open(self.audio, 'wb').close()
+        self.checkpoints = os.path.join(self.tmpdir, 'checkpoints')
+        for target, value in [
+            ('get_duration', mock.Mock(return_value=3 * CHUNK_LENGTH)),
+            # Stand in for ffmpeg: "samples" are just the chunk start.
+            ('decode_chunk', lambda audio_path, chunk, buffer: chunk.start),
+            ('_get_buffers', lambda count: [None] * count),
+        ]:
+            patcher = mock.patch.object(transcribe_slim, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        quiet = mock.patch.object(transcribe_slim, 'print', create=True)
+        quiet.start()
+        self.addCleanup(quiet.stop)
+
+    def transcribe(self, model, **kwargs):
+        output = os.path.join(self.tmpdir, 'out.srt')
+        transcribe_file(model, self.audio, output, checkpoint_dir=self.checkpoints, **kwargs)
+        with open(output, encoding='utf-8') as f:
+            return f.read()
+
+    def test_resumes_from_finished_chunks(self):
+        first = FakeModel()
+        progress = []
+
+        def interrupt_after_two(done, total, segments):
+            progress.append((done, total, len(segments)))
+            if done == 2:
+                raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            self.transcribe(first, on_progress=interrupt_after_two)
+        self.assertEqual(progress, [(1, 3, 1), (2, 3, 2)])
+
+        second = FakeModel()
+        srt = self.transcribe(second)
+        self.assertEqual(len(second.calls), 1)
+        self.assertEqual(srt.count("chunk "), 3)
+
+    def test_checkpoints_for_another_chunk_plan_are_ignored(self):
+        self.transcribe(FakeModel())
+        transcribe_slim.get_duration.return_value = 5 * CHUNK_LENGTH
+        model = FakeModel()
+        self.transcribe(model)
+        self.assertEqual(len(model.calls), 5 - 2)
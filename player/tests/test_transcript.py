@@ -1,4 +1,7 @@
-from django.test import TestCase, Client
+import shutil
+import tempfile
+
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
 from player.models import Track, Transcript
@@ -6,6 +9,10 @@ import time
 
 class TranscriptTests(TestCase):
     def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
         self.user = User.objects.create_user(username='testuser', password='password')
         self.client = Client()
         self.client.force_login(self.user)
@@ -19,6 +26,10 @@ class TranscriptTests(TestCase):
         )
         self.track.file.save('test.mp3', SimpleUploadedFile('test.mp3', b'dummy content'))
 
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
     def test_transcript_request(self):
         response = self.client.post(f'/track/{self.track.id}/transcript/', {'action': 'request'})
         self.assertEqual(response.status_code, 302)
@@ -50,3 +61,18 @@ class TranscriptTests(TestCase):
 
         transcript = Transcript.objects.get(track=self.track)
         self.assertEqual(transcript.status, 'failed') # Should fail as only SRT is allowed
+
+    def test_partial_transcript_is_served_while_processing(self):
+        Transcript.objects.create(
+            track=self.track, status='processing', chunks_completed=1, chunks_total=3,
+            content="1\n00:00:01,000 --> 00:00:02,000\nFirst chunk\n",
+        )
+        data = self.client.get(f'/api/track/{self.track.id}/transcript/').json()
+        self.assertEqual(data['status'], 'partial')
+        self.assertEqual(data['chunks_completed'], 1)
+        self.assertEqual(data['transcript'][0]['text'], 'First chunk')
+
+    def test_processing_without_finished_chunks_is_unavailable(self):
+        Transcript.objects.create(track=self.track, status='processing', content='')
+        data = self.client.get(f'/api/track/{self.track.id}/transcript/').json()
+        self.assertEqual(data['status'], 'unavailable')
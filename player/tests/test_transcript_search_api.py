@@ -1,3 +1,5 @@
+from unittest import mock
+
 from django.test import TestCase
 from django.contrib.auth.models import User
 from player.models import Track, Transcript, Playlist, PlaylistItem
@@ -49,3 +51,65 @@ Searching for the keyword apple here.
         response = self.client.get(url, {'q': 'a'})
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.json()), 0)
+
+
+class TranscriptFullTextSearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='listener', password='password')
+        self.client.force_login(self.user)
+        self.track = Track.objects.create(name='Show', owner=self.user, type='podcast')
+        lines = [
+            'Apple pie is a dessert.',
+            'The apple orchard grows apples, apple after apple.',
+            'Pie apple is not the phrase.',
+            'Nothing relevant <b>here</b>.',
+        ]
+        content = ''.join(
+            f"{i + 1}\n00:00:{i:02},000 --> 00:00:{i:02},900\n{line}\n\n" for i, line in enumerate(lines)
+        )
+        Transcript.objects.create(track=self.track, content=content, status='completed')
+
+    def search(self, **params):
+        return self.client.get(reverse('search_transcripts'), params)
+
+    def texts(self, **params):
+        return [result['text'] for result in self.search(**params).json()]
+
+    def test_most_relevant_segment_first(self):
+        self.assertEqual(self.texts(q='apple ')[0], 'The apple orchard grows apples, apple after apple.')
+
+    def test_phrase_query(self):
+        self.assertEqual(self.texts(q='"apple pie"'), ['Apple pie is a dessert.'])
+
+    def test_last_word_is_a_prefix(self):
+        self.assertEqual(self.texts(q='orch'), ['The apple orchard grows apples, apple after apple.'])
+
+    def test_snippet_is_escaped_and_highlighted(self):
+        result, = self.search(q='relevant').json()
+        self.assertIn('<mark>relevant</mark>', result['snippet'])
+        self.assertIn('&lt;b&gt;', result['snippet'])
+
+    def test_other_users_transcripts_are_not_searched(self):
+        other = User.objects.create_user(username='other', password='pw')
+        self.client.force_login(other)
+        self.assertEqual(self.texts(q='apple'), [])
+
+    def test_pages_beyond_the_first(self):
+        content = ''.join(
+            f"{i + 1}\n00:{i // 60:02}:{i % 60:02},000 --> 00:{i // 60:02}:{i % 60:02},500\nbanana number {i}\n\n"
+            for i in range(25)
+        )
+        track = Track.objects.create(name='Bananas', owner=self.user, type='podcast')
+        Transcript.objects.create(track=track, content=content, status='completed')
+
+        first = self.search(q='banana')
+        self.assertEqual(len(first.json()), 20)
+        self.assertEqual(first['X-Next-Page'], '2')
+        second = self.search(q='banana', page=2)
+        self.assertEqual(len(second.json()), 5)
+        self.assertNotIn('X-Next-Page', second)
+
+    def test_substring_fallback_without_index(self):
+        with mock.patch('player.search._fts5_available', return_value=False):
+            result, = self.search(q='orchard').json()
+        self.assertIn('<mark>orchard</mark>', result['snippet'])
@@ -0,0 +1,64 @@
+import io
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from player.models import Track, Transcript, TranscriptSegment
+from player.transcripts import format_srt, parse_srt
+
+SRT = """1
+00:00:01,000 --> 00:00:04,500
+Hello there.
+
+2
+01:02:03,250 --> 01:02:05,000
+Second line
+wraps here.
+"""
+
+
+class TranscriptSegmentTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+        self.client.force_login(self.user)
+        self.track = Track.objects.create(name='Episode', owner=self.user, type='podcast')
+
+    def test_saving_content_builds_segments(self):
+        transcript = Transcript.objects.create(track=self.track, content=SRT, status='completed')
+        self.assertEqual(
+            list(transcript.segments.values_list('index', 'start_ms', 'end_ms', 'text')),
+            [(0, 1000, 4500, 'Hello there.'), (1, 3723250, 3725000, 'Second line\nwraps here.')],
+        )
+
+        transcript.content = "1\n00:00:00,000 --> 00:00:01,000\nReplaced\n"
+        transcript.save()
+        self.assertEqual(list(transcript.segments.values_list('text', flat=True)), ['Replaced'])
+
+    def test_saving_other_fields_does_not_reparse(self):
+        Transcript.objects.create(track=self.track, content=SRT, status='completed')
+        transcript = Transcript.objects.get(track=self.track)
+        with self.assertNumQueries(1):
+            transcript.error_message = 'note'
+            transcript.save()
+
+    def test_json_is_served_from_segments(self):
+        Transcript.objects.create(track=self.track, content=SRT, status='completed')
+        url = reverse('get_transcript_json', args=[self.track.id])
+        response = self.client.get(url)
+        self.assertEqual(response.json()['transcript'][1], {'start': 3723.25, 'end': 3725.0, 'text': 'Second line\nwraps here.'})
+
+    def test_export_regenerates_srt(self):
+        Transcript.objects.create(track=self.track, content=SRT, status='completed')
+        response = self.client.get(reverse('export_transcript', args=[self.track.id]))
+        self.assertEqual(parse_srt(response.content.decode()), parse_srt(SRT))
+
+    def test_backfill_builds_missing_segments(self):
+        transcript = Transcript.objects.create(track=self.track, content=SRT, status='completed')
+        TranscriptSegment.objects.all().delete()
+        call_command('backfill_transcript_segments', stdout=io.StringIO())
+        self.assertEqual(transcript.segments.count(), 2)
+
+    def test_format_srt_round_trips(self):
+        self.assertEqual(parse_srt(format_srt(parse_srt(SRT))), parse_srt(SRT))
@@ -0,0 +1,223 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+
+from player.management.commands.run_transcription_worker import (
+    LEASE_TIMEOUT, Command, TranscriptionEngine, TranscriptionJob, claim_next_transcript,
+    reclaim_stale_transcripts,
+)
+from player.models import Track, Transcript
+
+
+class ClaimTranscriptTests(TestCase):
+    def setUp(self):
+        self.bulk = User.objects.create_user(username='bulk', password='pw')
+        self.other = User.objects.create_user(username='other', password='pw')
+        self.start = timezone.now() - timedelta(hours=1)
+
+    def make_transcript(self, owner, minutes, status='pending'):
+        track = Track.objects.create(name=f'{owner.username}-{minutes}', owner=owner, type='podcast')
+        return Transcript.objects.create(
+            track=track, status=status, created_at=self.start + timedelta(minutes=minutes),
+        )
+
+    def test_claims_oldest_pending_and_marks_processing(self):
+        first = self.make_transcript(self.bulk, 0)
+        self.make_transcript(self.bulk, 1)
+        claimed = claim_next_transcript()
+        self.assertEqual(claimed.pk, first.pk)
+        self.assertEqual(claimed.status, 'processing')
+        self.assertIsNotNone(claimed.processing_started_at)
+
+    def test_owner_with_fewer_running_jobs_goes_first(self):
+        for minutes in range(3):
+            self.make_transcript(self.bulk, minutes)
+        later = self.make_transcript(self.other, 10)
+        self.make_transcript(self.bulk, -5, status='processing')
+        self.assertEqual(claim_next_transcript().pk, later.pk)
+
+    def test_round_robins_between_owners(self):
+        for minutes in range(3):
+            self.make_transcript(self.bulk, minutes)
+        self.make_transcript(self.other, 10)
+        owners = [claim_next_transcript().track.owner for _ in range(3)]
+        self.assertEqual(owners, [self.bulk, self.other, self.bulk])
+
+    def test_claim_starts_a_fresh_lease(self):
+        self.make_transcript(self.bulk, 0)
+        claimed = claim_next_transcript()
+        self.assertEqual(claimed.heartbeat_at, claimed.processing_started_at)
+
+    def test_nothing_to_claim(self):
+        self.make_transcript(self.bulk, 0, status='completed')
+        self.assertIsNone(claim_next_transcript())
+
+
+FAKE_ENGINE = '''
+import json, sys
+print(json.dumps({"event": "ready"}), flush=True)
+for line in sys.stdin:
+    job = json.loads(line)
+    with open(job["output_srt_path"], "w") as f:
+        f.write("1\\n00:00:00,000 --> 00:00:01,000\\nhello\\n\\n")
+    print(json.dumps({"ok": True}), flush=True)
+'''
+
+
+# Stands in for an engine with a chunk pool: a child process that would
+# keep working if only the engine were stopped.
+POOL_ENGINE = '''
+import json, subprocess, sys
+child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+print(json.dumps({"event": "ready", "child": child.pid}), flush=True)
+for line in sys.stdin:
+    pass
+'''
+
+
+def process_gone(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            # A zombie has stopped; it only waits to be reaped.
+            return any(line.split() == ['State:', 'Z', '(zombie)'] for line in f)
+    except FileNotFoundError:
+        return True
+
+
+class TranscriptionEngineTests(TestCase):
+    """The worker talks to a warm engine over JSON lines and reuses it."""
+
+    def setUp(self):
+        user = User.objects.create_user(username='owner', password='pw')
+        self.tmpdir = tempfile.mkdtemp()
+        script = os.path.join(self.tmpdir, 'engine.py')
+        with open(script, 'w') as f:
+            f.write(FAKE_ENGINE)
+        patcher = mock.patch(
+            'player.management.commands.run_transcription_worker._engine_script_path', return_value=script,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.transcripts = [
+            Transcript.objects.create(
+                track=Track.objects.create(name=f'episode-{i}', owner=user, type='podcast'),
+                status='processing',
+            )
+            for i in range(2)
+        ]
+
+    def wait_for_messages(self, engine):
+        for _ in range(200):
+            messages = engine.read_messages()
+            if messages:
+                return messages
+            time.sleep(0.05)
+        self.fail('engine did not reply')
+
+    def test_engine_handles_several_jobs_without_restarting(self):
+        command = Command(stdout=io.StringIO())
+        command.max_jobs_per_engine = 10
+        command.max_engine_memory = 1 << 40
+        engine = TranscriptionEngine()
+        command.engines = [engine]
+        self.addCleanup(engine.terminate)
+        self.assertEqual(self.wait_for_messages(engine), [{'event': 'ready'}])
+
+        for transcript in self.transcripts:
+            with mock.patch.object(type(transcript.track.file), 'path', os.path.join(self.tmpdir, 'a.mp3')):
+                job = TranscriptionJob(transcript)
+                engine.submit(job)
+            message, = self.wait_for_messages(engine)
+            command.finish_job(job, message)
+            job.cleanup()
+
+        self.assertTrue(engine.alive())
+        for transcript in self.transcripts:
+            transcript.refresh_from_db()
+            self.assertEqual(transcript.status, 'completed')
+            self.assertIn('hello', transcript.content)
+            self.assertEqual(list(transcript.segments.values_list('text', flat=True)), ['hello'])
+
+    def test_terminating_an_engine_stops_its_pool(self):
+        script = os.path.join(self.tmpdir, 'pool_engine.py')
+        with open(script, 'w') as f:
+            f.write(POOL_ENGINE)
+        with mock.patch(
+            'player.management.commands.run_transcription_worker._engine_script_path', return_value=script,
+        ):
+            engine = TranscriptionEngine()
+        child = self.wait_for_messages(engine)[0]['child']
+        self.assertFalse(process_gone(child))
+
+        # What cancel_abandoned does to a cancelled job's engine.
+        engine.terminate()
+        for _ in range(100):
+            if process_gone(child):
+                break
+            time.sleep(0.05)
+        self.assertTrue(process_gone(child))
+
+    def test_engine_that_died_before_dispatch_is_replaced(self):
+        command = Command(stdout=io.StringIO())
+        command.engine_options = {}
+        dead = TranscriptionEngine()
+        dead.terminate()
+        command.engines = [dead]
+        self.addCleanup(lambda: command.engines[0].terminate())
+
+        index = command.idle_engine_index()
+        self.assertEqual(index, 0)
+        transcript = self.transcripts[0]
+        with mock.patch.object(type(transcript.track.file), 'path', os.path.join(self.tmpdir, 'a.mp3')):
+            command.start_job(index, transcript)
+        engine = command.engines[0]
+        self.assertIsNot(engine, dead)
+        self.assertTrue(engine.alive())
+        self.assertIsNotNone(engine.job)
+        self.assertIsNone(command.idle_engine_index())
+        engine.job.cleanup()
+
+
+class LeaseTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pw')
+
+    def make_processing(self, heartbeat_age):
+        track = Track.objects.create(name=f'episode-{heartbeat_age}', owner=self.user, type='podcast')
+        started = timezone.now() - timedelta(hours=2)
+        return Transcript.objects.create(
+            track=track, status='processing', processing_started_at=started,
+            heartbeat_at=timezone.now() - timedelta(seconds=heartbeat_age),
+        )
+
+    def test_stale_jobs_are_requeued_and_live_ones_kept(self):
+        stale = self.make_processing(LEASE_TIMEOUT + 60)
+        live = self.make_processing(5)
+        self.assertEqual(reclaim_stale_transcripts(), 1)
+        stale.refresh_from_db()
+        live.refresh_from_db()
+        self.assertEqual(stale.status, 'pending')
+        self.assertIsNone(stale.processing_started_at)
+        self.assertEqual(live.status, 'processing')
+
+    def test_old_claim_cannot_finish_a_reclaimed_job(self):
+        transcript = self.make_processing(LEASE_TIMEOUT + 60)
+        job = TranscriptionJob(transcript)
+        self.addCleanup(job.cleanup)
+        reclaim_stale_transcripts()
+        reclaimed = claim_next_transcript()
+        self.assertEqual(reclaimed.pk, transcript.pk)
+
+        command = Command(stdout=io.StringIO())
+        command.fail(job, 'old worker gave up')
+        reclaimed.refresh_from_db()
+        self.assertEqual(reclaimed.status, 'processing')
@@ -0,0 +1,26 @@
+"""Text normalisation shared by the library search index and its queries."""
+import re
+import unicodedata
+
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize_search_text(*parts):
+    """Lower-case, strip accents and collapse punctuation/whitespace to single spaces."""
+    text = ' '.join(part for part in parts if part)
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _NON_WORD.sub(' ', text.lower()).strip()
+
+
+def search_grams(normalized):
+    """The distinct trigrams of each word of already-normalised text.
+
+    Grams never span words, and words shorter than three characters have
+    none, so a query's grams are a subset of the grams of any text that
+    contains it.
+    """
+    grams = set()
+    for word in normalized.split():
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
@@ -0,0 +1,46 @@
+"""Converting between SRT text and transcript segments.
+
+Transcripts arrive as SRT (from the worker or an upload) and are parsed once
+into TranscriptSegment rows; readers query those rows instead of parsing
+the SRT again, and export turns them back into SRT.
+"""
+import logging
+
+import pysrt
+
+
+def parse_srt(content):
+    """Return [(start_ms, end_ms, text), ...] for SRT ``content``.
+
+    Unparseable content yields an empty list (and is logged), like a
+    transcript with no cues.
+    """
+    if not content:
+        return []
+    try:
+        subs = pysrt.from_string(content)
+    except Exception as e:
+        logging.error(f"Error parsing transcript SRT: {e}")
+        return []
+    return [(sub.start.ordinal, sub.end.ordinal, sub.text) for sub in subs]
+
+
+def format_timestamp(ms, separator=','):
+    """HH:MM:SS,mmm (SRT) for a millisecond offset."""
+    seconds, ms = divmod(int(ms), 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02}:{minutes:02}:{seconds:02}{separator}{ms:03}"
+
+
+def format_clock(ms):
+    """HH:MM:SS for a millisecond offset, as shown next to search results."""
+    return format_timestamp(ms).split(',')[0]
+
+
+def format_srt(segments):
+    """SRT text for an iterable of (start_ms, end_ms, text)."""
+    return ''.join(
+        f"{i}\n{format_timestamp(start_ms)} --> {format_timestamp(end_ms)}\n{text}\n\n"
+        for i, (start_ms, end_ms, text) in enumerate(segments, start=1)
+    )
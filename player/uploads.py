@@ -0,0 +1,261 @@
+"""Resumable, chunked track uploads (the core of tus 1.0, plus its creation,
+checksum and termination extensions).
+
+A client creates an upload by POSTing its total length, then sends the
+bytes in PATCH requests that each start at the offset the server last
+reported (HEAD tells it after a dropped connection). Bytes are streamed
+straight onto a ``.part`` file in MEDIA_ROOT/tracks/, so no request holds
+more than a small buffer or lasts longer than one chunk. A PATCH may carry
+an ``Upload-Checksum``; if it doesn't match, the chunk is thrown away.
+Without one, whatever arrived before a disconnect is kept.
+
+When the last byte arrives the file is moved to its final name beside the
+other tracks and its duration and tags are read, once. upload_track and
+upload_playlist then create tracks from finished uploads by ``upload_id``
+rather than from files in the form POST.
+
+The whole length is reserved against the user's quota when the upload is
+created (UserProfile.storage_reserved_bytes) and becomes used storage when
+the track is saved. Uploads not used within UPLOAD_EXPIRY are deleted by
+purge_stale_uploads, which releases their reservation. run_media_worker
+runs it hourly for every user; creating an upload also purges that user's.
+"""
+import base64
+import binascii
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+from datetime import timedelta
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.http import UnreadablePostError
+from django.utils import timezone
+from mutagen import File as MutagenFile
+
+from .media_store import blob_digest
+from .models import MediaBlob, Track, UploadSession, UserProfile, adjust_storage_used
+
+TUS_VERSION = '1.0.0'
+TUS_EXTENSIONS = 'creation,checksum,termination'
+CHECKSUM_ALGORITHMS = {'md5': hashlib.md5, 'sha1': hashlib.sha1, 'sha256': hashlib.sha256}
+UPLOAD_EXPIRY = timedelta(days=1)
+READ_SIZE = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    """A request the upload API refuses, with the HTTP status to answer with."""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_metadata(header):
+    """Decode a tus Upload-Metadata header ("key base64value,...") to a dict."""
+    metadata = {}
+    for pair in filter(None, (item.strip() for item in (header or '').split(','))):
+        key, _, value = pair.partition(' ')
+        try:
+            metadata[key] = base64.b64decode(value, validate=True).decode('utf-8') if value else ''
+        except (binascii.Error, UnicodeDecodeError):
+            raise UploadError(f'Invalid Upload-Metadata value for {key!r}.', 400)
+    return metadata
+
+
+def parse_checksum(header):
+    """(algorithm, expected digest bytes) from an Upload-Checksum header, or None."""
+    if not header:
+        return None
+    algorithm, _, encoded = header.strip().partition(' ')
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise UploadError(f'Unsupported checksum algorithm {algorithm!r}.', 400)
+    try:
+        return algorithm, base64.b64decode(encoded, validate=True)
+    except binascii.Error:
+        raise UploadError('Invalid Upload-Checksum value.', 400)
+
+
+def create_upload(user, filename, length):
+    """Start an upload of ``length`` bytes, reserving them against the user's quota."""
+    if length < 0:
+        raise UploadError('Upload-Length must not be negative.', 400)
+    if not filename:
+        raise UploadError('Upload-Metadata must include a filename.', 400)
+    purge_stale_uploads(user=user)
+    with transaction.atomic():
+        profile = UserProfile.objects.select_for_update().get(user=user)
+        if not profile.has_room_for(length):
+            raise UploadError(
+                f"Uploading this file would exceed your {profile.storage_limit_gb}GB storage limit.", 413
+            )
+        adjust_storage_used(user.pk, length, 'storage_reserved_bytes')
+        session = UploadSession.objects.create(user=user, filename=os.path.basename(filename), length=length)
+    part_path = default_storage.path(session.part_name)
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    open(part_path, 'wb').close()
+    if length == 0:
+        _finish_upload(session)
+    return session
+
+
+def _read_body(stream, remaining):
+    """Yield the request body in pieces; stops early if the client goes away."""
+    while remaining > 0:
+        try:
+            data = stream.read(min(READ_SIZE, remaining))
+        except (OSError, UnreadablePostError):
+            return
+        if not data:
+            return
+        remaining -= len(data)
+        yield data
+
+
+def append_chunk(session, offset, stream, content_length, checksum=None):
+    """Append a PATCH body to the upload and return the new offset.
+
+    ``checksum`` is a parsed Upload-Checksum. Only one write per upload runs
+    at a time; another one meanwhile is refused rather than queued.
+    """
+    if session.complete:
+        raise UploadError('This upload is already complete.', 403)
+    if offset != session.offset:
+        raise UploadError(f'Upload-Offset {offset} does not match the current offset {session.offset}.', 409)
+    if content_length is None or offset + content_length > session.length:
+        raise UploadError('The chunk would run past Upload-Length.', 400)
+
+    try:
+        part = open(default_storage.path(session.part_name), 'r+b')
+    except FileNotFoundError:
+        raise UploadError('This upload no longer exists.', 404)
+    with part:
+        try:
+            fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                raise UploadError('Another request is writing to this upload.', 423)
+            raise
+        # Someone else may have written while this request waited for the
+        # lock, and a worker that died mid-write can leave extra bytes.
+        session.refresh_from_db(fields=['offset', 'file_name'])
+        if offset != session.offset or session.complete:
+            raise UploadError(f'Upload-Offset {offset} does not match the current offset {session.offset}.', 409)
+        part.truncate(offset)
+        part.seek(offset)
+
+        digest = CHECKSUM_ALGORITHMS[checksum[0]]() if checksum else None
+        received = 0
+        for data in _read_body(stream, content_length):
+            part.write(data)
+            received += len(data)
+            if digest:
+                digest.update(data)
+        part.flush()
+
+        if digest and (received != content_length or digest.digest() != checksum[1]):
+            # An unverifiable chunk is as bad as a corrupt one.
+            part.truncate(offset)
+            raise UploadError('Checksum mismatch.', 460)
+
+        session.offset = offset + received
+        UploadSession.objects.filter(pk=session.pk).update(offset=session.offset, updated_at=timezone.now())
+        if session.offset == session.length:
+            _finish_upload(session)
+    return session.offset
+
+
+def read_audio_metadata(path):
+    """{'duration', 'title', 'artist'} read from the audio file's header and tags."""
+    metadata = {'duration': 0, 'title': None, 'artist': None}
+    try:
+        audio = MutagenFile(path, easy=True)
+    except Exception as e:
+        logger.error(f"Error reading audio file metadata: {e}")
+        return metadata
+    if audio is None:
+        return metadata
+    metadata['duration'] = getattr(audio.info, 'length', 0) or 0
+    tags = audio.tags or {}
+    for key in ('title', 'artist'):
+        values = tags.get(key) if hasattr(tags, 'get') else None
+        if values:
+            metadata[key] = str(values[0])
+    return metadata
+
+
+class _AssembledFile(File):
+    """The finished .part file. Like a TemporaryUploadedFile, storage may
+    move or link it into place rather than copy it."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def _finish_upload(session):
+    """Move the complete .part file to its final name and read its metadata."""
+    part_path = default_storage.path(session.part_name)
+    field = Track._meta.get_field('file')
+    with _AssembledFile(open(part_path, 'rb')) as assembled:
+        name = field.storage.save(field.generate_filename(None, session.filename), assembled)
+    if os.path.exists(part_path):
+        # Content-addressed storage links the file rather than moving it.
+        os.unlink(part_path)
+    with transaction.atomic():
+        MediaBlob.acquire([name])
+        session.file_name = name
+        session.metadata = read_audio_metadata(field.storage.path(name))
+        session.save(update_fields=['file_name', 'metadata', 'updated_at'])
+
+
+def finished_upload(user, upload_id):
+    """The user's complete UploadSession with this id, or None."""
+    try:
+        return UploadSession.objects.filter(user=user).exclude(file_name='').get(pk=upload_id)
+    except (UploadSession.DoesNotExist, ValueError, TypeError):
+        return None
+
+
+def consume_upload(session):
+    """Hand a finished upload's file over to a track being saved.
+
+    Call inside the transaction that saves the track, so the reservation
+    turns into used storage atomically. Returns False if another request
+    has already used (or discarded) the upload.
+    """
+    if not UploadSession.objects.filter(pk=session.pk).delete()[0]:
+        return False
+    adjust_storage_used(session.user_id, -session.length, 'storage_reserved_bytes')
+    # The track's own reference to a shared blob is counted when it is saved.
+    MediaBlob.release([session.file_name])
+    return True
+
+
+def discard_upload(session):
+    """Delete an upload and its file, and release its reservation."""
+    with transaction.atomic():
+        if not UploadSession.objects.filter(pk=session.pk).delete()[0]:
+            return
+        adjust_storage_used(session.user_id, -session.length, 'storage_reserved_bytes')
+        MediaBlob.release([session.file_name])
+    default_storage.delete(session.part_name)
+    if session.file_name and not blob_digest(session.file_name):
+        default_storage.delete(session.file_name)
+
+
+def purge_stale_uploads(user=None, now=None):
+    """Discard uploads untouched for UPLOAD_EXPIRY; returns how many."""
+    cutoff = (now or timezone.now()) - UPLOAD_EXPIRY
+    stale = UploadSession.objects.filter(updated_at__lt=cutoff)
+    if user is not None:
+        stale = stale.filter(user=user)
+    count = 0
+    for session in stale:
+        discard_upload(session)
+        count += 1
+    return count
@@ -10,6 +10,8 @@ urlpatterns = [
     path('profile/', views.profile, name='profile'),
     path('register/', views.register, name='register'),
     path('upload/', views.upload_track, name='upload_track'),
+    path('api/uploads/', views.upload_create, name='upload_create'),
+    path('api/uploads/<uuid:upload_id>/', views.upload_detail, name='upload_detail'),
     path('api/track/<int:track_id>/delete/', views.delete_track_api, name='delete_track_api'),
     path('track/<int:track_id>/edit/', views.edit_track, name='edit_track'),
     path('track/<int:track_id>/transcript/', views.update_transcript, name='update_transcript'),
@@ -17,16 +19,22 @@ urlpatterns = [
     path('track/<int:track_id>/transcript/cancel/', views.cancel_transcript, name='cancel_transcript'),
     path('track/<int:track_id>/download/', views.download_track, name='download_track'),
     path('track/<int:track_id>/stream/', views.stream_track, name='stream_track'),
+    path('track/<int:track_id>/hls/master.m3u8', views.track_hls, name='track_hls'),
+    path('track/<int:track_id>/renditions/<int:rendition_id>/<str:name>', views.rendition_file, name='rendition_file'),
     path('api/update_playback_state/', views.update_playback_state, name='update_playback_state'),
+    path('api/sync_playback_state/', views.sync_playback_state, name='sync_playback_state'),
     path('api/track/<int:track_id>/transcript/', views.get_transcript_json, name='get_transcript_json'),
     path('api/transcript/status/<int:track_id>/', views.get_transcript_status, name='get_transcript_status'),
     path('api/search_transcripts/', views.search_transcripts, name='search_transcripts'),
+    path('api/tracks/typeahead/', views.track_typeahead, name='track_typeahead'),
+    path('api/tracks/recently_played/', views.recently_played_api, name='recently_played_api'),
     path('transcripts/', views.transcript_list, name='transcript_list'),
 
     # Playlist URLs
     path('playlists/', views.playlist_list, name='playlist_list'),
     path('playlists/create/', views.create_playlist, name='create_playlist'),
     path('playlists/upload/', views.upload_playlist, name='upload_playlist'),
+    path('api/uploads/progress/<slug:progress_id>/', views.upload_progress, name='upload_progress'),
     path('playlists/<int:playlist_id>/', views.playlist_detail, name='playlist_detail'),
     path('playlists/<int:playlist_id>/edit/', views.edit_playlist, name='edit_playlist'),
     path('playlists/<int:playlist_id>/delete/', views.delete_playlist, name='delete_playlist'),
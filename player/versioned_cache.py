@@ -0,0 +1,47 @@
+"""Cache entries that are dropped by bumping a version number.
+
+Each entry lives under a key containing a version number, itself cached
+(with no expiry) under a per-id version key. ``invalidate`` writes a new
+version once the current transaction commits; readers then miss and
+rebuild, and entries under old versions simply expire. A reader racing a
+write can at worst store a value under a version nobody asks for any more.
+player.header_cache and player.access are built on it.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _version_key(namespace, pk):
+    return f'{namespace}:version:{pk}'
+
+
+def _new_version():
+    return time.time_ns()
+
+
+def invalidate(namespace, ids):
+    """Drop the entries in ``namespace`` for these ids when the current transaction commits."""
+    ids = {pk for pk in ids if pk is not None}
+    if ids:
+        version = _new_version()
+        transaction.on_commit(lambda: cache.set_many(
+            {_version_key(namespace, pk): version for pk in ids}, None
+        ))
+
+
+def cached(namespace, pk, build, timeout):
+    """The entry in ``namespace`` for ``pk``, calling ``build()`` to fill it on a miss."""
+    version_key = _version_key(namespace, pk)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, _new_version(), None)
+        version = cache.get(version_key, 0)
+    key = f'{namespace}:{pk}:{version}'
+    # Wrapped so a cached None is still a hit.
+    entry = cache.get(key)
+    if entry is None:
+        entry = (build(),)
+        cache.set(key, entry, timeout)
+    return entry[0]
@@ -1,25 +1,42 @@
+import asyncio
 import os
-import re
-import mimetypes
 import logging
-from datetime import datetime, timezone as dt_timezone
-from django.core.paginator import Paginator
-from django.core.files.base import ContentFile
-from django.shortcuts import render, redirect, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.template.loader import render_to_string
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login, authenticate
-from django.http import FileResponse, StreamingHttpResponse, JsonResponse
-from django.views.decorators.http import require_POST
+from django.http import Http404, JsonResponse
+from django.views.decorators.http import require_POST, require_http_methods
 from django.views.decorators.csrf import csrf_exempt
+from .access import access_grants, can_access_playlist, can_access_track
 from .forms import TrackForm, PlaylistForm, BookmarkForm, PlaylistUploadForm, TranscriptUploadForm
-from .models import Track, UserPlaybackState, PodcastProgress, Playlist, PlaylistItem, UserTrackLastPlayed, Bookmark, Transcript
+from .models import (
+    Track, TrackRendition, UserPlaybackState, Playlist, PlaylistItem, Bookmark, Transcript, UploadSession,
+)
+from .media_store import blob_digest
+from .media_cache import track_media
+from .renditions import CONTENT_TYPES, FILE_NAME_RE, hls_master_playlist, renditions_for
+from .streaming import REVALIDATE_CACHE_CONTROL, describe_path, serve_file
+from .transcripts import format_clock, format_srt
+from .search import matching_tracks, rank_tracks, search_segments
+from .pagination import SortKey, chained_keyset_page, keyset_page
+from .ingest import (
+    IngestedFile, IngestProgress, bulk_create_tracks, delete_stored_files, get_progress, ingest_files, store_file,
+)
+from .uploads import (
+    CHECKSUM_ALGORITHMS, TUS_EXTENSIONS, TUS_VERSION, UploadError, append_chunk, consume_upload,
+    create_upload, discard_upload, finished_upload, parse_checksum, parse_metadata,
+)
+from .playback import (
+    apply_playback_samples, podcast_positions, last_played_times, current_playback_state,
+    last_played_order, played_tracks, LAST_PLAYED_KEYS, MAX_SAMPLES_PER_BATCH,
+)
 from mutagen import File as MutagenFile
 import pysrt
 from django.utils import timezone
 from django.db import models, transaction
-from wsgiref.util import FileWrapper
 from django.http import HttpResponse
 from django.urls import reverse
 import json
@@ -37,37 +54,33 @@ def track_list(request):
     sort_option = request.GET.get('sort', 'name')
 
     if title_search_query:
-        tracks_query = tracks_query.filter(
-            models.Q(name__icontains=title_search_query) |
-            models.Q(artist__icontains=title_search_query)
-        )
+        tracks_query = matching_tracks(tracks_query, title_search_query)
     if selected_artist:
         tracks_query = tracks_query.filter(artist=selected_artist)
     if selected_playlist_id:
         tracks_query = tracks_query.filter(playlists__id=selected_playlist_id)
 
-    # Sorting
+    # Sorting: keyset pagination needs the order to end in a unique column
     if sort_option == 'last_played':
-        tracks_query = tracks_query.annotate(
-            user_last_played=models.Max('usertracklastplayed__last_played', filter=models.Q(usertracklastplayed__user=request.user))
-        ).order_by(models.F('user_last_played').desc(nulls_last=True))
+        # Played tracks straight off the user's last-played index, then the rest
+        sort_parts = last_played_order(request.user, tracks_query)
     else: # 'name'
-        tracks_query = tracks_query.order_by('name')
+        sort_parts = [(tracks_query, [SortKey('name'), SortKey('id')])]
 
     playlists = Playlist.objects.filter(owner=request.user)
     artists = Track.objects.filter(owner=request.user).values_list('artist', flat=True).distinct().order_by('artist')
 
-    # Pagination
-    paginator = Paginator(tracks_query, 10)  # Show 10 tracks per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Pagination: 10 tracks per page, an estimated total only when asked for
+    is_ajax = request.headers.get('x-requested-with') == 'XMLHttpRequest'
+    page_obj = chained_keyset_page(
+        sort_parts, cursor=request.GET.get('cursor'), per_page=10,
+        with_count=not is_ajax or request.GET.get('count') == '1',
+    )
 
     # Prepare track data with progress and last played info
     track_ids = [t.id for t in page_obj.object_list]
-    podcast_progress = PodcastProgress.objects.filter(user=request.user, track_id__in=track_ids)
-    podcast_progress_map = {p.track_id: p.position for p in podcast_progress}
-    last_played_data = UserTrackLastPlayed.objects.filter(user=request.user, track_id__in=track_ids)
-    last_played_map = {lp.track_id: lp.last_played for lp in last_played_data}
+    podcast_progress_map = podcast_positions(request.user, track_ids)
+    last_played_map = last_played_times(request.user, track_ids)
 
     for track in page_obj.object_list:
         last_played_dt = last_played_map.get(track.id)
@@ -80,7 +93,7 @@ def track_list(request):
             track.position = 0
             track.progress_percentage = 0
 
-    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+    if is_ajax:
         track_html = render_to_string(
             'player/partials/track_list_items.html',
             {'tracks': page_obj.object_list, 'playlists': playlists}
@@ -89,16 +102,19 @@ def track_list(request):
             'player/partials/pagination.html',
             {'tracks': page_obj}
         )
-        return JsonResponse({'track_html': track_html, 'pagination_html': pagination_html})
+        return JsonResponse({
+            'track_html': track_html,
+            'pagination_html': pagination_html,
+            'next_cursor': page_obj.next_cursor,
+            'prev_cursor': page_obj.prev_cursor,
+            'approximate_count': page_obj.count,
+        })
 
-    # Calculate storage usage for initial load
-    current_storage_usage = tracks_query.aggregate(total_size=models.Sum('file_size'))['total_size'] or 0
-    user_storage_limit_bytes = request.user.userprofile.storage_limit_gb * 1024 * 1024 * 1024
+    # Storage usage for initial load
+    current_storage_usage = request.user.userprofile.storage_used_bytes
+    user_storage_limit_bytes = request.user.userprofile.storage_limit_bytes
     storage_percentage = (current_storage_usage / user_storage_limit_bytes) * 100 if user_storage_limit_bytes > 0 else 0
 
-    bookmarks = Bookmark.objects.filter(user=request.user).order_by('name')
-    bookmark_form = BookmarkForm()
-
     context = {
         'tracks': page_obj,
         'playlists': playlists,
@@ -110,8 +126,6 @@ def track_list(request):
         'storage_usage': current_storage_usage,
         'storage_limit': user_storage_limit_bytes,
         'storage_percentage': storage_percentage,
-        'bookmarks': bookmarks,
-        'bookmark_form': bookmark_form,
     }
     return render(request, 'player/track_list.html', context)
 
@@ -144,20 +158,22 @@ def web_manifest(request):
 def profile(request):
     return render(request, 'registration/profile.html')
 
-from .models import UserProfile
-from django.db.models import Sum
+from .models import UserProfile, StorageTotals
 
 def register(request):
     if request.method == 'POST':
         form = UserCreationForm(request.POST)
-        total_storage_limit = UserProfile.objects.aggregate(Sum('storage_limit_gb'))['storage_limit_gb__sum'] or 0
-        if total_storage_limit + settings.DEFAULT_USER_STORAGE_LIMIT_GB > settings.STORAGE_LIMIT_GB_TOTAL:
-            form.add_error(None, "Registration is currently disabled due to storage limitations.")
-            return render(request, 'registration/register.html', {'form': form})
-
-        if form.is_valid():
-            user = form.save()
+        # The totals row stays locked until the new profile's allocation is
+        # added to it, so simultaneous sign-ups can't overshoot the total.
+        with transaction.atomic():
+            totals = StorageTotals.load(lock=True)
+            if totals.allocated_limit_gb + settings.DEFAULT_USER_STORAGE_LIMIT_GB > settings.STORAGE_LIMIT_GB_TOTAL:
+                form.add_error(None, "Registration is currently disabled due to storage limitations.")
+                return render(request, 'registration/register.html', {'form': form})
+
+            user = form.save() if form.is_valid() else None
             # UserProfile is created automatically by the post_save signal
+        if user is not None:
             login(request, user, backend='django.contrib.auth.backends.ModelBackend')
             return redirect('track_list')
     else:
@@ -182,6 +198,14 @@ def upload_track(request):
         transcript_error = None
         transcript_content = None
 
+        # The audio may have arrived beforehand through the resumable upload API.
+        upload_id = request.POST.get('upload_id')
+        upload = finished_upload(request.user, upload_id) if upload_id else None
+        if upload_id:
+            form.fields['file'].required = False
+            if upload is None:
+                form.add_error('file', "This upload is missing or has not finished.")
+
         if transcript_file:
             if not transcript_file.name.lower().endswith('.srt'):
                 transcript_error = "Only .srt files are supported for upload."
@@ -198,29 +222,40 @@ def upload_track(request):
             track = form.save(commit=False)
             track.owner = request.user
 
-            audio_file = request.FILES['file']
-            new_track_size = audio_file.size
-            current_storage_usage = Track.objects.filter(owner=request.user).aggregate(total_size=models.Sum('file_size'))['total_size'] or 0
-            user_storage_limit_bytes = request.user.userprofile.storage_limit_gb * 1024 * 1024 * 1024
-
-            if current_storage_usage + new_track_size > user_storage_limit_bytes:
-                form.add_error(None, f"Uploading this track would exceed your {request.user.userprofile.storage_limit_gb}GB storage limit.")
-                if is_ajax:
-                    return JsonResponse({'status': 'error', 'errors': form.errors.get_json_data()}, status=400)
-                return render(request, 'player/upload_track.html', {'form': form})
+            if upload is not None:
+                # Its metadata was read once, when the last chunk arrived.
+                track.file = upload.file_name
+                new_track_size = upload.length
+                track.duration = upload.metadata.get('duration') or 0
+            else:
+                audio_file = request.FILES['file']
+                new_track_size = audio_file.size
 
+                try:
+                    audio = MutagenFile(audio_file)
+                    if audio:
+                        track.duration = audio.info.length
+                except Exception as e:
+                    logging.error(f"Error reading audio file metadata: {e}")
+                finally:
+                    audio_file.seek(0)
             track.file_size = new_track_size
 
-            try:
-                audio = MutagenFile(audio_file)
-                if audio:
-                    track.duration = audio.info.length
-            except Exception as e:
-                logging.error(f"Error reading audio file metadata: {e}")
-            finally:
-                audio_file.seek(0)
-
-            track.save()
+            # The profile stays locked until track.save() has added the new
+            # size to its counter, so concurrent uploads are checked in turn.
+            with transaction.atomic():
+                profile = UserProfile.objects.select_for_update().get(user=request.user)
+                if upload is not None:
+                    # Its size was reserved when the upload began.
+                    if not consume_upload(upload):
+                        form.add_error('file', "This upload has already been used.")
+                elif not profile.has_room_for(new_track_size):
+                    form.add_error(None, f"Uploading this track would exceed your {profile.storage_limit_gb}GB storage limit.")
+                if form.errors:
+                    if is_ajax:
+                        return JsonResponse({'status': 'error', 'errors': form.errors.get_json_data()}, status=400)
+                    return render(request, 'player/upload_track.html', {'form': form})
+                track.save()
 
             if transcript_file and not transcript_error:
                 transcript = Transcript(
@@ -276,6 +311,80 @@ def delete_track_api(request, track_id):
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
+def _tus_response(status=204, headers=None):
+    response = HttpResponse(status=status)
+    response['Tus-Resumable'] = TUS_VERSION
+    for name, value in (headers or {}).items():
+        response[name] = value
+    return response
+
+def _upload_error(error):
+    response = JsonResponse({'status': 'error', 'message': str(error)}, status=error.status)
+    response['Tus-Resumable'] = TUS_VERSION
+    return response
+
+@login_required
+@require_http_methods(['POST', 'OPTIONS'])
+def upload_create(request):
+    """Start a resumable upload (tus creation). See player.uploads."""
+    if request.method == 'OPTIONS':
+        return _tus_response(204, {
+            'Tus-Version': TUS_VERSION,
+            'Tus-Extension': TUS_EXTENSIONS,
+            'Tus-Checksum-Algorithm': ','.join(CHECKSUM_ALGORITHMS),
+        })
+    try:
+        try:
+            length = int(request.headers.get('Upload-Length', ''))
+        except ValueError:
+            raise UploadError('Upload-Length is required.', 400)
+        metadata = parse_metadata(request.headers.get('Upload-Metadata'))
+        session = create_upload(request.user, metadata.get('filename'), length)
+    except UploadError as e:
+        return _upload_error(e)
+    return _tus_response(201, {'Location': reverse('upload_detail', args=[session.pk])})
+
+@login_required
+@require_http_methods(['HEAD', 'GET', 'PATCH', 'DELETE'])
+def upload_detail(request, upload_id):
+    """HEAD/PATCH/DELETE one resumable upload; GET describes it as JSON."""
+    session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+
+    if request.method == 'DELETE':
+        discard_upload(session)
+        return _tus_response(204)
+
+    if request.method == 'PATCH':
+        if request.content_type != 'application/offset+octet-stream':
+            return _upload_error(UploadError('Content-Type must be application/offset+octet-stream.', 415))
+        try:
+            try:
+                offset = int(request.headers.get('Upload-Offset', ''))
+                content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                raise UploadError('Upload-Offset and Content-Length are required.', 400)
+            checksum = parse_checksum(request.headers.get('Upload-Checksum'))
+            offset = append_chunk(session, offset, request, content_length, checksum)
+        except UploadError as e:
+            return _upload_error(e)
+        return _tus_response(204, {'Upload-Offset': str(offset)})
+
+    if request.method == 'GET':
+        return JsonResponse({
+            'id': str(session.pk),
+            'filename': session.filename,
+            'offset': session.offset,
+            'length': session.length,
+            'complete': session.complete,
+            'metadata': session.metadata,
+        })
+
+    return _tus_response(200, {
+        'Upload-Offset': str(session.offset),
+        'Upload-Length': str(session.length),
+        'Cache-Control': 'no-store',
+    })
+
 @login_required
 def edit_track(request, track_id):
     track = get_object_or_404(Track, pk=track_id, owner=request.user)
@@ -288,16 +397,12 @@ def edit_track(request, track_id):
             if 'file' in request.FILES:
                 audio_file = request.FILES['file']
                 new_track_size = audio_file.size
-                old_track_size = track.file_size or 0
-
-                # Check storage limit
-                current_storage_usage = Track.objects.filter(owner=request.user).exclude(pk=track_id).aggregate(total_size=models.Sum('file_size'))['total_size'] or 0
-                user_storage_limit_bytes = request.user.userprofile.storage_limit_gb * 1024 * 1024 * 1024
-                if current_storage_usage + new_track_size > user_storage_limit_bytes:
-                    form.add_error(None, f"Uploading this track would exceed your {request.user.userprofile.storage_limit_gb}GB storage limit.")
-                    return render(request, 'player/edit_track.html', {'form': form, 'track': track})
-
                 edited_track.file_size = new_track_size
+                # A new file gets a fresh set of probe and remux attempts.
+                edited_track.duration_attempts = 0
+                edited_track.duration_retry_at = None
+                edited_track.remux_attempts = 0
+                edited_track.remux_retry_at = None
 
                 # Calculate duration
                 try:
@@ -309,8 +414,16 @@ def edit_track(request, track_id):
                 finally:
                     audio_file.seek(0)
 
-            edited_track.save()
-            form.save_m2m()
+            with transaction.atomic():
+                if 'file' in request.FILES:
+                    # Check storage limit, the replaced file's size freed up
+                    profile = UserProfile.objects.select_for_update().get(user=request.user)
+                    stored_size = Track.objects.filter(pk=track_id).values_list('file_size', flat=True).get()
+                    if not profile.has_room_for(edited_track.file_size - stored_size):
+                        form.add_error(None, f"Uploading this track would exceed your {profile.storage_limit_gb}GB storage limit.")
+                        return render(request, 'player/edit_track.html', {'form': form, 'track': track})
+                edited_track.save()
+                form.save_m2m()
             return redirect('track_list')
     else:
         form = TrackForm(instance=track)
@@ -373,35 +486,55 @@ def update_transcript(request, track_id):
 
 @login_required
 def transcript_list(request):
-    transcripts = Transcript.objects.filter(track__owner=request.user).select_related('track').order_by('-created_at')
+    transcripts = Transcript.objects.filter(track__owner=request.user).select_related('track')
 
-    paginator = Paginator(transcripts, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = keyset_page(
+        transcripts,
+        [SortKey('created_at', descending=True), SortKey('id', descending=True)],
+        cursor=request.GET.get('cursor'), per_page=20,
+    )
+
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        rows_html = render_to_string(
+            'player/partials/transcript_rows.html', {'transcripts': page_obj}, request=request
+        )
+        return JsonResponse({
+            'rows_html': rows_html,
+            'next_cursor': page_obj.next_cursor,
+            'prev_cursor': page_obj.prev_cursor,
+        })
 
     return render(request, 'player/transcript_list.html', {'transcripts': page_obj})
 
 @login_required
-def get_transcript_status(request, track_id):
-    track = get_object_or_404(Track, pk=track_id)
-    if track.owner != request.user:
+async def get_transcript_status(request, track_id):
+    # Polled while a transcript is being made, so it is async: under ASGI
+    # the wait for the database holds no worker.
+    track = await aget_object_or_404(Track.objects.select_related('transcript'), pk=track_id)
+    user = await request.auser()
+    if track.owner_id != user.id:
         return JsonResponse({'status': 'error', 'message': 'Permission denied'}, status=403)
 
     try:
         transcript = track.transcript
-        status_html = render_to_string('player/partials/transcript_status.html', {'transcript': transcript})
-        actions_html = render_to_string('player/partials/transcript_actions.html', {
-            'transcript': transcript,
-            'track': track,
-            'show_edit_track': request.GET.get('show_edit_track') == 'true'
-        }, request=request)
-        return JsonResponse({
-            'status': transcript.status,
-            'html': status_html,
-            'actions_html': actions_html
-        })
     except Transcript.DoesNotExist:
         return JsonResponse({'status': 'none', 'html': ''})
+    # Templates rendered with the request run context processors, which may query.
+    status_html, actions_html = await sync_to_async(_transcript_status_html)(request, track, transcript)
+    return JsonResponse({
+        'status': transcript.status,
+        'html': status_html,
+        'actions_html': actions_html
+    })
+
+def _transcript_status_html(request, track, transcript):
+    status_html = render_to_string('player/partials/transcript_status.html', {'transcript': transcript})
+    actions_html = render_to_string('player/partials/transcript_actions.html', {
+        'transcript': transcript,
+        'track': track,
+        'show_edit_track': request.GET.get('show_edit_track') == 'true'
+    }, request=request)
+    return status_html, actions_html
 
 @login_required
 def get_transcript_json(request, track_id):
@@ -412,16 +545,20 @@ def get_transcript_json(request, track_id):
 
     try:
         transcript = track.transcript
-        if transcript.status != 'completed':
+        if transcript.status != 'completed' and not transcript.is_partial:
             return JsonResponse({'status': 'unavailable'})
 
-        subs = pysrt.from_string(transcript.content)
-        data = []
-        for sub in subs:
-            data.append({
-                'start': sub.start.ordinal / 1000.0,
-                'end': sub.end.ordinal / 1000.0,
-                'text': sub.text
+        data = [
+            {'start': start_ms / 1000.0, 'end': end_ms / 1000.0, 'text': text}
+            for start_ms, end_ms, text in transcript.segments.values_list('start_ms', 'end_ms', 'text')
+        ]
+        if transcript.is_partial:
+            # Long transcriptions publish each finished chunk as they go.
+            return JsonResponse({
+                'status': 'partial',
+                'transcript': data,
+                'chunks_completed': transcript.chunks_completed,
+                'chunks_total': transcript.chunks_total,
             })
         return JsonResponse({'status': 'success', 'transcript': data})
     except Transcript.DoesNotExist:
@@ -439,7 +576,8 @@ def export_transcript(request, track_id):
     if transcript.status != 'completed' or not transcript.content:
         return HttpResponse("Transcript not available for export.", status=400)
 
-    response = HttpResponse(transcript.content, content_type='application/x-subrip')
+    srt = format_srt(transcript.segments.values_list('start_ms', 'end_ms', 'text'))
+    response = HttpResponse(srt, content_type='application/x-subrip')
     response['Content-Disposition'] = f'attachment; filename="{track.name}.srt"'
     return response
 
@@ -475,14 +613,16 @@ def cancel_transcript(request, track_id):
 @login_required
 def download_track(request, track_id):
     track = get_object_or_404(Track, pk=track_id, owner=request.user)
-    return FileResponse(track.file, as_attachment=True, filename=track.file.name)
+    filename = track.file.name
+    if blob_digest(filename):
+        # Content-addressed names are just a hash.
+        filename = track.name + os.path.splitext(filename)[1]
+    return serve_file(request, track.file, filename=os.path.basename(filename), as_attachment=True)
 
 
 @login_required
 def playlist_list(request):
-    playlists = Playlist.objects.filter(
-        models.Q(owner=request.user) | models.Q(accessors=request.user)
-    ).distinct()
+    playlists = Playlist.objects.filter(pk__in=access_grants(request.user).playlist_ids)
     form = PlaylistUploadForm()
     return render(request, 'player/playlist_list.html', {
         'playlists': playlists,
@@ -504,19 +644,21 @@ def create_playlist(request):
         form = PlaylistForm(user=request.user)
     return render(request, 'player/create_playlist.html', {'form': form})
 
-def _accessible_playlists(user):
-    """Playlists a user may view/play: ones they own or are an accessor of."""
-    return Playlist.objects.filter(
-        models.Q(owner=user) | models.Q(accessors=user)
-    ).distinct()
+def _accessible_playlist(user, playlist_id):
+    """The playlist, if the user owns it or is an accessor of it; else 404."""
+    if not can_access_playlist(user, playlist_id):
+        raise Http404("No Playlist matches the given query.")
+    return get_object_or_404(Playlist, pk=playlist_id)
 
 
 @login_required
 def playlist_detail(request, playlist_id):
-    playlist = get_object_or_404(_accessible_playlists(request.user), pk=playlist_id)
+    playlist = _accessible_playlist(request.user, playlist_id)
     is_owner = playlist.owner_id == request.user.id
     # Use select_related to fetch track details efficiently to prevent N+1 queries
-    playlist_items = playlist.playlistitem_set.select_related('track', 'track__transcript').all()
+    playlist_items = playlist.playlistitem_set.select_related('track', 'track__transcript').prefetch_related(
+        _ready_renditions_prefetch()
+    )
 
     # Total length of the whole playlist (independent of any active filter)
     total_duration = playlist.playlistitem_set.aggregate(
@@ -527,17 +669,16 @@ def playlist_detail(request, playlist_id):
     title_search_query = request.GET.get('search_title') or request.GET.get('search')
 
     if title_search_query:
+        playlist_tracks = Track.objects.filter(playlistitem__playlist=playlist)
         playlist_items = playlist_items.filter(
-            models.Q(track__name__icontains=title_search_query) |
-            models.Q(track__artist__icontains=title_search_query)
+            track__in=matching_tracks(playlist_tracks, title_search_query).values('pk')
         )
 
     # Get track IDs to fetch their progress in one go
     track_ids = [item.track.id for item in playlist_items]
 
     # Fetch podcast progress for all relevant tracks
-    podcast_progress = PodcastProgress.objects.filter(user=request.user, track_id__in=track_ids)
-    podcast_progress_map = {p.track_id: p.position for p in podcast_progress}
+    podcast_progress_map = podcast_positions(request.user, track_ids)
 
     # Attach progress data to each track object
     tracks_json_data = []
@@ -554,16 +695,21 @@ def playlist_detail(request, playlist_id):
             # Ensure non-podcast tracks have default values
             track.position = 0
             track.progress_percentage = 0
+        renditions = renditions_for(track, track.ready_renditions)
+        # Written into playlistData by the template; only reversed URLs and
+        # fixed profile strings, so safe to embed.
+        track.renditions_json = json.dumps(renditions)
 
         tracks_json_data.append({
             'id': track.id,
             'name': track.name,
             'artist': track.artist,
-            'stream_url': request.build_absolute_uri(reverse('stream_track', args=[track.id])),
+            'stream_url': request.build_absolute_uri(track.get_stream_url()),
             'icon_url': request.build_absolute_uri(track.icon.url) if track.icon else None,
             'type': track.type,
             'position': track.position,
-            'duration': track.duration or 0
+            'duration': track.duration or 0,
+            'renditions': renditions,
         })
 
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
@@ -611,75 +757,97 @@ def upload_playlist(request):
         form = PlaylistUploadForm(request.POST, request.FILES)
         if form.is_valid():
             uploaded_tracks = request.FILES.getlist('tracks')
-            if not uploaded_tracks:
+            # Files sent beforehand through the resumable upload API.
+            upload_ids = request.POST.getlist('upload_ids')
+            uploads = [finished_upload(request.user, upload_id) for upload_id in upload_ids]
+            if None in uploads:
+                form.add_error(None, "One of the uploads is missing or has not finished.")
+            elif not uploaded_tracks and not uploads:
                 form.add_error(None, "Please select at least one track file.")
+            if form.errors:
                 if is_ajax:
                     return JsonResponse({'status': 'error', 'errors': form.errors.get_json_data()}, status=400)
                 return render(request, 'player/upload_playlist.html', {'form': form})
 
-            current_storage_usage = Track.objects.filter(owner=request.user).aggregate(total_size=models.Sum('file_size'))['total_size'] or 0
             total_new_size = sum(audio_file.size for audio_file in uploaded_tracks)
-            user_storage_limit_bytes = request.user.userprofile.storage_limit_gb * 1024 * 1024 * 1024
-            if current_storage_usage + total_new_size > user_storage_limit_bytes:
-                form.add_error(None, f"Uploading these tracks would exceed your {request.user.userprofile.storage_limit_gb}GB storage limit.")
+            # Checked again under the lock below; this just avoids storing
+            # files that are bound to be rejected.
+            profile = UserProfile.objects.get(user=request.user)
+            if not profile.has_room_for(total_new_size):
+                form.add_error(None, f"Uploading these tracks would exceed your {profile.storage_limit_gb}GB storage limit.")
                 if is_ajax:
                     return JsonResponse({'status': 'error', 'errors': form.errors.get_json_data()}, status=400)
                 return render(request, 'player/upload_playlist.html', {'form': form})
 
+            progress = IngestProgress(request.user.pk, request.POST.get('progress_id'), len(uploads) + len(uploaded_tracks))
+            progress.advance(len(uploads))
+            stored_names = []
             try:
+                # Files are written and probed with no transaction open...
+                image = form.cleaned_data['image']
+                image_name = store_file(Playlist._meta.get_field('image'), image) if image else None
+                default_icon = form.cleaned_data['default_track_icon']
+                # ...and the default icon is stored once, for every track to share.
+                icon_name = store_file(Track._meta.get_field('icon'), default_icon) if default_icon else None
+                stored_names += [name for name in (image_name, icon_name) if name]
+                ingested = ingest_files(uploaded_tracks, progress)
+                stored_names += [entry.name for entry in ingested]
+                ingested = [
+                    IngestedFile(upload.filename, upload.file_name, upload.metadata.get('duration') or 0, upload.length)
+                    for upload in uploads
+                ] + ingested
+
+                progress.set_stage('saving')
+                # ...so the transaction only inserts rows.
                 with transaction.atomic():
-                    playlist = Playlist.objects.create(
-                        name=form.cleaned_data['name'],
-                        owner=request.user,
-                        image=form.cleaned_data['image']
-                    )
-
-                    default_icon = form.cleaned_data['default_track_icon']
-                    default_type = form.cleaned_data['default_track_type']
-                    default_icon_bytes = None
-                    default_icon_name = None
-                    if default_icon:
-                        default_icon_bytes = default_icon.read()
-                        default_icon_name = os.path.basename(default_icon.name)
-                        default_icon.seek(0)
-
-                    for order, audio_file in enumerate(uploaded_tracks):
-                        track_name = os.path.splitext(audio_file.name)[0]
-
-                        try:
-                            audio = MutagenFile(audio_file)
-                            duration = audio.info.length if audio else 0
-                        except Exception:
-                            duration = 0
-                        finally:
-                            audio_file.seek(0)
-
-                        icon_file = None
-                        if default_icon_bytes is not None:
-                            icon_file = ContentFile(default_icon_bytes, name=default_icon_name)
-
-                        track = Track.objects.create(
-                            name=track_name,
+                    # Locked until the new tracks are counted against the quota
+                    profile = UserProfile.objects.select_for_update().get(user=request.user)
+                    if not all(consume_upload(upload) for upload in uploads):
+                        form.add_error(None, "One of the uploads has already been used.")
+                    elif not profile.has_room_for(total_new_size):
+                        form.add_error(None, f"Uploading these tracks would exceed your {profile.storage_limit_gb}GB storage limit.")
+                    if form.errors:
+                        transaction.set_rollback(True)
+                    else:
+                        playlist = Playlist.objects.create(
+                            name=form.cleaned_data['name'],
                             owner=request.user,
-                            file=audio_file,
-                            icon=icon_file,
-                            duration=duration,
-                            file_size=audio_file.size,
-                            type=default_type
-                        )
-
-                        PlaylistItem.objects.create(
-                            playlist=playlist,
-                            track=track,
-                            order=order
+                            image=image_name
                         )
+                        default_type = form.cleaned_data['default_track_type']
+                        tracks = bulk_create_tracks([
+                            Track(
+                                name=os.path.splitext(entry.filename)[0],
+                                owner=request.user,
+                                file=entry.name,
+                                icon=icon_name,
+                                duration=entry.duration,
+                                file_size=entry.file_size,
+                                type=default_type
+                            )
+                            for entry in ingested
+                        ])
+                        PlaylistItem.objects.bulk_create([
+                            PlaylistItem(playlist=playlist, track=track, order=order)
+                            for order, track in enumerate(tracks)
+                        ])
             except Exception:
                 logging.exception("Error uploading playlist")
+                delete_stored_files(stored_names)
+                progress.set_stage('failed')
                 if is_ajax:
                     return JsonResponse({'status': 'error', 'errors': {'__all__': ['An error occurred while uploading your playlist. Please try again.']}}, status=500)
                 form.add_error(None, "An error occurred while uploading your playlist. Please try again.")
                 return render(request, 'player/upload_playlist.html', {'form': form})
 
+            if form.errors:
+                delete_stored_files(stored_names)
+                progress.set_stage('failed')
+                if is_ajax:
+                    return JsonResponse({'status': 'error', 'errors': form.errors.get_json_data()}, status=400)
+                return render(request, 'player/upload_playlist.html', {'form': form})
+
+            progress.set_stage('done')
             if is_ajax:
                 return JsonResponse({'status': 'success', 'message': 'Playlist uploaded successfully!', 'redirect_url': reverse('playlist_list')})
             return redirect('playlist_list')
@@ -691,6 +859,14 @@ def upload_playlist(request):
 
     return render(request, 'player/upload_playlist.html', {'form': form})
 
+@login_required
+def upload_progress(request, progress_id):
+    """How far upload_playlist has got with the request that sent this progress_id."""
+    progress = get_progress(request.user.pk, progress_id)
+    if progress is None:
+        return JsonResponse({'status': 'error', 'message': 'No upload in progress with this id.'}, status=404)
+    return JsonResponse(progress)
+
 @login_required
 def delete_playlist(request, playlist_id):
     playlist = get_object_or_404(Playlist, pk=playlist_id, owner=request.user)
@@ -743,134 +919,80 @@ def remove_track_from_playlist(request, playlist_id, track_id):
     return JsonResponse({'status': 'success', 'message': 'Track removed from playlist.'})
 
 
-range_re = re.compile(r'bytes\s*=\s*(\d+)\s*-\s*(\d*)', re.I)
-
-class RangeFileWrapper:
-    def __init__(self, filelike, blksize=8192, offset=0, length=None):
-        self.filelike = filelike
-        self.filelike.seek(offset, os.SEEK_SET)
-        self.remaining = length
-        self.blksize = blksize
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        if self.remaining is None:
-            data = self.filelike.read(self.blksize)
-            if data:
-                return data
-            raise StopIteration()
-        else:
-            if self.remaining <= 0:
-                raise StopIteration()
-            data = self.filelike.read(min(self.remaining, self.blksize))
-            if not data:
-                raise StopIteration()
-            self.remaining -= len(data)
-            return data
-
 @csrf_exempt
 @require_POST
 @login_required
-def update_playback_state(request):
+async def update_playback_state(request):
+    """Record a single playback sample (see player.playback for the fields)."""
     try:
         data = json.loads(request.body)
-        track_id = data.get('track_id')
-        position = data.get('position')
-        playlist_id = data.get('playlist_id')
-        shuffle = data.get('shuffle', False)
-        # Optional client-side capture time (epoch ms). Sent by devices syncing
-        # progress recorded while offline; conflicts resolve newest-wins so a
-        # stale replay never overwrites fresher state written by another device.
-        recorded_at_ms = data.get('recorded_at')
-        # When replaying queued per-podcast progress, only touch PodcastProgress
-        # (and last-played), not the user's single "current track" state.
-        podcast_only = bool(data.get('podcast_only'))
-
-        if track_id is None or position is None:
+        if not isinstance(data, dict) or data.get('track_id') is None or data.get('position') is None:
             return JsonResponse({'status': 'error', 'message': 'Missing track_id or position'}, status=400)
 
-        now = timezone.now()
-        if recorded_at_ms is not None:
-            try:
-                recorded_dt = datetime.fromtimestamp(float(recorded_at_ms) / 1000.0, tz=dt_timezone.utc)
-            except (TypeError, ValueError, OverflowError, OSError):
-                recorded_dt = now
-            # A device with a fast clock must not lock out future updates.
-            if recorded_dt > now:
-                recorded_dt = now
-        else:
-            recorded_dt = now
-
-        track = get_object_or_404(
-            Track.objects.filter(
-                models.Q(owner=request.user) |
-                models.Q(playlists__accessors=request.user)
-            ).distinct(),
-            pk=track_id,
-        )
-        playlist = None
-        if playlist_id:
-            playlist = get_object_or_404(_accessible_playlists(request.user), pk=playlist_id)
-
-        applied_state = False
-        if not podcast_only:
-            existing = UserPlaybackState.objects.filter(user=request.user).first()
-            if existing is None or recorded_dt >= existing.recorded_at:
-                UserPlaybackState.objects.update_or_create(
-                    user=request.user,
-                    defaults={
-                        'track': track,
-                        'last_played_position': position,
-                        'playlist': playlist,
-                        'shuffle': shuffle,
-                        'recorded_at': recorded_dt,
-                    }
-                )
-                applied_state = True
+        # The write runs in transactions, which need a synchronous connection.
+        result = await sync_to_async(apply_playback_samples)(await request.auser(), [data])
+        if result.rejected:
+            return JsonResponse({'status': 'error', 'message': 'Track or playlist not found'}, status=404)
 
-        # Last-played timestamp only ever moves forward.
-        last_played, created = UserTrackLastPlayed.objects.get_or_create(
-            user=request.user,
-            track=track,
-            defaults={'last_played': recorded_dt}
-        )
-        if not created and recorded_dt > last_played.last_played:
-            last_played.last_played = recorded_dt
-            last_played.save(update_fields=['last_played'])
+        return JsonResponse({
+            'status': 'success',
+            'applied_state': result.applied_state,
+            'applied_podcast': bool(result.applied_podcast),
+        })
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        logging.exception("Error updating playback state")
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
-        applied_podcast = False
-        if track.type == 'podcast':
-            existing_progress = PodcastProgress.objects.filter(user=request.user, track=track).first()
-            if existing_progress is None or recorded_dt >= existing_progress.recorded_at:
-                PodcastProgress.objects.update_or_create(
-                    user=request.user,
-                    track=track,
-                    defaults={'position': position, 'recorded_at': recorded_dt}
-                )
-                applied_podcast = True
 
+@csrf_exempt
+@require_POST
+@login_required
+def sync_playback_state(request):
+    """Record a batch of playback samples, live and offline-queued alike.
+
+    Expects ``{"samples": [...]}``; the batch is collapsed to the newest
+    sample per track before anything is written.
+    """
+    try:
+        data = json.loads(request.body)
+        samples = data.get('samples') if isinstance(data, dict) else None
+        if not isinstance(samples, list):
+            return JsonResponse({'status': 'error', 'message': 'Missing samples'}, status=400)
+        if len(samples) > MAX_SAMPLES_PER_BATCH:
+            return JsonResponse({'status': 'error', 'message': f'At most {MAX_SAMPLES_PER_BATCH} samples per request'}, status=400)
+
+        result = apply_playback_samples(request.user, samples)
         return JsonResponse({
             'status': 'success',
-            'applied_state': applied_state,
-            'applied_podcast': applied_podcast,
+            'accepted': len(samples) - len(result.rejected),
+            'rejected': result.rejected,
+            'applied_state': result.applied_state,
+            'applied_podcast': result.applied_podcast,
+            'stale_podcast': result.stale_podcast,
         })
     except json.JSONDecodeError:
         return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
     except Exception as e:
-        logging.exception("Error updating playback state")
+        logging.exception("Error syncing playback state")
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
 
 @login_required
-def playlist_tracks_api(request, playlist_id):
-    playlist = get_object_or_404(_accessible_playlists(request.user), pk=playlist_id)
-    items = playlist.playlistitem_set.select_related('track').order_by('order')
+async def playlist_tracks_api(request, playlist_id):
+    user = await request.auser()
+    if not (await sync_to_async(can_access_playlist)(user, playlist_id)
+            and await Playlist.objects.filter(pk=playlist_id).aexists()):
+        raise Http404("No Playlist matches the given query.")
+    items = [
+        item async for item in
+        PlaylistItem.objects.filter(playlist_id=playlist_id).select_related('track').order_by('order')
+        .prefetch_related(_ready_renditions_prefetch())
+    ]
     track_ids = [item.track.id for item in items]
 
-    podcast_progress = PodcastProgress.objects.filter(user=request.user, track_id__in=track_ids)
-    podcast_progress_map = {p.track_id: p.position for p in podcast_progress}
+    podcast_progress_map = await sync_to_async(podcast_positions)(user, track_ids)
 
     tracks_data = []
     for item in items:
@@ -879,14 +1001,23 @@ def playlist_tracks_api(request, playlist_id):
             'id': track.id,
             'name': track.name,
             'artist': track.artist,
-            'stream_url': request.build_absolute_uri(reverse('stream_track', args=[track.id])),
+            'stream_url': request.build_absolute_uri(track.get_stream_url()),
             'icon_url': request.build_absolute_uri(track.icon.url) if track.icon else None,
             'type': track.type,
             'duration': track.duration,
-            'position': podcast_progress_map.get(track.id, 0)
+            'position': podcast_progress_map.get(track.id, 0),
+            'renditions': renditions_for(track, track.ready_renditions),
+            'hls_url': reverse('track_hls', args=[track.id]) if track.ready_renditions else None,
         })
     return JsonResponse(tracks_data, safe=False)
 
+
+def _ready_renditions_prefetch():
+    """Prefetch of each item's track's ready renditions, as ``track.ready_renditions``."""
+    return models.Prefetch(
+        'track__renditions', queryset=TrackRendition.objects.filter(status='ready'), to_attr='ready_renditions',
+    )
+
 @login_required
 @require_POST
 def delete_bookmark(request, bookmark_id):
@@ -919,7 +1050,7 @@ def play_bookmark(request, bookmark_id):
         'trackName': playback_state.track.name,
         'trackArtist': playback_state.track.artist or 'No artist',
         'trackIcon': request.build_absolute_uri(playback_state.track.icon.url) if playback_state.track.icon else None,
-        'trackStreamUrl': request.build_absolute_uri(reverse('stream_track', args=[playback_state.track.id])),
+        'trackStreamUrl': request.build_absolute_uri(playback_state.track.get_stream_url()),
         'position': playback_state.last_played_position,
         'trackType': playback_state.track.type,
         'playlist': {
@@ -941,118 +1072,197 @@ def play_bookmark(request, bookmark_id):
 def create_bookmark(request):
     form = BookmarkForm(request.POST)
     if form.is_valid():
-        try:
-            playback_state = UserPlaybackState.objects.get(user=request.user)
-            bookmark = form.save(commit=False)
-            bookmark.user = request.user
-            bookmark.track = playback_state.track
-            bookmark.position = playback_state.last_played_position
-            bookmark.shuffle = playback_state.shuffle
-            bookmark.playlist = playback_state.playlist
-            bookmark.save()
-
-            bookmark_item_html = render_to_string(
-                'player/partials/bookmark_item.html',
-                {'bookmark': bookmark}
-            )
-
-            return JsonResponse({
-                'status': 'success',
-                'message': 'Bookmark created.',
-                'bookmark_item_html': bookmark_item_html,
-            })
-        except UserPlaybackState.DoesNotExist:
+        playback_state = current_playback_state(request.user)
+        if playback_state is None:
             return JsonResponse({'status': 'error', 'message': 'No current playback state to bookmark.'}, status=404)
+
+        bookmark = form.save(commit=False)
+        bookmark.user = request.user
+        bookmark.track = playback_state.track
+        bookmark.position = playback_state.last_played_position
+        bookmark.shuffle = playback_state.shuffle
+        bookmark.playlist = playback_state.playlist
+        bookmark.save()
+
+        bookmark_item_html = render_to_string(
+            'player/partials/bookmark_item.html',
+            {'bookmark': bookmark}
+        )
+
+        return JsonResponse({
+            'status': 'success',
+            'message': 'Bookmark created.',
+            'bookmark_item_html': bookmark_item_html,
+        })
     else:
         return JsonResponse({'status': 'error', 'errors': form.errors}, status=400)
 
 
 @login_required
-def search_transcripts(request):
+async def search_transcripts(request):
     query = request.GET.get('q')
     playlist_id = request.GET.get('playlist_id')
     if not query or len(query) < 2:
         return JsonResponse([], safe=False)
 
-    # Filter transcripts the user can reach: their own tracks, or tracks in a
-    # playlist they have been granted access to.
-    transcripts_query = Transcript.objects.filter(
-        models.Q(track__owner=request.user) |
-        models.Q(track__playlists__accessors=request.user),
-        content__icontains=query,
-    ).distinct()
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        page = 1
 
+    # Only segments of transcripts the user can reach: their own tracks, or
+    # tracks in a playlist they have been granted access to.
+    tracks = Track.objects.accessible_by(await request.auser())
     if playlist_id:
-        transcripts_query = transcripts_query.filter(track__playlistitem__playlist_id=playlist_id)
+        tracks = tracks.filter(playlistitem__playlist_id=playlist_id)
+
+    # The search runs raw SQL and several queries; it gets a thread.
+    hits, has_next = await sync_to_async(search_segments)(query, tracks, page)
 
     results = []
-    # Limit to top 5 transcripts to avoid excessive SRT parsing in one request
-    # or we can parse all but limit the total number of segments.
-    for transcript in transcripts_query.select_related('track')[:10]:
-        try:
-            subs = pysrt.from_string(transcript.content)
-            for sub in subs:
-                if query.lower() in sub.text.lower():
-                    results.append({
-                        'track_id': transcript.track.id,
-                        'track_name': transcript.track.name,
-                        'track_artist': transcript.track.artist,
-                        'track_icon': request.build_absolute_uri(transcript.track.icon.url) if transcript.track.icon else None,
-                        'track_stream_url': request.build_absolute_uri(reverse('stream_track', args=[transcript.track.id])),
-                        'track_type': transcript.track.type,
-                        'track_duration': transcript.track.duration,
-                        'start_time': sub.start.ordinal / 1000.0,
-                        'text': sub.text.replace('\n', ' '),
-                        'start_time_formatted': str(sub.start).split(',')[0] # HH:MM:SS
-                    })
-                    if len(results) >= 20: # Limit total results
-                        break
-            if len(results) >= 20:
-                break
-        except Exception as e:
-            logging.error(f"Error parsing transcript {transcript.id}: {e}")
+    for hit in hits:
+        segment = hit.segment
+        track = segment.transcript.track
+        results.append({
+            'track_id': track.id,
+            'track_name': track.name,
+            'track_artist': track.artist,
+            'track_icon': request.build_absolute_uri(track.icon.url) if track.icon else None,
+            'track_stream_url': request.build_absolute_uri(track.get_stream_url()),
+            'track_type': track.type,
+            'track_duration': track.duration,
+            'start_time': segment.start_ms / 1000.0,
+            'text': segment.text.replace('\n', ' '),
+            'snippet': hit.snippet.replace('\n', ' '),  # HTML-escaped, matches in <mark>
+            'start_time_formatted': format_clock(segment.start_ms),  # HH:MM:SS
+        })
 
+    response = JsonResponse(results, safe=False)
+    # The body stays a plain list; further pages are advertised in a header.
+    if has_next:
+        response['X-Next-Page'] = str(page + 1)
+    return response
+
+
+@login_required
+def track_typeahead(request):
+    """Top matches by name/artist among tracks the user can play, as they type."""
+    query = request.GET.get('q', '')
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), 20)
+    except ValueError:
+        limit = 8
+
+    results = []
+    for track in rank_tracks(Track.objects.accessible_by(request.user), query, limit):
+        results.append({
+            'id': track.id,
+            'name': track.name,
+            'artist': track.artist,
+            'type': track.type,
+            'icon': request.build_absolute_uri(track.icon.url) if track.icon else None,
+            'stream_url': request.build_absolute_uri(track.get_stream_url()),
+            'duration': track.duration,
+        })
     return JsonResponse(results, safe=False)
 
 
 @login_required
-def stream_track(request, track_id):
+def recently_played_api(request):
+    """Tracks the user can play, most recently played first, a page at a time.
+
+    Pass the returned ``next_cursor`` as ``cursor`` for the following page.
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 50)
+    except ValueError:
+        limit = 10
+
+    # A semi-join rather than accessible_by's DISTINCT, so the page is read
+    # off the last-played index and each row merely checked for access.
+    tracks = Track.objects.filter(pk__in=Track.objects.accessible_by(request.user).values('pk'))
+    page = keyset_page(
+        played_tracks(request.user, tracks), LAST_PLAYED_KEYS, cursor=request.GET.get('cursor'), per_page=limit,
+    )
+    podcast_progress_map = podcast_positions(request.user, [track.id for track in page])
+
+    results = []
+    for track in page:
+        results.append({
+            'id': track.id,
+            'name': track.name,
+            'artist': track.artist,
+            'type': track.type,
+            'icon': request.build_absolute_uri(track.icon.url) if track.icon else None,
+            'stream_url': request.build_absolute_uri(track.get_stream_url()),
+            'duration': track.duration,
+            'position': podcast_progress_map.get(track.id, 0),
+            'last_played': track.user_last_played.isoformat(),
+        })
+    return JsonResponse({'tracks': results, 'next_cursor': page.next_cursor})
+
+
+def _streamable_track_media(user, track_id):
     # The owner can stream any of their tracks; accessors can stream tracks
     # that belong to a playlist they have been granted access to.
-    track = get_object_or_404(
-        Track.objects.filter(
-            models.Q(owner=request.user) |
-            models.Q(playlists__accessors=request.user)
-        ).distinct(),
-        pk=track_id,
-    )
-    path = track.file.path
-    size = os.path.getsize(path)
-    content_type, _ = mimetypes.guess_type(path)
-    content_type = content_type or 'application/octet-stream'
-
-    range_header = request.META.get('HTTP_RANGE', '').strip()
-    range_match = range_re.match(range_header)
-    print("Range header raw:", request.META.get('HTTP_RANGE'))
-    print("Range regex match:", bool(range_match))
-
-    if range_match:
-        first_byte, last_byte = range_match.groups()
-        first_byte = int(first_byte) if first_byte else 0
-        last_byte = int(last_byte) if last_byte else size - 1
-        if last_byte >= size:
-            last_byte = size - 1
-        length = last_byte - first_byte + 1
-
-        # Use the custom RangeFileWrapper for ranged requests
-        f = open(path, 'rb')
-        response = StreamingHttpResponse(RangeFileWrapper(f, offset=first_byte, length=length), status=206, content_type=content_type)
-        response['Content-Length'] = str(length)
-        response['Content-Range'] = f'bytes {first_byte}-{last_byte}/{size}'
-    else:
-        # Use StreamingHttpResponse for non-range requests as well for consistency
-        response = StreamingHttpResponse(open(path, 'rb'), content_type=content_type)
-        response['Content-Length'] = str(size)
+    # Checked against cached grants and a cached description of the file
+    # (player.media_cache), so a range request runs no query and no stat.
+    return track_media(track_id) if can_access_track(user, track_id) else None
+
+@login_required
+async def stream_track(request, track_id):
+    # Async so that, under ASGI, a long stream holds no worker: the body is
+    # read in threads as the client takes it (see player.streaming). Opening
+    # the file blocks too, so the response is built in a thread as well.
+    entry = await sync_to_async(_streamable_track_media)(await request.auser(), track_id)
+    if entry is None:
+        raise Http404("No Track matches the given query.")
+    try:
+        response = await asyncio.to_thread(
+            serve_file, request, entry.media, immutable=request.GET.get('v') == entry.version,
+        )
+    except FileNotFoundError:
+        # The entry describes a file that has been replaced (by a remux,
+        # say) and deleted since; describe the track's file as it is now.
+        entry = await sync_to_async(track_media)(track_id, refresh=True)
+        if entry is None:
+            raise Http404("No Track matches the given query.")
+        response = await asyncio.to_thread(
+            serve_file, request, entry.media, immutable=request.GET.get('v') == entry.version,
+        )
+    if entry.hls_url:
+        response['Link'] = f'<{entry.hls_url}>; rel="alternate"; type="application/vnd.apple.mpegurl"'
+    return response
+
+
+def _ready_renditions(user, track_id):
+    if not can_access_track(user, track_id):
+        raise Http404("No Track matches the given query.")
+    return list(TrackRendition.objects.filter(track_id=track_id, status='ready'))
 
-    response['Accept-Ranges'] = 'bytes'
+@login_required
+async def track_hls(request, track_id):
+    """HLS master playlist offering the track's renditions (see player.renditions)."""
+    renditions = await sync_to_async(_ready_renditions)(await request.auser(), track_id)
+    playlist = hls_master_playlist(Track(pk=track_id), renditions)
+    if playlist is None:
+        raise Http404("This track has no renditions yet.")
+    response = HttpResponse(playlist, content_type=CONTENT_TYPES['.m3u8'])
+    response['Cache-Control'] = REVALIDATE_CACHE_CONTROL
     return response
+
+@login_required
+async def rendition_file(request, track_id, rendition_id, name):
+    """A rendition's progressive file, HLS playlist or segment."""
+    renditions = await sync_to_async(_ready_renditions)(await request.auser(), track_id)
+    rendition = next((r for r in renditions if r.pk == rendition_id), None)
+    if rendition is None or not FILE_NAME_RE.fullmatch(name):
+        raise Http404("No such rendition file.")
+    try:
+        media = await asyncio.to_thread(describe_path, f'{rendition.directory}/{name}')
+    except FileNotFoundError:
+        raise Http404("No such rendition file.")
+    # The directory is never reused, so its files never change.
+    return await asyncio.to_thread(
+        serve_file, request, media, content_type=CONTENT_TYPES[os.path.splitext(name)[1]], immutable=True,
+    )
@@ -252,12 +252,25 @@
             artist: t.artist || '',
             icon_url: t.icon_url || '',
             stream_url: t.stream_url,
+            renditions: t.renditions || [],
             type: t.type || 'song',
             duration: parseFloat(t.duration) || 0,
         };
     }
 
+    // The smallest rendition this browser can play (renditions come lowest
+    // bitrate first), else the original.
+    function downloadUrl(track) {
+        const probe = document.createElement('audio');
+        const rendition = (track.renditions || []).find(function (r) {
+            return probe.canPlayType(r.mime_type) !== '';
+        });
+        return rendition ? rendition.url : track.stream_url;
+    }
+
     // Download one track into IndexedDB. Silent (no toasts); returns success.
+    // The audio is stored under the stream URL whichever file was fetched,
+    // so the service worker answers the player's requests for it.
     async function downloadAndStore(track) {
         const id = track.id;
         if (progress.has(id)) return false;
@@ -266,7 +279,7 @@
         let success = false;
         try {
             let lastEmit = 0;
-            const result = await fetchWithProgress(track.stream_url, function (loaded, total) {
+            const result = await fetchWithProgress(downloadUrl(track), function (loaded, total) {
                 const now = Date.now();
                 if (loaded < total && now - lastEmit < 150) return; // throttle UI updates
                 lastEmit = now;
@@ -327,7 +340,7 @@
 
     // ---- Whole-playlist save / remove -----------------------------------------
     // The playlist page exposes its tracks as `window.playlistData`
-    // (id, name, artist, stream_url, icon_url, type, duration).
+    // (id, name, artist, stream_url, icon_url, type, duration, renditions).
     let playlistSaveState = { active: false, done: 0, total: 0, currentId: null };
 
     function getPlaylistTracks() {
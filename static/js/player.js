@@ -226,7 +226,36 @@ document.addEventListener('DOMContentLoaded', function() {
 
 
     // --- PLAYBACK STATE MANAGEMENT ---
-    async function savePlaybackState() {
+    // Each second of playback is recorded on-device and queued as a sample;
+    // queued samples reach the server in one batched request. The queue is
+    // flushed right away on pause, track change, seek and page hide, and on a
+    // relaxed cadence during steady playback, backing off while the server
+    // is unreachable.
+    const FLUSH_INTERVAL_PLAYING = 15000;
+    const FLUSH_INTERVAL_MAX = 5 * 60 * 1000;
+    const SEEK_FLUSH_DELAY = 2000;
+    // Newest unsent sample per track id (the server keeps the newest anyway).
+    let pendingSamples = {};
+    let flushTimer = null;
+    let flushInFlight = false;
+    let flushFailures = 0;
+
+    function scheduleFlush(delay) {
+        if (flushTimer) clearTimeout(flushTimer);
+        flushTimer = setTimeout(function () {
+            flushTimer = null;
+            flushPlaybackSamples();
+        }, delay);
+    }
+
+    function nextFlushDelay() {
+        if (flushFailures > 0) {
+            return Math.min(FLUSH_INTERVAL_PLAYING * Math.pow(2, flushFailures), FLUSH_INTERVAL_MAX);
+        }
+        return FLUSH_INTERVAL_PLAYING;
+    }
+
+    async function recordPlaybackSample() {
         if (!currentTrack || isNaN(audioPlayer.currentTime)) return;
 
         const position = audioPlayer.currentTime;
@@ -236,9 +265,17 @@ document.addEventListener('DOMContentLoaded', function() {
         }
         const recordedAt = Date.now();
 
+        pendingSamples[currentTrack.id] = {
+            track_id: currentTrack.id,
+            track_type: currentTrack.type,
+            position: position,
+            playlist_id: currentPlaylist ? currentPlaylist.id : null,
+            shuffle: isShuffle,
+            recorded_at: recordedAt
+        };
+
         // Local-first: persist on-device so listening progress made while
         // offline is never lost.
-        let wroteLocal = false;
         if (syncDB && syncUserId) {
             try {
                 await syncDB.putSync({
@@ -269,49 +306,114 @@ document.addEventListener('DOMContentLoaded', function() {
                         synced: false
                     });
                 }
-                wroteLocal = true;
             } catch (e) { /* local persistence is best-effort */ }
         }
+    }
 
-        try {
-            const response = await fetch('/api/update_playback_state/', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json', 'X-CSRFToken': csrftoken },
-                body: JSON.stringify({
-                    track_id: currentTrack.id,
-                    position: position,
-                    playlist_id: currentPlaylist ? currentPlaylist.id : null,
-                    shuffle: isShuffle,
-                    recorded_at: recordedAt
-                })
-            });
-            if (response.ok && wroteLocal) {
-                syncDB.markSynced('playbackState', recordedAt);
-                if (currentTrack.type === 'podcast') {
-                    syncDB.markSynced('podcast:' + currentTrack.id, recordedAt);
+    function takePendingSamples() {
+        const samples = Object.values(pendingSamples);
+        pendingSamples = {};
+        return samples;
+    }
+
+    function samplesPayload(samples) {
+        return JSON.stringify({
+            samples: samples.map(function (s) {
+                return {
+                    track_id: s.track_id,
+                    position: s.position,
+                    playlist_id: s.playlist_id,
+                    shuffle: s.shuffle,
+                    recorded_at: s.recorded_at
+                };
+            })
+        });
+    }
+
+    async function markSamplesSynced(samples) {
+        if (!syncDB || !syncUserId) return;
+        for (const s of samples) {
+            await syncDB.markSynced('playbackState', s.recorded_at);
+            if (s.track_type === 'podcast') {
+                await syncDB.markSynced('podcast:' + s.track_id, s.recorded_at);
+            }
+        }
+    }
+
+    async function flushPlaybackSamples() {
+        if (flushInFlight) return;
+        const samples = takePendingSamples();
+        if (samples.length) {
+            flushInFlight = true;
+            try {
+                const response = await fetch('/api/sync_playback_state/', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json', 'X-CSRFToken': csrftoken },
+                    body: samplesPayload(samples)
+                });
+                // A 4xx means the batch itself is bad; retrying won't help.
+                if (response.ok || (response.status >= 400 && response.status < 500 && response.status !== 403)) {
+                    flushFailures = 0;
+                    if (response.ok) await markSamplesSynced(samples);
+                } else {
+                    throw new Error('Playback sync failed: ' + response.status);
                 }
+            } catch (error) {
+                // Offline or server unreachable: requeue anything not
+                // superseded meanwhile. The unsynced local copies are also
+                // replayed by syncOfflinePlayback() when connectivity returns.
+                flushFailures += 1;
+                samples.forEach(function (s) {
+                    const newer = pendingSamples[s.track_id];
+                    if (!newer || newer.recorded_at < s.recorded_at) pendingSamples[s.track_id] = s;
+                });
+            } finally {
+                flushInFlight = false;
             }
-        } catch (error) {
-            // Offline or server unreachable: the unsynced local copy will be
-            // replayed by syncOfflinePlayback() when connectivity returns.
         }
+        if (audioPlayer && !audioPlayer.paused) {
+            scheduleFlush(nextFlushDelay());
+        }
+    }
+
+    // Record the current position and send it now (pause, track change...).
+    async function savePlaybackState() {
+        await recordPlaybackSample();
+        await flushPlaybackSamples();
     }
 
-    // Replay playback state captured while offline. The server compares each
-    // record's recorded_at against what it already has and keeps the newer
-    // one, so replaying stale data can never clobber progress made on
-    // another device in the meantime.
+    // Last-chance delivery when the page is hidden or unloaded; a beacon
+    // survives the page going away where fetch() may not.
+    function beaconPlaybackState() {
+        if (!currentTrack || isNaN(audioPlayer.currentTime)) return;
+        recordPlaybackSample();
+        const samples = takePendingSamples();
+        if (!samples.length) return;
+        const sent = navigator.sendBeacon && navigator.sendBeacon(
+            '/api/sync_playback_state/',
+            new Blob([samplesPayload(samples)], { type: 'application/json' })
+        );
+        if (!sent) {
+            samples.forEach(function (s) { pendingSamples[s.track_id] = s; });
+            flushPlaybackSamples();
+        }
+    }
+
+    // Replay playback state captured while offline, in a single batch. The
+    // server compares each record's recorded_at against what it already has
+    // and keeps the newer one, so replaying stale data can never clobber
+    // progress made on another device in the meantime.
     let playbackSyncInFlight = false;
     async function syncOfflinePlayback() {
         if (playbackSyncInFlight || !syncDB || !syncUserId || navigator.onLine === false) return;
         playbackSyncInFlight = true;
         try {
-            const entries = (await syncDB.getAllSync()).filter(function (e) {
-                return e.userId === syncUserId && !e.synced;
-            });
-            for (const entry of entries) {
+            const entries = [];
+            const samples = [];
+            (await syncDB.getAllSync()).forEach(function (entry) {
+                if (entry.userId !== syncUserId || entry.synced) return;
                 const isPodcast = entry.key.indexOf('podcast:') === 0;
-                const body = isPodcast
+                const sample = isPodcast
                     ? {
                         track_id: entry.trackId,
                         position: entry.position,
@@ -325,26 +427,35 @@ document.addEventListener('DOMContentLoaded', function() {
                         shuffle: entry.shuffle,
                         recorded_at: entry.recordedAt
                     };
-                if (body.track_id == null) {
-                    await syncDB.markSynced(entry.key, entry.recordedAt);
-                    continue;
+                if (sample.track_id == null) {
+                    syncDB.markSynced(entry.key, entry.recordedAt);
+                    return;
                 }
-                const response = await fetch('/api/update_playback_state/', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json', 'X-CSRFToken': csrftoken },
-                    body: JSON.stringify(body)
-                });
-                if (!response.ok) {
-                    // Track deleted / bad record: drop it. Anything else
-                    // (auth, server error) stays queued for a later retry.
-                    if (response.status === 404 || response.status === 400) {
-                        await syncDB.markSynced(entry.key, entry.recordedAt);
-                    }
-                    continue;
+                entries.push(entry);
+                samples.push(sample);
+            });
+            if (!samples.length) return;
+
+            const response = await fetch('/api/sync_playback_state/', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json', 'X-CSRFToken': csrftoken },
+                body: JSON.stringify({ samples: samples })
+            });
+            if (!response.ok) {
+                // Malformed batch: drop it. Anything else (auth, server
+                // error) stays queued for a later retry.
+                if (response.status === 400) {
+                    for (const entry of entries) await syncDB.markSynced(entry.key, entry.recordedAt);
                 }
-                const data = await response.json();
+                return;
+            }
+            // Rejected samples (track deleted / access revoked) are dropped
+            // along with the applied ones.
+            const data = await response.json();
+            const stale = new Set(data.stale_podcast || []);
+            for (const entry of entries) {
                 await syncDB.markSynced(entry.key, entry.recordedAt);
-                if (isPodcast && data.applied_podcast === false) {
+                if (entry.key.indexOf('podcast:') === 0 && stale.has(entry.trackId)) {
                     // The cloud had fresher progress for this podcast; stop
                     // preferring our stale local position.
                     delete localPodcastOverrides[entry.trackId];
@@ -465,27 +576,53 @@ document.addEventListener('DOMContentLoaded', function() {
         audioPlayer.removeAttribute('src'); // Fully disassociate the old source
         audioPlayer.load(); // This resets the media element
 
-        // 2. Set the new source
-        audioPlayer.src = track.stream_url;
-
-        // 3. Load the new source
-        audioPlayer.load();
-
-        // 4. Play and then seek
-        // The play() method returns a promise. We wait for it to resolve before seeking.
-        // This is the most reliable way to ensure the player is ready for a seek command.
-        const playPromise = audioPlayer.play();
-        if (playPromise !== undefined) {
-            playPromise.then(_ => {
-                // Playback has started, now it's safe to seek.
-                audioPlayer.currentTime = startPosition;
-            }).catch(error => {
-                // Autoplay was prevented.
-                console.error("Playback was prevented:", error);
-                // We can't automatically start, but we can still set the time for when the user clicks play.
-                audioPlayer.currentTime = startPosition;
-            });
+        playbackUrl(track).then(url => {
+            // Another track was picked while we were choosing.
+            if (currentTrack !== track) return;
+
+            // 2. Set the new source
+            audioPlayer.src = url;
+
+            // 3. Load the new source
+            audioPlayer.load();
+
+            // 4. Play and then seek
+            // The play() method returns a promise. We wait for it to resolve before seeking.
+            // This is the most reliable way to ensure the player is ready for a seek command.
+            const playPromise = audioPlayer.play();
+            if (playPromise !== undefined) {
+                playPromise.then(_ => {
+                    // Playback has started, now it's safe to seek.
+                    audioPlayer.currentTime = startPosition;
+                }).catch(error => {
+                    // Autoplay was prevented.
+                    console.error("Playback was prevented:", error);
+                    // We can't automatically start, but we can still set the time for when the user clicks play.
+                    audioPlayer.currentTime = startPosition;
+                });
+            }
+        });
+    }
+
+    // The lowest-bitrate rendition this browser can play, or null.
+    function playableRendition(track) {
+        return (track.renditions || []).find(r => audioPlayer.canPlayType(r.mime_type) !== '') || null;
+    }
+
+    // On Save-Data or a cellular-grade connection, play a low-bitrate
+    // rendition instead of the original, unless the original is saved
+    // offline (the service worker serves that without the network).
+    async function playbackUrl(track) {
+        const connection = navigator.connection;
+        const constrained = connection && (connection.saveData || /^(slow-2g|2g|3g)$/.test(connection.effectiveType || ''));
+        const rendition = constrained ? playableRendition(track) : null;
+        if (!rendition) return track.stream_url;
+        if (syncDB) {
+            try {
+                if (await syncDB.getTrack(parseInt(track.id, 10))) return track.stream_url;
+            } catch (e) { /* no offline store; fall through */ }
         }
+        return rendition.url;
     }
 
     function playNextTrack() {
@@ -594,7 +731,8 @@ document.addEventListener('DOMContentLoaded', function() {
         audioPlayer.addEventListener('play', () => {
             if (playPauseBtn) playPauseBtn.innerHTML = '<i class="fas fa-pause"></i>';
             if (saveInterval) clearInterval(saveInterval);
-            saveInterval = setInterval(savePlaybackState, 1000);
+            saveInterval = setInterval(recordPlaybackSample, 1000);
+            scheduleFlush(nextFlushDelay());
             if ('mediaSession' in navigator) {
                 navigator.mediaSession.playbackState = 'playing';
             }
@@ -603,6 +741,7 @@ document.addEventListener('DOMContentLoaded', function() {
         audioPlayer.addEventListener('pause', () => {
             if (playPauseBtn) playPauseBtn.innerHTML = '<i class="fas fa-play"></i>';
             clearInterval(saveInterval);
+            if (flushTimer) clearTimeout(flushTimer);
             savePlaybackState();
             if ('mediaSession' in navigator) {
                 navigator.mediaSession.playbackState = 'paused';
@@ -618,6 +757,13 @@ document.addEventListener('DOMContentLoaded', function() {
             playNextTrack();
         });
 
+        audioPlayer.addEventListener('seeked', () => {
+            if (audioPlayer.paused) return;
+            // Scrubbing fires many seeks; send the final position shortly after.
+            recordPlaybackSample();
+            scheduleFlush(SEEK_FLUSH_DELAY);
+        });
+
         audioPlayer.addEventListener('timeupdate', () => {
             if (!audioPlayer.duration || !currentTrack) return;
             const currentTime = audioPlayer.currentTime;
@@ -852,7 +998,10 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
-    window.addEventListener('beforeunload', savePlaybackState);
+    window.addEventListener('pagehide', beaconPlaybackState);
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'hidden') beaconPlaybackState();
+    });
     if (skipBackBtn) skipBackBtn.addEventListener('click', () => { if (audioPlayer && audioPlayer.src) audioPlayer.currentTime = Math.max(0, audioPlayer.currentTime - 15); });
     if (skipForwardBtn) skipForwardBtn.addEventListener('click', () => { if (audioPlayer && audioPlayer.src) audioPlayer.currentTime = Math.min(audioPlayer.duration, audioPlayer.currentTime + 15); });
     if (playbackSpeed) playbackSpeed.addEventListener('change', () => { if (audioPlayer && audioPlayer.src) audioPlayer.playbackRate = parseFloat(playbackSpeed.value); });
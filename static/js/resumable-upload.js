@@ -0,0 +1,146 @@
+/*
+ * Client for the resumable upload API (/api/uploads/, see player/uploads.py).
+ *
+ * Sends a file in CHUNK_SIZE PATCH requests, each with a SHA-256
+ * Upload-Checksum where the browser can compute one. A failed chunk is
+ * retried after asking the server (HEAD) how much it already has, with
+ * exponential backoff. The upload URL is kept in localStorage so choosing
+ * the same file again after a reload carries on where it stopped.
+ */
+const ResumableUpload = (function () {
+    const ENDPOINT = '/api/uploads/';
+    const CHUNK_SIZE = 5 * 1024 * 1024;
+    const MAX_RETRIES = 6;
+    const STORAGE_PREFIX = 'resumable-upload:';
+
+    function csrfToken() {
+        const match = document.cookie.match(/(?:^|;\s*)csrftoken=([^;]+)/);
+        return match ? decodeURIComponent(match[1]) : '';
+    }
+
+    function storageKey(file) {
+        return STORAGE_PREFIX + [file.name, file.size, file.lastModified].join(':');
+    }
+
+    function encodeMetadata(value) {
+        return btoa(unescape(encodeURIComponent(value)));
+    }
+
+    function sleep(ms) {
+        return new Promise(resolve => setTimeout(resolve, ms));
+    }
+
+    async function request(method, url, headers, body) {
+        return fetch(url, {
+            method: method,
+            credentials: 'same-origin',
+            headers: Object.assign({'Tus-Resumable': '1.0.0', 'X-CSRFToken': csrfToken()}, headers),
+            body: body,
+        });
+    }
+
+    async function errorMessage(response) {
+        try {
+            return (await response.json()).message;
+        } catch (err) {
+            return `Server returned status ${response.status}.`;
+        }
+    }
+
+    async function checksum(blob) {
+        if (!(window.crypto && crypto.subtle)) {
+            return null;  // Only available in secure contexts.
+        }
+        const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+        return 'sha256 ' + btoa(String.fromCharCode(...new Uint8Array(digest)));
+    }
+
+    async function currentOffset(url) {
+        const response = await request('HEAD', url, {});
+        if (!response.ok) {
+            return null;
+        }
+        return parseInt(response.headers.get('Upload-Offset'), 10);
+    }
+
+    async function create(file) {
+        const response = await request('POST', ENDPOINT, {
+            'Upload-Length': String(file.size),
+            'Upload-Metadata': 'filename ' + encodeMetadata(file.name),
+        });
+        if (response.status !== 201) {
+            throw new Error(await errorMessage(response));
+        }
+        return response.headers.get('Location');
+    }
+
+    /*
+     * Upload ``file``; resolves to the finished upload's description
+     * ({id, filename, length, metadata: {duration, title, artist}}).
+     * ``onProgress(bytesSent, totalBytes)`` is called after every chunk.
+     */
+    async function upload(file, onProgress) {
+        const key = storageKey(file);
+        let url = localStorage.getItem(key);
+        let offset = url ? await currentOffset(url) : null;
+        if (offset === null) {
+            url = await create(file);
+            localStorage.setItem(key, url);
+            offset = 0;
+        }
+
+        let failures = 0;
+        while (offset < file.size) {
+            const chunk = file.slice(offset, offset + CHUNK_SIZE);
+            const headers = {
+                'Content-Type': 'application/offset+octet-stream',
+                'Upload-Offset': String(offset),
+            };
+            const digest = await checksum(chunk);
+            if (digest) {
+                headers['Upload-Checksum'] = digest;
+            }
+
+            let response = null;
+            try {
+                response = await request('PATCH', url, headers, chunk);
+            } catch (err) {
+                // Network failure; fall through to the retry below.
+            }
+            if (response && response.status === 204) {
+                offset = parseInt(response.headers.get('Upload-Offset'), 10);
+                failures = 0;
+                if (onProgress) {
+                    onProgress(offset, file.size);
+                }
+                continue;
+            }
+            if (response && [400, 403, 404, 413, 415].includes(response.status)) {
+                localStorage.removeItem(key);
+                throw new Error(await errorMessage(response));
+            }
+
+            failures += 1;
+            if (failures > MAX_RETRIES) {
+                throw new Error('The upload keeps failing. Please check your connection and try again.');
+            }
+            await sleep(Math.min(30000, 500 * 2 ** failures));
+            const serverOffset = await currentOffset(url).catch(() => null);
+            if (serverOffset === null) {
+                localStorage.removeItem(key);
+                throw new Error('The upload was lost on the server. Please try again.');
+            }
+            offset = serverOffset;
+        }
+
+        localStorage.removeItem(key);
+        const response = await fetch(url, {credentials: 'same-origin'});
+        return response.json();
+    }
+
+    function isSupported() {
+        return !!(window.fetch && window.Blob && Blob.prototype.slice && window.localStorage);
+    }
+
+    return {upload: upload, isSupported: isSupported, CHUNK_SIZE: CHUNK_SIZE};
+})();